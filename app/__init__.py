@@ -1,4 +1,5 @@
-from fastapi import FastAPI
+import time
+from fastapi import FastAPI, Request
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 import tushare as ts
@@ -7,12 +8,39 @@ from app.config import Config
 # 确保必要的目录和文件存在
 Config.ensure_directories()
 
+# 日志经队列由后台线程输出，不阻塞请求
+from app.services.logging_setup import setup_logging
+setup_logging()
+
 # 创建FastAPI实例
 app = FastAPI()
 
-# 设置tushare token
+# 设置tushare token，所有接口调用经过限流包装；启用录制/回放时在限流之下加一层Cassette
+from app.services.tushare_client import TushareClient
+from app.services.cassette import Cassette
 ts.set_token(Config.TUSHARE_TOKEN)
-pro = ts.pro_api()
+_tushare_api = ts.pro_api()
+if Config.TUSHARE_CASSETTE_MODE:
+    _tushare_api = Cassette(_tushare_api, Config.TUSHARE_CASSETTE_MODE, Config.TUSHARE_CASSETTE_DIR)
+pro = TushareClient(_tushare_api)
+
+# 记录每个请求的耗时，并把路由模板设为当前上下文的接口标签，请求内的上游调用和缓存读写按接口归类
+from app.services.metrics import HTTP_LATENCY, set_endpoint, reset_endpoint, resolve_endpoint
+
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    endpoint = resolve_endpoint(app, request.scope)
+    token = set_endpoint(endpoint)
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        HTTP_LATENCY.observe(time.perf_counter() - start, endpoint=endpoint, method=request.method, status=status)
+        reset_endpoint(token)
 
 # Mount static files
 app.mount("/static", StaticFiles(directory=Config.STATIC_DIR), name="static")
@@ -22,4 +50,12 @@ templates = Jinja2Templates(directory=Config.TEMPLATES_DIR)
 
 # 导入路由
 from app.api import stock_routes
-app.include_router(stock_routes.router) 
\ No newline at end of file
+app.include_router(stock_routes.router)
+
+# 后台刷新任务和AI分析任务随应用启动，退出时先停止任务再关闭上游调用线程池
+from app.services.executor import shutdown_executors
+app.add_event_handler("startup", stock_routes.scheduler.start)
+app.add_event_handler("startup", stock_routes.ai_jobs.start)
+app.add_event_handler("shutdown", stock_routes.scheduler.stop)
+app.add_event_handler("shutdown", stock_routes.ai_jobs.stop)
+app.add_event_handler("shutdown", shutdown_executors) 
\ No newline at end of file
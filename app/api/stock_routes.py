@@ -1,24 +1,44 @@
+import asyncio
 from fastapi import APIRouter, Request, Form
+from fastapi.responses import StreamingResponse, PlainTextResponse
 from typing import Optional
 from app.services.stock_service import StockService
 from app.services.ai_analysis_service import AIAnalysisService
-from app import templates
+from app.services.executor import run_blocking, iterate_blocking, TUSHARE, LLM, LOCAL
+from app.services.scheduler import RefreshScheduler
+from app.services.push_service import PushHub
+from app.services.ai_jobs import AIJobQueue
+from app.services.screener import Screener
+from app.services.alert_engine import AlertEngine
+from app.services.metrics import REGISTRY
+from app import templates, pro
 
 router = APIRouter(prefix="")
 stock_service = StockService()
 ai_service = AIAnalysisService()
+push_hub = PushHub()
+screener = Screener(stock_service.symbols, stock_service.session)
+alerts = AlertEngine.from_config(stock_service.cache_store)
+scheduler = RefreshScheduler(stock_service, push_hub, screener, alerts)
+ai_jobs = AIJobQueue(stock_service, ai_service)
 
 @router.get("/")
 async def home(request: Request):
     return templates.TemplateResponse("index.html", {"request": request})
 
+@router.get("/api/stock_info/batch")
+async def get_stock_info_batch(codes: Optional[str] = None, force_refresh: bool = False):
+    """批量获取股票数据，codes为逗号分隔的股票代码，不传则刷新整个监控列表"""
+    stock_codes = [code.strip() for code in codes.split(',') if code.strip()] if codes else list(stock_service.watchlist_snapshot())
+    return await run_blocking(TUSHARE, stock_service.get_stock_info_many, stock_codes, force_refresh)
+
 @router.get("/api/stock_info/{stock_code}")
 async def get_stock_info(stock_code: str, force_refresh: bool = False):
-    return stock_service.get_stock_info(stock_code, force_refresh)
+    return await run_blocking(TUSHARE, stock_service.get_stock_info, stock_code, force_refresh)
 
 @router.get("/api/watchlist")
 async def get_watchlist():
-    return stock_service.get_watchlist()
+    return await run_blocking(TUSHARE, stock_service.get_watchlist)
 
 @router.post("/api/add_watch")
 async def add_watch(
@@ -26,15 +46,23 @@ async def add_watch(
     target_market_value_min: Optional[float] = Form(None),
     target_market_value_max: Optional[float] = Form(None)
 ):
-    return stock_service.add_watch(stock_code, target_market_value_min, target_market_value_max)
+    return await run_blocking(LOCAL, stock_service.add_watch, stock_code, target_market_value_min, target_market_value_max)
+
+def _remove_watch(stock_code: str):
+    """移出监控列表并清除提醒状态（都要写本地文件和缓存库，在同一次线程池调用中完成）"""
+    result = stock_service.remove_watch(stock_code)
+    alerts.forget(stock_code)
+    return result
 
 @router.delete("/api/remove_watch/{stock_code}")
 async def remove_watch(stock_code: str):
-    return stock_service.remove_watch(stock_code)
+    result = await run_blocking(LOCAL, _remove_watch, stock_code)
+    push_hub.remove_quote(stock_code)
+    return result
 
 @router.get("/api/index_info")
 async def get_index_info():
-    return stock_service.get_index_info()
+    return await run_blocking(TUSHARE, stock_service.get_index_info)
 
 @router.get("/market")
 async def market(request: Request):
@@ -42,42 +70,76 @@ async def market(request: Request):
 
 @router.get("/api/company_detail/{stock_code}")
 async def get_company_detail(stock_code: str):
-    return stock_service.get_company_detail(stock_code)
+    return await run_blocking(TUSHARE, stock_service.get_company_detail, stock_code)
 
 @router.get("/api/holders/{stock_code}")
 async def get_top_holders(stock_code: str):
     """获取前十大股东数据"""
-    return stock_service.get_top_holders(stock_code)
+    return await run_blocking(TUSHARE, stock_service.get_top_holders, stock_code)
 
 @router.get("/api/performance_forecast/{stock_code}")
 async def get_performance_forecast(stock_code: str):
     """获取业绩预告数据"""
     # 处理股票代码格式
-    if stock_code.startswith('6'):
-        ts_code = f"{stock_code}.SH"
-    elif stock_code.startswith(('0', '3')):
-        ts_code = f"{stock_code}.SZ"
-    else:
+    ts_code = stock_service.symbols.to_ts_code(stock_code)
+    if ts_code is None:
         return {"error": "不支持的股票代码"}
         
-    return stock_service.get_forecast_data(ts_code)
+    return await run_blocking(TUSHARE, stock_service.get_forecast_data, ts_code)
+
+@router.get("/api/history/{stock_code}")
+async def get_history(stock_code: str, start: Optional[str] = None, end: Optional[str] = None, limit: Optional[int] = None):
+    """从本地日线库获取股票历史日线，start、end为YYYYMMDD，limit为区间内最近的条数"""
+    return await run_blocking(TUSHARE, stock_service.get_history, stock_code, start, end, limit)
+
+@router.get("/api/index_history/{ts_code}")
+async def get_index_history(ts_code: str, start: Optional[str] = None, end: Optional[str] = None, limit: Optional[int] = None):
+    """从本地日线库获取指数历史日线（K线）"""
+    return await run_blocking(TUSHARE, stock_service.get_index_history, ts_code, start, end, limit)
+
+@router.get("/api/screen")
+async def screen_stocks(request: Request, sort: Optional[str] = None, order: str = 'desc', limit: int = 50,
+                        industry: Optional[str] = None):
+    """
+    全市场选股，条件为字段_运算=数值，如/api/screen?pe_lt=15&roe_gt=0.15&dv_gt=0.03
+    运算为lt、le、gt、ge；比率类字段为小数，市值（mv）为亿元
+    """
+    params = {key: value for key, value in request.query_params.items()
+              if key not in ('sort', 'order', 'limit', 'industry')}
+    return await run_blocking(TUSHARE, screener.screen, params, sort, order, limit, industry)
+
+@router.get("/api/alerts")
+async def get_alerts(limit: int = 100):
+    """最近的目标市值提醒（新的在前）和各股票当前所处的状态"""
+    return {"recent": alerts.recent(limit), "zones": alerts.zones()}
+
+@router.get("/api/fina_history/{stock_code}")
+async def get_fina_history(stock_code: str):
+    """最近多个报告期的财务指标和趋势指标（ROE均值、利润率稳定性、复合增长率、TTM）"""
+    return await run_blocking(TUSHARE, stock_service.get_fina_history, stock_code)
 
 @router.get("/api/value_analysis/{stock_code}")
 async def get_value_analysis(stock_code: str):
     """获取价值投资分析数据"""
-    return stock_service.get_value_analysis_data(stock_code)
+    return await run_blocking(TUSHARE, stock_service.get_value_analysis_data, stock_code)
 
 @router.get("/api/ai_analysis/{stock_code}")
 async def get_ai_analysis(stock_code: str, force_refresh: bool = False):
     """获取AI价值投资分析结果"""
     try:
-        # 首先获取价值分析数据
-        analysis_data = stock_service.get_value_analysis_data(stock_code)
+        # 获取价值分析数据（有缓存时不访问上游）
+        analysis_data = await run_blocking(TUSHARE, stock_service.get_value_analysis_data, stock_code, force_refresh)
         if "error" in analysis_data:
             return analysis_data
+
+        # 输入未变的分析结果直接返回（在本地读写线程池中读取缓存），不占用AI线程池
+        if not force_refresh:
+            cached_result = await run_blocking(LOCAL, ai_service.load_cache, 'value', stock_code, analysis_data)
+            if cached_result:
+                return cached_result
             
         # 使用AI服务进行分析
-        return ai_service.analyze_value_investment(analysis_data, force_refresh)
+        return await run_blocking(LLM, ai_service.analyze_value_investment, analysis_data, force_refresh)
     except Exception as e:
         return {"error": f"AI分析失败: {str(e)}"}
 
@@ -88,36 +150,161 @@ async def update_target(
     target_market_value_max: Optional[float] = Form(None)
 ):
     """更新股票的目标市值"""
-    return stock_service.update_target(stock_code, target_market_value_min, target_market_value_max)
+    return await run_blocking(LOCAL, stock_service.update_target, stock_code, target_market_value_min, target_market_value_max)
 
 @router.get("/api/tao_analysis/{stock_code}")
-async def get_tao_analysis(stock_code: str):
+async def get_tao_analysis(stock_code: str, force_refresh: bool = False):
     """获取基于道德经的公司分析"""
     try:
-        # 首先获取公司详细信息
-        company_info = stock_service.get_company_detail(stock_code)
+        # 获取公司详细信息（有缓存时不访问上游）
+        company_info = await run_blocking(TUSHARE, stock_service.get_company_detail, stock_code, force_refresh)
         if "error" in company_info:
             return company_info
+
+        # 输入未变的分析结果直接返回（在本地读写线程池中读取缓存），不占用AI线程池
+        if not force_refresh:
+            cached_result = await run_blocking(LOCAL, ai_service.load_cache, 'tao', stock_code, company_info)
+            if cached_result:
+                return cached_result
             
         # 使用AI服务进行道德经分析
-        return ai_service.analyze_tao_philosophy(company_info)
+        return await run_blocking(LLM, ai_service.analyze_tao_philosophy, company_info, force_refresh)
     except Exception as e:
         return {"error": f"道德经分析失败: {str(e)}"}
 
 @router.get("/api/master_analysis/{stock_code}")
-async def get_master_analysis(stock_code: str):
+async def get_master_analysis(stock_code: str, force_refresh: bool = False):
     """获取价值投资大咖的分析结果"""
     try:
-        # 首先获取公司详细信息和财务数据
-        company_info = stock_service.get_company_detail(stock_code)
+        # 获取公司详细信息和财务数据（有缓存时不访问上游）
+        company_info = await run_blocking(TUSHARE, stock_service.get_company_detail, stock_code, force_refresh)
         if "error" in company_info:
             return company_info
             
-        value_analysis = stock_service.get_value_analysis_data(stock_code)
+        value_analysis = await run_blocking(TUSHARE, stock_service.get_value_analysis_data, stock_code, force_refresh)
         if "error" in value_analysis:
             return value_analysis
+
+        # 输入未变的分析结果直接返回（在本地读写线程池中读取缓存），不占用AI线程池
+        if not force_refresh:
+            cached_result = await run_blocking(LOCAL, ai_service.load_cache, 'masters', stock_code, company_info, value_analysis)
+            if cached_result:
+                return cached_result
             
         # 使用AI服务进行大咖分析
-        return ai_service.analyze_by_masters(company_info, value_analysis)
+        return await run_blocking(LLM, ai_service.analyze_by_masters, company_info, value_analysis, force_refresh)
     except Exception as e:
-        return {"error": f"价值投资大咖分析失败: {str(e)}"} 
\ No newline at end of file
+        return {"error": f"价值投资大咖分析失败: {str(e)}"}
+
+def _analysis_stream(kind: str, stock_code: str, force_refresh: bool):
+    """流式AI分析的SSE响应：delta事件为模型逐段输出的文本，result事件为完整的分析结果，failed事件为错误信息"""
+    async def event_stream():
+        try:
+            inputs = await ai_jobs.load_inputs(kind, stock_code, force_refresh)
+            if isinstance(inputs, dict):
+                yield PushHub.format_event("failed", inputs)
+                return
+            # 输入未变的分析结果直接返回（在本地读写线程池中读取缓存），不占用AI线程池
+            if not force_refresh:
+                cached_result = await run_blocking(LOCAL, ai_service.load_cache, kind, stock_code, *inputs)
+                if cached_result:
+                    yield PushHub.format_event("result", cached_result)
+                    return
+            async for event, payload in iterate_blocking(LLM, ai_service.stream_analysis, kind, stock_code,
+                                                         *inputs, force_refresh=force_refresh):
+                if event == "delta":
+                    yield PushHub.format_event("delta", {"text": payload})
+                elif event == "result":
+                    yield PushHub.format_event("result", payload)
+                else:
+                    yield PushHub.format_event("failed", {"error": payload})
+        except Exception as e:
+            yield PushHub.format_event("failed", {"error": f"AI分析失败: {str(e)}"})
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@router.get("/api/ai_analysis/{stock_code}/stream")
+async def stream_ai_analysis(stock_code: str, force_refresh: bool = False):
+    """流式获取AI价值投资分析结果"""
+    return _analysis_stream('value', stock_code, force_refresh)
+
+@router.get("/api/tao_analysis/{stock_code}/stream")
+async def stream_tao_analysis(stock_code: str, force_refresh: bool = False):
+    """流式获取基于道德经的公司分析"""
+    return _analysis_stream('tao', stock_code, force_refresh)
+
+@router.get("/api/master_analysis/{stock_code}/stream")
+async def stream_master_analysis(stock_code: str, force_refresh: bool = False):
+    """流式获取价值投资大咖的分析结果"""
+    return _analysis_stream('masters', stock_code, force_refresh)
+
+@router.post("/api/ai_jobs")
+async def submit_ai_job(
+    stock_code: str = Form(...),
+    kind: str = Form('value'),
+    force_refresh: bool = Form(False)
+):
+    """提交AI分析后台任务，kind为value/tao/masters，返回任务信息"""
+    return ai_jobs.submit(kind, stock_code, force_refresh)
+
+@router.post("/api/ai_jobs/watchlist")
+async def submit_watchlist_ai_jobs(kinds: str = Form('value'), force_refresh: bool = Form(False)):
+    """为整个监控列表提交AI分析任务，kinds为逗号分隔的分析类型，返回批次id"""
+    kind_list = [kind.strip() for kind in kinds.split(',') if kind.strip()]
+    invalid = [kind for kind in kind_list if kind not in AIJobQueue.ANALYZERS]
+    if invalid or not kind_list:
+        return {"error": f"不支持的分析类型: {','.join(invalid)}"}
+    return ai_jobs.submit_watchlist(kind_list, force_refresh)
+
+@router.get("/api/ai_jobs")
+async def get_ai_jobs_status():
+    """获取AI任务队列的整体情况"""
+    return ai_jobs.status()
+
+@router.get("/api/ai_jobs/batch/{batch_id}")
+async def get_ai_job_batch(batch_id: str):
+    """获取批量AI任务的进度"""
+    return ai_jobs.batch_status(batch_id) or {"error": "批次不存在"}
+
+@router.get("/api/ai_jobs/{job_id}")
+async def get_ai_job(job_id: str):
+    """获取AI分析任务的状态"""
+    return ai_jobs.get_job(job_id) or {"error": "任务不存在"}
+
+@router.get("/api/scheduler/status")
+async def get_scheduler_status():
+    """获取后台刷新任务的运行状态"""
+    return scheduler.status()
+
+@router.get("/api/tushare/metrics")
+async def get_tushare_metrics():
+    """获取tushare各接口的限流排队和调用统计"""
+    return pro.metrics()
+
+@router.get("/metrics")
+async def get_metrics():
+    """Prometheus格式的指标：各接口耗时，以及按接口归类的上游调用、限流等待和缓存读写"""
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+@router.get("/api/stream")
+async def stream_updates(request: Request):
+    """SSE推送通道：连接后先收到完整数据，之后只收到发生变化的行情和指数"""
+    async def event_stream():
+        queue = push_hub.subscribe()
+        try:
+            for event, payload in push_hub.snapshot():
+                yield push_hub.format_event(event, payload)
+            while not await request.is_disconnected():
+                try:
+                    event, payload = await asyncio.wait_for(queue.get(), timeout=15)
+                except asyncio.TimeoutError:
+                    # 心跳，保持连接并及时发现断开的客户端
+                    yield ": keepalive\n\n"
+                    continue
+                yield push_hub.format_event(event, payload)
+        finally:
+            push_hub.unsubscribe(queue)
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
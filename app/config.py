@@ -11,12 +11,111 @@ class Config:
     # 配置文件路径
     CONFIG_FILE = os.path.join(BASE_DIR, "config.json")
     
+    # 股票数据缓存库（SQLite）
+    CACHE_DB_FILE = os.path.join(BASE_DIR, "stock_cache.db")
+    
+    # 缓存有效期（秒）：交易时段内的行情、收盘后日线入库前的行情、财务指标披露窗口内的复查间隔
+    QUOTE_TTL_OPEN = int(os.getenv('QUOTE_TTL_OPEN', '60'))
+    QUOTE_TTL_SETTLE = int(os.getenv('QUOTE_TTL_SETTLE', '600'))
+    FINA_RECHECK_TTL = int(os.getenv('FINA_RECHECK_TTL', str(24 * 3600)))
+    # 按报告期批量拉取财务指标（fina_indicator_vip）的最少股票数，较少时逐只按报告期拉取
+    FINA_BULK_MIN_CODES = int(os.getenv('FINA_BULK_MIN_CODES', '20'))
+    # disclosure_date单次返回的行数上限，整期的披露日期按offset分页拉取直到不足一页
+    FINA_DISCLOSURE_PAGE_SIZE = int(os.getenv('FINA_DISCLOSURE_PAGE_SIZE', '3000'))
+    # 每只股票保存的财务历史报告期数（用于多年趋势指标）
+    FINA_HISTORY_PERIODS = int(os.getenv('FINA_HISTORY_PERIODS', '20'))
+    # 公司详情、价值分析数据、十大股东的缓存有效期（秒），详情页和各AI分析共用
+    DETAIL_CACHE_TTL = int(os.getenv('DETAIL_CACHE_TTL', '1800'))
+
+    # 全市场股票代码表：本地文件、有效期（秒）、两次刷新尝试的最小间隔（秒）
+    SYMBOL_TABLE_FILE = os.path.join(BASE_DIR, "stock_basic.csv")
+    SYMBOL_TABLE_MAX_AGE = int(os.getenv('SYMBOL_TABLE_MAX_AGE', str(24 * 3600)))
+    SYMBOL_TABLE_RETRY_INTERVAL = 600
+
+    # 交易日历（trade_cal）：本地文件、交易所、获取失败后的重试间隔（秒）
+    TRADING_CALENDAR_FILE = os.path.join(BASE_DIR, "trade_cal.json")
+    TRADING_CALENDAR_EXCHANGE = os.getenv('TRADING_CALENDAR_EXCHANGE', 'SSE')
+    TRADING_CALENDAR_RETRY_INTERVAL = 600
+
+    # 本地日线库：目录、首次回填的自然日天数、按交易日批量追加的最多天数（更多时按代码区间补齐）
+    BAR_STORE_DIR = os.getenv('BAR_STORE_DIR', os.path.join(BASE_DIR, "bars"))
+    BAR_BACKFILL_DAYS = int(os.getenv('BAR_BACKFILL_DAYS', str(5 * 365)))
+    BAR_BULK_MAX_DAYS = int(os.getenv('BAR_BULK_MAX_DAYS', '20'))
+
+    # 全市场选股数据目录，以及合并的最近报告期数（每只股票取其中最新的一期）
+    SCREENER_DIR = os.getenv('SCREENER_DIR', os.path.join(BASE_DIR, "screener"))
+    SCREENER_FINA_PERIODS = int(os.getenv('SCREENER_FINA_PERIODS', '4'))
+    # 选股数据更新不完整（上游失败或没有数据）时，间隔多少秒后再重试
+    SCREENER_RETRY_INTERVAL = 600
+
+    # 后台刷新任务：是否启用、各任务间隔（秒）、每批刷新的股票数、批次间暂停（秒）
+    SCHEDULER_ENABLED = os.getenv('SCHEDULER_ENABLED', '1') == '1'
+    SCHEDULER_QUOTE_INTERVAL = int(os.getenv('SCHEDULER_QUOTE_INTERVAL', '60'))
+    SCHEDULER_INDEX_INTERVAL = int(os.getenv('SCHEDULER_INDEX_INTERVAL', '60'))
+    SCHEDULER_FUNDAMENTALS_INTERVAL = int(os.getenv('SCHEDULER_FUNDAMENTALS_INTERVAL', str(6 * 3600)))
+    SCHEDULER_SYMBOL_TABLE_INTERVAL = int(os.getenv('SCHEDULER_SYMBOL_TABLE_INTERVAL', '3600'))
+    SCHEDULER_BARS_INTERVAL = int(os.getenv('SCHEDULER_BARS_INTERVAL', '1800'))
+    SCHEDULER_SCREENER_INTERVAL = int(os.getenv('SCHEDULER_SCREENER_INTERVAL', '1800'))
+    SCHEDULER_BATCH_SIZE = int(os.getenv('SCHEDULER_BATCH_SIZE', '50'))
+    SCHEDULER_PACING_SECONDS = float(os.getenv('SCHEDULER_PACING_SECONDS', '1.0'))
+
+    # AI分析结果缓存：最长保留时间（秒）和三个缓存目录合计的大小上限（字节）
+    AI_CACHE_MAX_AGE = int(os.getenv('AI_CACHE_MAX_AGE', str(30 * 24 * 3600)))
+    AI_CACHE_MAX_BYTES = int(os.getenv('AI_CACHE_MAX_BYTES', str(100 * 1024 * 1024)))
+
+    # AI分析失败（含只能降级解析的结果）后，相同输入在这段时间内（秒）直接返回失败结果，不再调用模型
+    AI_FAILURE_TTL = int(os.getenv('AI_FAILURE_TTL', '300'))
+
+    # 多个进程共享AI缓存目录时的锁文件（秒）：超过此时间未刷新视为失效、持有期间的刷新间隔、
+    # 等待其他进程的最长时间（超时后直接调用模型）、等待时的轮询间隔
+    AI_LOCK_TIMEOUT = int(os.getenv('AI_LOCK_TIMEOUT', '300'))
+    AI_LOCK_HEARTBEAT_INTERVAL = 30
+    AI_LOCK_WAIT_TIMEOUT = int(os.getenv('AI_LOCK_WAIT_TIMEOUT', '180'))
+    AI_LOCK_POLL_INTERVAL = 0.5
+
+    # AI分析后台任务：worker数、队列容量、每个模型同时进行的分析数（默认值和按模型配置）、保留的已完成任务数
+    AI_JOB_WORKERS = int(os.getenv('AI_JOB_WORKERS', '4'))
+    AI_JOB_QUEUE_SIZE = int(os.getenv('AI_JOB_QUEUE_SIZE', '5000'))
+    AI_JOB_DEFAULT_CONCURRENCY = int(os.getenv('AI_JOB_CONCURRENCY', '2'))
+    AI_JOB_MODEL_CONCURRENCY = {}
+    AI_JOB_HISTORY = 5000
+
+    # tushare接口限流：默认每分钟调用次数、按接口单独配置的次数、允许的突发请求数、频率超限时的重试次数和退避基数（秒）
+    TUSHARE_DEFAULT_RATE_LIMIT = int(os.getenv('TUSHARE_RATE_LIMIT', '200'))
+    TUSHARE_RATE_LIMITS = {}
+    TUSHARE_BURST = int(os.getenv('TUSHARE_BURST', '10'))
+    TUSHARE_MAX_RETRIES = 3
+    TUSHARE_RETRY_BACKOFF = 2.0
+
+    # tushare返回数据的录制/回放：record、replay或auto，为空时不启用；录制文件目录
+    TUSHARE_CASSETTE_MODE = os.getenv('TUSHARE_CASSETTE', '')
+    TUSHARE_CASSETTE_DIR = os.getenv('TUSHARE_CASSETTE_DIR', os.path.join(BASE_DIR, "cassettes", "tushare"))
+
+    # 日志级别（DEBUG时输出公司详情、AI分析输入输出等完整数据）和日志格式
+    LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+    LOG_FORMAT = '%(asctime)s %(levelname)s %(name)s: %(message)s'
+
+    # 目标市值提醒：滞回比例、持久日志、启动时载入的最近提醒条数、可选的本地文件和webhook
+    ALERT_HYSTERESIS = float(os.getenv('ALERT_HYSTERESIS', '0.02'))
+    ALERT_LOG_FILE = os.getenv('ALERT_LOG_FILE', os.path.join(BASE_DIR, "alerts.jsonl"))
+    ALERT_RECENT_SIZE = 1000
+    ALERT_FILE_SINK = os.getenv('ALERT_FILE_SINK', '')
+    ALERT_WEBHOOK_URL = os.getenv('ALERT_WEBHOOK_URL', '')
+
     # 模板目录
     TEMPLATES_DIR = os.path.join(BASE_DIR, "app", "templates")
     
     # 静态文件目录
     STATIC_DIR = os.path.join(BASE_DIR, "app", "static")
-    
+
+    # 各上游服务及本地磁盘读写的线程池大小，阻塞调用在线程池中执行，不占用事件循环
+    EXECUTOR_DEFAULT_MAX_WORKERS = 4
+    EXECUTOR_MAX_WORKERS = {
+        'tushare': int(os.getenv('TUSHARE_MAX_WORKERS', '8')),
+        'llm': int(os.getenv('LLM_MAX_WORKERS', '4')),
+        'local': int(os.getenv('LOCAL_MAX_WORKERS', '4')),
+    }
+
     # 确保目录存在
     @classmethod
     def ensure_directories(cls):
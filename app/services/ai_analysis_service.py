@@ -1,9 +1,39 @@
+import hashlib
 import json
+import logging
 import os
+import re
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import Future
 from openai import OpenAI
 from app.config import Config
+from app.services.metrics import track_upstream, track_cache, record_cache
+from app.services.logging_setup import LazyJson
+
+logger = logging.getLogger(__name__)
 
 class AIAnalysisService:
+    # 各类分析的缓存目录和提示词版本，修改提示词模板时递增版本号，旧缓存随之失效
+    CACHE_TYPES = {
+        'value': ('ai_stock_analysis', 2),
+        'tao': ('dao_analysis', 1),
+        'masters': ('daka_analysis', 1),
+    }
+    # 来自财务指标的数据分组，参与缓存键
+    FINANCIAL_SECTIONS = ('profitability', 'growth', 'operation', 'solvency', 'cash_flow', 'per_share')
+    # 各类分析结果必须包含的字段及允许的类型
+    ANALYSIS_SCHEMAS = {
+        'value': {'investment_suggestion': (dict, str), 'analysis': (dict, str), 'price_analysis': dict},
+        'tao': {'tao_philosophy': (dict, str), 'business_ethics': (dict, str), 'investment_advice': (dict, str)},
+        'masters': {
+            'buffett_analysis': (dict, str), 'graham_analysis': (dict, str), 'lin_yuan_analysis': (dict, str),
+            'li_daxiao_analysis': (dict, str), 'duan_yongping_analysis': (dict, str)
+        },
+    }
+
     def __init__(self):
         # 配置OpenAI客户端连接到Volces API
         self.model = os.getenv('VOLCES_MODEL_ID', 'your_model_id_here')  # 从环境变量获取
@@ -11,89 +41,510 @@ class AIAnalysisService:
             api_key = os.getenv('VOLCES_API_KEY', 'your_api_key_here'),  # 从环境变量获取
             base_url = os.getenv('VOLCES_BASE_URL', 'https://ark.cn-beijing.volces.com/api/v3')
         )
+        # 进行中的模型调用，{(分析类型, 股票代码, 输入哈希): Future}
+        self._in_flight = {}
+        self._in_flight_lock = threading.Lock()
+        # 本进程持有的锁文件 -> 停止刷新心跳的Event
+        self._lock_heartbeats = {}
         # 创建AI分析结果缓存目录
-        self.cache_dir = os.path.join(Config.BASE_DIR, "ai_stock_analysis")
-        self.dao_cache_dir = os.path.join(Config.BASE_DIR, "dao_analysis")
-        self.daka_cache_dir = os.path.join(Config.BASE_DIR, "daka_analysis")
+        self.cache_dirs = {kind: os.path.join(Config.BASE_DIR, directory)
+                           for kind, (directory, _) in self.CACHE_TYPES.items()}
         
         # 确保所有缓存目录存在
-        for directory in [self.cache_dir, self.dao_cache_dir, self.daka_cache_dir]:
+        for directory in self.cache_dirs.values():
             if not os.path.exists(directory):
                 os.makedirs(directory)
+        self.evict_cache()
 
-    def get_cache_path(self, stock_code: str) -> str:
-        """获取缓存文件路径"""
-        return os.path.join(self.cache_dir, f"{stock_code}.json")
+    @staticmethod
+    def _normalize(value):
+        """统一数值精度，使等价的输入得到相同的哈希"""
+        if isinstance(value, float):
+            return float(f"{value:.6g}")
+        if isinstance(value, dict):
+            return {str(key): AIAnalysisService._normalize(item) for key, item in value.items()}
+        if isinstance(value, (list, tuple)):
+            return [AIAnalysisService._normalize(item) for item in value]
+        return value
 
-    def get_dao_cache_path(self, stock_code: str) -> str:
-        """获取道德经分析缓存文件路径"""
-        return os.path.join(self.dao_cache_dir, f"{stock_code}.json")
+    def cache_input(self, kind: str, *payloads) -> dict:
+        """
+        提取决定分析结果的输入：财务指标和公司资料
+        股价、估值等每日变动的行情字段不参与缓存键，否则缓存每天都会失效
+        """
+        if kind == 'value':
+            analysis_data, = payloads
+            return {
+                "stock": {key: analysis_data.get('stock_info', {}).get(key) for key in ('code', 'name')},
+                **{key: analysis_data.get(key) for key in self.FINANCIAL_SECTIONS},
+                "trend": analysis_data.get('trend')
+            }
+        if kind == 'tao':
+            company_info, = payloads
+            return {"basic_info": company_info.get('basic_info', {})}
+        company_info, value_analysis = payloads
+        return {
+            "basic_info": company_info.get('basic_info', {}),
+            **{key: value_analysis.get(key) for key in self.FINANCIAL_SECTIONS}
+        }
 
-    def get_daka_cache_path(self, stock_code: str) -> str:
-        """获取大咖分析缓存文件路径"""
-        return os.path.join(self.daka_cache_dir, f"{stock_code}.json")
+    def input_hash(self, kind: str, *payloads) -> str:
+        """规范化输入与提示词版本的哈希"""
+        key = {"version": self.CACHE_TYPES[kind][1], "input": self._normalize(self.cache_input(kind, *payloads))}
+        return hashlib.sha256(json.dumps(key, ensure_ascii=False, sort_keys=True).encode('utf-8')).hexdigest()[:16]
 
-    def load_cache(self, stock_code: str):
-        """加载缓存的AI分析结果"""
-        cache_path = self.get_cache_path(stock_code)
-        if os.path.exists(cache_path):
-            try:
-                with open(cache_path, 'r', encoding='utf-8') as f:
-                    return json.load(f)
-            except Exception as e:
-                print(f"读取AI分析缓存失败: {str(e)}")
+    def get_cache_path(self, kind: str, stock_code: str, input_hash: str) -> str:
+        """获取缓存文件路径：股票代码、提示词版本和输入哈希"""
+        return os.path.join(self.cache_dirs[kind], f"{stock_code}_v{self.CACHE_TYPES[kind][1]}_{input_hash}.json")
+
+    def load_cache(self, kind: str, stock_code: str, *payloads):
+        """加载与当前输入和提示词版本一致的分析结果，没有则返回None"""
+        cache_path = self.get_cache_path(kind, stock_code, self.input_hash(kind, *payloads))
+        with track_cache(f"ai:{kind}", 'load'):
+            if os.path.exists(cache_path):
+                try:
+                    with open(cache_path, 'r', encoding='utf-8') as f:
+                        result = json.load(f)
+                    record_cache(f"ai:{kind}", hits=1)
+                    return result
+                except Exception as e:
+                    logger.warning("读取AI分析缓存失败: %s", e)
+        record_cache(f"ai:{kind}", misses=1)
         return None
 
-    def save_cache(self, stock_code: str, analysis_result: dict):
-        """保存AI分析结果到缓存"""
-        cache_path = self.get_cache_path(stock_code)
+    def save_cache(self, kind: str, stock_code: str, analysis_result: dict, *payloads):
+        """保存分析结果，同一股票旧输入的结果随之删除"""
+        cache_path = self.get_cache_path(kind, stock_code, self.input_hash(kind, *payloads))
         try:
-            with open(cache_path, 'w', encoding='utf-8') as f:
-                json.dump(analysis_result, f, ensure_ascii=False, indent=4)
+            with track_cache(f"ai:{kind}", 'save'):
+                tmp_path = f"{cache_path}.tmp"
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(analysis_result, f, ensure_ascii=False, indent=4)
+                os.replace(tmp_path, cache_path)
+            for name in os.listdir(self.cache_dirs[kind]):
+                path = os.path.join(self.cache_dirs[kind], name)
+                if path != cache_path and name.endswith('.json') and (name == f"{stock_code}.json" or name.startswith(f"{stock_code}_")):
+                    os.remove(path)
         except Exception as e:
-            print(f"保存AI分析缓存失败: {str(e)}")
+            logger.warning("保存AI分析缓存失败: %s", e)
+        self.evict_cache()
 
-    def load_dao_cache(self, stock_code: str):
-        """加载缓存的道德经分析结果"""
-        cache_path = self.get_dao_cache_path(stock_code)
-        if os.path.exists(cache_path):
-            try:
-                with open(cache_path, 'r', encoding='utf-8') as f:
+    def get_failure_path(self, kind: str, stock_code: str, input_hash: str) -> str:
+        """修正后仍不合格（返回格式错误或只能降级解析）时的短期缓存文件路径"""
+        return self.get_cache_path(kind, stock_code, input_hash)[:-len('.json')] + '.failed.json'
+
+    def load_failure(self, kind: str, stock_code: str, *payloads):
+        """AI_FAILURE_TTL内输出不合格过的分析直接返回上次的结果，避免反复调用模型"""
+        failure_path = self.get_failure_path(kind, stock_code, self.input_hash(kind, *payloads))
+        try:
+            if time.time() - os.path.getmtime(failure_path) < Config.AI_FAILURE_TTL:
+                with open(failure_path, 'r', encoding='utf-8') as f:
                     return json.load(f)
-            except Exception as e:
-                print(f"读取道德经分析缓存失败: {str(e)}")
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning("读取AI分析失败记录失败: %s", e)
         return None
 
-    def save_dao_cache(self, stock_code: str, analysis_result: dict):
-        """保存道德经分析结果到缓存"""
-        cache_path = self.get_dao_cache_path(stock_code)
+    def save_failure(self, kind: str, stock_code: str, result: dict, *payloads):
+        failure_path = self.get_failure_path(kind, stock_code, self.input_hash(kind, *payloads))
         try:
-            with open(cache_path, 'w', encoding='utf-8') as f:
-                json.dump(analysis_result, f, ensure_ascii=False, indent=4)
+            tmp_path = f"{failure_path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(result, f, ensure_ascii=False, indent=4)
+            os.replace(tmp_path, failure_path)
         except Exception as e:
-            print(f"保存道德经分析缓存失败: {str(e)}")
+            logger.warning("保存AI分析失败记录失败: %s", e)
+
+    @staticmethod
+    def is_failed(result: dict) -> bool:
+        """结果是错误信息，或是JSON解析失败后的降级结果"""
+        return "error" in result or result.get("parse_fallback", False)
+
+    @staticmethod
+    def is_format_failure(result: dict) -> bool:
+        """
+        模型有返回但修正后仍不合格（格式错误或降级结果），只有这类失败写入短期失败缓存
+        网络错误、超时、限流等调用失败不缓存，下次请求直接重试
+        """
+        return result.get("format_error", False) or result.get("parse_fallback", False)
+
+    def evict_cache(self):
+        """清理超过有效期的分析结果，总大小超过上限时从最旧的开始删除"""
+        try:
+            entries = []
+            for directory in self.cache_dirs.values():
+                with os.scandir(directory) as it:
+                    for entry in it:
+                        if entry.is_file() and entry.name.endswith('.json'):
+                            stat = entry.stat()
+                            entries.append((stat.st_mtime, stat.st_size, entry.path))
+            entries.sort()
+            expire_before = time.time() - Config.AI_CACHE_MAX_AGE
+            total_size = sum(size for _, size, _ in entries)
+            for mtime, size, path in entries:
+                if mtime >= expire_before and total_size <= Config.AI_CACHE_MAX_BYTES:
+                    break
+                os.remove(path)
+                total_size -= size
+        except Exception as e:
+            logger.warning("清理AI分析缓存失败: %s", e)
+
+    def _acquire_file_lock(self, lock_path: str) -> tuple:
+        """
+        获取缓存目录中的锁文件，多个进程共享缓存目录时同一分析只有一个进程调用模型
+        - 锁文件内容为"主机名:进程号:令牌"，持有期间由心跳线程定期刷新修改时间
+        - 修改时间超过AI_LOCK_TIMEOUT未刷新，或本机上的持有进程已不存在，视为失效锁
+        - 最多等待AI_LOCK_WAIT_TIMEOUT，超时后不再等待，由调用方直接调用模型
+        :return: (令牌，超时未获取时为None, 是否等待过其他进程)
+        """
+        token = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex}"
+        deadline = time.monotonic() + Config.AI_LOCK_WAIT_TIMEOUT
+        waited = False
+        while True:
+            try:
+                fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                os.write(fd, token.encode())
+                os.close(fd)
+                self._start_heartbeat(lock_path, token)
+                return token, waited
+            except FileExistsError:
+                try:
+                    if self._lock_is_stale(lock_path):
+                        os.remove(lock_path)
+                        continue
+                except FileNotFoundError:
+                    continue
+                if time.monotonic() >= deadline:
+                    logger.warning("等待AI分析锁超时，直接调用模型: %s", lock_path)
+                    return None, True
+                waited = True
+                time.sleep(Config.AI_LOCK_POLL_INTERVAL)
+
+    @staticmethod
+    def _lock_is_stale(lock_path: str) -> bool:
+        if time.time() - os.path.getmtime(lock_path) > Config.AI_LOCK_TIMEOUT:
+            return True
+        try:
+            with open(lock_path, 'r', encoding='utf-8') as f:
+                host, pid, _ = f.read().split(':', 2)
+            if host != socket.gethostname():
+                return False
+            os.kill(int(pid), 0)
+        except (ValueError, OSError) as e:
+            # 进程不存在时为失效锁；内容尚未写完或无权限探测时按修改时间判断
+            return isinstance(e, ProcessLookupError)
+        return False
+
+    def _start_heartbeat(self, lock_path: str, token: str):
+        """持有锁期间定期刷新锁文件的修改时间，模型调用超过AI_LOCK_TIMEOUT时锁也不会被判为失效"""
+        stop = threading.Event()
+        with self._in_flight_lock:
+            self._lock_heartbeats[lock_path] = stop
+
+        def beat():
+            while not stop.wait(Config.AI_LOCK_HEARTBEAT_INTERVAL):
+                if not self._owns_lock(lock_path, token):
+                    return
+                try:
+                    os.utime(lock_path)
+                except OSError:
+                    return
 
-    def load_daka_cache(self, stock_code: str):
-        """加载缓存的大咖分析结果"""
-        cache_path = self.get_daka_cache_path(stock_code)
-        if os.path.exists(cache_path):
+        threading.Thread(target=beat, name="ai-lock-heartbeat", daemon=True).start()
+
+    @staticmethod
+    def _owns_lock(lock_path: str, token: str) -> bool:
+        try:
+            with open(lock_path, 'r', encoding='utf-8') as f:
+                return f.read() == token
+        except OSError:
+            return False
+
+    def _release_file_lock(self, lock_path: str, token: str):
+        """停止心跳并删除锁文件（只删除自己持有的锁）"""
+        if token is None:
+            return
+        with self._in_flight_lock:
+            stop = self._lock_heartbeats.pop(lock_path, None)
+        if stop is not None:
+            stop.set()
+        if self._owns_lock(lock_path, token):
             try:
-                with open(cache_path, 'r', encoding='utf-8') as f:
-                    return json.load(f)
-            except Exception as e:
-                print(f"读取大咖分析缓存失败: {str(e)}")
+                os.remove(lock_path)
+            except FileNotFoundError:
+                pass
+
+    def _single_flight(self, kind: str, stock_code: str, payloads: tuple, call, force_refresh: bool = False):
+        """
+        相同(分析类型, 股票, 输入哈希)的并发请求只调用一次模型，其余调用方共享结果
+        同一进程内等待进行中的调用；其他进程持有锁文件时等待其释放（最多AI_LOCK_WAIT_TIMEOUT），拿到锁后先读取缓存，命中时不再调用模型
+        最近输出不合格的分析在AI_FAILURE_TTL内直接返回失败结果（强制刷新除外），调用失败不缓存
+        :param call: 无参数函数，调用模型并返回分析结果
+        """
+        input_hash = self.input_hash(kind, *payloads)
+        key = (kind, stock_code, input_hash)
+        leader, future = self._join_flight(key)
+        if not leader:
+            logger.debug("等待进行中的相同分析: %s %s", kind, stock_code)
+            return future.result()
+
+        lock_path = f"{self.get_cache_path(kind, stock_code, input_hash)}.lock"
+        try:
+            token, waited = self._acquire_file_lock(lock_path)
+            try:
+                # 拿到锁后总是重新读取缓存：其他进程可能刚写入结果并释放锁；强制刷新时只在等过其他进程后读取
+                result = self.load_cache(kind, stock_code, *payloads) if waited or not force_refresh else None
+                if not result and not force_refresh:
+                    result = self.load_failure(kind, stock_code, *payloads)
+                if not result:
+                    result = call()
+                    if self.is_format_failure(result):
+                        self.save_failure(kind, stock_code, result, *payloads)
+            finally:
+                self._release_file_lock(lock_path, token)
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            self._leave_flight(key)
+
+    def _join_flight(self, key: tuple):
+        """登记进行中的调用，返回(是否由自己调用模型, 共享结果的Future)"""
+        with self._in_flight_lock:
+            future = self._in_flight.get(key)
+            if future is not None:
+                return False, future
+            future = Future()
+            self._in_flight[key] = future
+            return True, future
+
+    def _leave_flight(self, key: tuple):
+        with self._in_flight_lock:
+            self._in_flight.pop(key, None)
+
+    @staticmethod
+    def extract_json(text: str):
+        """
+        从模型输出中提取JSON对象：去掉markdown代码块标记，解析失败时取最外层的{...}
+        :return: dict，提取不到返回None
+        """
+        if not text:
+            return None
+        text = re.sub(r"^\s*```(?:json)?\s*|\s*```\s*$", "", text.strip(), flags=re.IGNORECASE)
+        try:
+            result = json.loads(text)
+            return result if isinstance(result, dict) else None
+        except json.JSONDecodeError:
+            pass
+
+        start = text.find('{')
+        while start != -1:
+            depth = 0
+            in_string = False
+            escaped = False
+            for i in range(start, len(text)):
+                char = text[i]
+                if in_string:
+                    if escaped:
+                        escaped = False
+                    elif char == '\\':
+                        escaped = True
+                    elif char == '"':
+                        in_string = False
+                elif char == '"':
+                    in_string = True
+                elif char == '{':
+                    depth += 1
+                elif char == '}':
+                    depth -= 1
+                    if depth == 0:
+                        try:
+                            result = json.loads(text[start:i + 1])
+                            if isinstance(result, dict):
+                                return result
+                        except json.JSONDecodeError:
+                            pass
+                        break
+            start = text.find('{', start + 1)
         return None
 
-    def save_daka_cache(self, stock_code: str, analysis_result: dict):
-        """保存大咖分析结果到缓存"""
-        cache_path = self.get_daka_cache_path(stock_code)
+    def validate_result(self, kind: str, result) -> list:
+        """按分析类型检查必需字段，返回问题列表，为空表示通过"""
+        if not isinstance(result, dict):
+            return ["返回内容不是有效的JSON对象"]
+        problems = []
+        for field, types in self.ANALYSIS_SCHEMAS[kind].items():
+            if field not in result:
+                problems.append(f"缺少字段{field}")
+            elif not isinstance(result[field], types):
+                problems.append(f"字段{field}的类型不正确")
+        return problems
+
+    def _finish_analysis(self, kind: str, stock_code: str, messages: list, analysis_text: str, *payloads) -> dict:
+        """
+        解析模型输出：提取并校验JSON，不合格时带上问题让模型修正一次
+        仍不合格时，价值分析用正则从文本中提取（降级结果），其他分析返回错误
+        合格的结果写入缓存
+        """
+        analysis_result = self.extract_json(analysis_text)
+        problems = self.validate_result(kind, analysis_result)
+        if problems:
+            logger.warning("AI分析结果不合格（%s），请求模型修正", '；'.join(problems))
+            repair_messages = messages + [
+                {"role": "assistant", "content": analysis_text or ""},
+                {"role": "user", "content": f"上面的回复不符合要求：{'；'.join(problems)}。"
+                                            f"请只返回一个有效的JSON对象，必须包含字段：{'、'.join(self.ANALYSIS_SCHEMAS[kind])}，"
+                                            f"不要使用markdown代码块，不要附加其他文字。"}
+            ]
+            response = self._create_completion(repair_messages)
+            repaired_text = response.choices[0].message.content
+            analysis_result = self.extract_json(repaired_text)
+            problems = self.validate_result(kind, analysis_result)
+            if problems:
+                logger.warning("修正后的AI分析结果仍不合格: %s", '；'.join(problems))
+                if kind == 'value':
+                    current_price = payloads[0].get('stock_info', {}).get('current_price') or 0
+                    return self._fallback_value_result(analysis_text, current_price)
+                return {"error": "分析结果格式错误", "format_error": True}
+
+        if stock_code:
+            self.save_cache(kind, stock_code, analysis_result, *payloads)
+        return analysis_result
+
+    def _fallback_value_result(self, analysis_text: str, current_price: float) -> dict:
+        """用_parse_analysis_result从文本中提取价值分析，整理为页面使用的字段"""
+        parsed = self._parse_analysis_result(analysis_text or "", current_price)
+        analysis = parsed["analysis"]
+        price_analysis = parsed["price_analysis"]
+        return {
+            "investment_suggestion": {
+                "summary": parsed["investment_suggestion"] or "AI返回的结果不是有效的JSON格式，以下为文本提取结果",
+                "action": "",
+                "key_points": ""
+            },
+            "analysis": {
+                "估值分析": analysis["valuation_analysis"],
+                "财务健康状况": analysis["financial_health"],
+                "成长潜力": analysis["growth_potential"],
+                "风险评估": analysis["risk_assessment"]
+            },
+            "price_analysis": {
+                "合理价格区间": [price_analysis["reasonable_price_range"]["min"], price_analysis["reasonable_price_range"]["max"]],
+                "目标市值区间": [price_analysis["target_market_value"]["min"], price_analysis["target_market_value"]["max"]]
+            },
+            "parse_fallback": True
+        }
+
+    def _create_completion(self, messages: list):
+        """调用模型（非流式），记录耗时和失败次数"""
+        with track_upstream('llm', 'chat.completions.create'):
+            return self.client.chat.completions.create(model=self.model, messages=messages)
+
+    def _build_messages(self, kind: str, *payloads) -> list:
+        """构建各类分析的对话消息"""
+        if kind == 'value':
+            return [{"role": "user", "content": [{"type": "text", "text": self._build_analysis_prompt(*payloads)}]}]
+        if kind == 'tao':
+            return [{"role": "user", "content": self._build_tao_analysis_prompt(*payloads)}]
+        return [{"role": "user", "content": self._build_masters_analysis_prompt(*payloads)}]
+
+    def stream_analysis(self, kind: str, stock_code: str, *payloads, force_refresh: bool = False):
+        """
+        流式分析，逐段产出("delta", 文本)，最后产出("result", 分析结果)或("error", 错误信息)
+        完整文本在结束时解析为JSON并写入缓存，与非流式接口共用缓存
+        :param kind: CACHE_TYPES中的分析类型
+        :param payloads: 与对应analyze_*方法相同的输入数据
+        """
+        if not force_refresh:
+            cached_result = self.load_cache(kind, stock_code, *payloads)
+            if cached_result:
+                yield "result", cached_result
+                return
+
+        # 与blocking接口相同的单飞逻辑：跟随者不再收到逐段文本，只收到最终结果
+        input_hash = self.input_hash(kind, *payloads)
+        key = (kind, stock_code, input_hash)
+        leader, future = self._join_flight(key)
+        if not leader:
+            result = future.result()
+            yield ("error", result["error"]) if "error" in result else ("result", result)
+            return
+
+        lock_path = f"{self.get_cache_path(kind, stock_code, input_hash)}.lock"
+        result = {"error": "AI分析失败"}
+        try:
+            token, waited = self._acquire_file_lock(lock_path)
+            try:
+                # 拿到锁后总是重新读取缓存：其他进程可能刚写入结果并释放锁；强制刷新时只在等过其他进程后读取
+                cached_result = self.load_cache(kind, stock_code, *payloads) if waited or not force_refresh else None
+                if not cached_result and not force_refresh:
+                    cached_result = self.load_failure(kind, stock_code, *payloads)
+                if cached_result:
+                    result = cached_result
+                else:
+                    for event, payload in self._stream_completion(kind, stock_code, *payloads):
+                        if event == "delta":
+                            yield event, payload
+                        else:
+                            result = payload if event == "result" else {"error": payload}
+                    if self.is_format_failure(result):
+                        self.save_failure(kind, stock_code, result, *payloads)
+            finally:
+                self._release_file_lock(lock_path, token)
+        finally:
+            future.set_result(result)
+            self._leave_flight(key)
+        yield ("error", result["error"]) if "error" in result else ("result", result)
+
+    def _stream_completion(self, kind: str, stock_code: str, *payloads):
+        """
+        调用模型的流式接口，产出("delta", 文本)，最后产出("result", 分析结果)或("error", 调用失败的错误信息)
+        修正后仍不合格时也以"result"产出带error的结果，保留format_error标记供调用方写入失败缓存
+        """
+        messages = self._build_messages(kind, *payloads)
+        parts = []
+        try:
+            # 耗时按整个流计算，到最后一段输出为止
+            with track_upstream('llm', 'chat.completions.create:stream'):
+                stream = self.client.chat.completions.create(
+                    model=self.model,
+                    messages=messages,
+                    stream=True
+                )
+                for chunk in stream:
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta.content
+                    if delta:
+                        parts.append(delta)
+                        yield "delta", delta
+        except Exception as e:
+            logger.warning("AI流式分析失败: %s", e)
+            yield "error", f"AI分析失败: {str(e)}"
+            return
+
         try:
-            with open(cache_path, 'w', encoding='utf-8') as f:
-                json.dump(analysis_result, f, ensure_ascii=False, indent=4)
+            analysis_result = self._finish_analysis(kind, stock_code, messages, ''.join(parts), *payloads)
         except Exception as e:
-            print(f"保存大咖分析缓存失败: {str(e)}")
+            logger.warning("AI流式分析失败: %s", e)
+            yield "error", f"AI分析失败: {str(e)}"
+            return
+        yield "result", analysis_result
 
     def analyze_value_investment(self, analysis_data: dict, force_refresh: bool = False):
+        """对股票进行价值投资分析，相同输入的并发请求共享一次模型调用"""
+        stock_code = analysis_data.get("stock_info", {}).get("code")
+        if not stock_code:
+            return self._analyze_value_investment(analysis_data, force_refresh)
+        return self._single_flight('value', stock_code, (analysis_data,),
+                                   lambda: self._analyze_value_investment(analysis_data, force_refresh),
+                                   force_refresh)
+
+    def _analyze_value_investment(self, analysis_data: dict, force_refresh: bool = False):
         """
         对股票进行价值投资分析
         :param analysis_data: 包含各项财务指标的字典
@@ -105,71 +556,34 @@ class AIAnalysisService:
             
             # 如果不是强制刷新，尝试从缓存加载
             if not force_refresh:
-                cached_result = self.load_cache(stock_code)
+                cached_result = self.load_cache('value', stock_code, analysis_data)
                 if cached_result:
-                    print(f"从缓存加载AI分析结果: {stock_code}")
+                    logger.debug("从缓存加载AI分析结果: %s", stock_code)
                     return cached_result
 
             # 打印输入数据用于调试
-            print(f"输入的分析数据: {json.dumps(analysis_data, ensure_ascii=False, indent=2)}")
+            logger.debug("输入的分析数据: %s", LazyJson(analysis_data))
             
             # 构建提示词
-            prompt = self._build_analysis_prompt(analysis_data)
+            messages = self._build_messages('value', analysis_data)
             
             # 打印提示词用于调试
-            print(f"AI分析提示词: {prompt}")
+            logger.debug("AI分析提示词: %s", messages[0]['content'][0]['text'])
             
             # 调用API
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "text",
-                                "text": prompt
-                            }
-                        ]
-                    }
-                ]
-            )
+            response = self._create_completion(messages)
             
             # 获取分析结果
             analysis_text = response.choices[0].message.content
-            print(f"AI原始返回结果: {analysis_text}")
+            logger.debug("AI原始返回结果: %s", analysis_text)
             
-            try:
-                # 尝试解析JSON
-                analysis_result = json.loads(analysis_text)
-                print(f"解析后的JSON结果: {json.dumps(analysis_result, ensure_ascii=False, indent=2)}")
-                
-                # 保存到缓存
-                self.save_cache(stock_code, analysis_result)
-                
-                return analysis_result
-                
-            except json.JSONDecodeError as e:
-                print(f"JSON解析失败: {str(e)}")
-                # 如果JSON解析失败，返回错误信息
-                error_result = {
-                    'stock_info': analysis_data.get('stock_info', {}),
-                    'valuation': analysis_data.get('valuation', {}),
-                    'profitability': analysis_data.get('profitability', {}),
-                    'growth': analysis_data.get('growth', {}),
-                    'operation': analysis_data.get('operation', {}),
-                    'solvency': analysis_data.get('solvency', {}),
-                    'cash_flow': analysis_data.get('cash_flow', {}),
-                    'per_share': analysis_data.get('per_share', {}),
-                    'analysis_result': {
-                        "error": "AI返回的结果不是有效的JSON格式",
-                        "raw_text": analysis_text
-                    }
-                }
-                return error_result
+            # 解析、校验并保存到缓存
+            analysis_result = self._finish_analysis('value', stock_code, messages, analysis_text, analysis_data)
+            logger.debug("解析后的JSON结果: %s", LazyJson(analysis_result))
+            return analysis_result
                 
         except Exception as e:
-            print(f"AI分析失败: {str(e)}")
+            logger.warning("AI分析失败: %s", e)
             return {"error": f"AI分析失败: {str(e)}"}
     
     def _parse_analysis_result(self, analysis_text, current_price):
@@ -177,13 +591,13 @@ class AIAnalysisService:
         解析AI返回的分析文本，提取结构化信息
         """
         try:
-            print(f"开始解析分析文本...")
+            logger.debug("开始解析分析文本...")
             
             # 提取投资建议
             suggestion_pattern = r"投资建议[：:]([\s\S]*?)(?=\n\n|$)"
             suggestion_match = re.search(suggestion_pattern, analysis_text, re.MULTILINE | re.DOTALL)
             investment_suggestion = suggestion_match.group(1).strip() if suggestion_match else ""
-            print(f"提取到的投资建议: {investment_suggestion}")
+            logger.debug("提取到的投资建议: %s", investment_suggestion)
             
             # 提取合理价格区间
             price_pattern = r"合理股价区间[：:]\s*(\d+\.?\d*)\s*[元-]\s*(\d+\.?\d*)[元]"
@@ -194,7 +608,7 @@ class AIAnalysisService:
             else:
                 price_min = current_price * 0.8
                 price_max = current_price * 1.2
-            print(f"提取到的价格区间: {price_min}-{price_max}")
+            logger.debug("提取到的价格区间: %s-%s", price_min, price_max)
             
             # 提取目标市值区间（单位：亿元）
             market_value_pattern = r"目标市值区间[：:]\s*(\d+\.?\d*)\s*[亿-]\s*(\d+\.?\d*)[亿]"
@@ -212,7 +626,7 @@ class AIAnalysisService:
                 else:
                     market_value_min = 0
                     market_value_max = 0
-            print(f"提取到的市值区间: {market_value_min}-{market_value_max}")
+            logger.debug("提取到的市值区间: %s-%s", market_value_min, market_value_max)
             
             # 提取各个分析维度的内容
             analysis_patterns = {
@@ -229,7 +643,7 @@ class AIAnalysisService:
                 # 移除markdown标记和多余的空白字符
                 content = re.sub(r'[#\-*]', '', content).strip()
                 analysis_results[key] = content
-                print(f"提取到的{key}: {content[:100]}...")
+                logger.debug("提取到的%s: %.100s...", key, content)
             
             return {
                 "investment_suggestion": investment_suggestion,
@@ -247,10 +661,7 @@ class AIAnalysisService:
             }
             
         except Exception as e:
-            print(f"解析分析结果失败: {str(e)}")
-            print(f"错误详情: {e.__class__.__name__}")
-            import traceback
-            print(f"错误堆栈: {traceback.format_exc()}")
+            logger.exception("解析分析结果失败: %s", e)
             return {
                 "investment_suggestion": "分析结果解析失败",
                 "analysis": {
@@ -369,6 +780,23 @@ class AIAnalysisService:
 - 每股经营现金流(OCFPS)：{format_number(per_share.get('ocfps'))}元
 - 每股未分配利润：{format_number(per_share.get('retained_eps'))}元"""
 
+        # 多期趋势指标（有财务历史时）
+        trend = data.get('trend')
+        if trend:
+            data_section += f"""
+
+多年趋势指标（最近{trend.get('years', 0)}个年报）：
+- 近3年平均ROE：{format_percent(trend.get('roe_avg_3y'))}
+- 近5年平均ROE：{format_percent(trend.get('roe_avg_5y'))}
+- 近5年最低ROE：{format_percent(trend.get('roe_min_5y'))}
+- 近5年平均毛利率：{format_percent(trend.get('gross_margin_avg_5y'))}（标准差{format_percent(trend.get('gross_margin_std_5y'))}）
+- 近5年平均净利率：{format_percent(trend.get('net_margin_avg_5y'))}（标准差{format_percent(trend.get('net_margin_std_5y'))}）
+- 每股收益3年/5年复合增长率：{format_percent(trend.get('eps_cagr_3y'))} / {format_percent(trend.get('eps_cagr_5y'))}
+- 扣非净利润3年/5年复合增长率：{format_percent(trend.get('profit_dedt_cagr_3y'))} / {format_percent(trend.get('profit_dedt_cagr_5y'))}
+- 每股营收3年复合增长率：{format_percent(trend.get('total_revenue_ps_cagr_3y'))}
+- 每股收益(TTM)：{format_number(trend.get('eps_ttm'))}元
+- 每股经营现金流(TTM)：{format_number(trend.get('ocfps_ttm'))}元"""
+
         # 构建分析要求部分
         analysis_requirements = """
 请基于以上数据，从价值投资的角度进行分析。请特别注意：
@@ -407,6 +835,15 @@ class AIAnalysisService:
         return prompt 
 
     def analyze_tao_philosophy(self, company_info: dict, force_refresh: bool = False):
+        """基于道德经理念分析公司，相同输入的并发请求共享一次模型调用"""
+        stock_code = company_info.get('basic_info', {}).get('code')
+        if not stock_code:
+            return self._analyze_tao_philosophy(company_info, force_refresh)
+        return self._single_flight('tao', stock_code, (company_info,),
+                                   lambda: self._analyze_tao_philosophy(company_info, force_refresh),
+                                   force_refresh)
+
+    def _analyze_tao_philosophy(self, company_info: dict, force_refresh: bool = False):
         """
         基于道德经理念分析公司
         :param company_info: 公司信息
@@ -418,43 +855,25 @@ class AIAnalysisService:
             
             # 如果不是强制刷新，尝试从缓存加载
             if not force_refresh and stock_code:
-                cached_result = self.load_dao_cache(stock_code)
+                cached_result = self.load_cache('tao', stock_code, company_info)
                 if cached_result:
-                    print(f"从缓存加载道德经分析结果: {stock_code}")
+                    logger.debug("从缓存加载道德经分析结果: %s", stock_code)
                     return cached_result
             
             # 构建提示词
-            prompt = self._build_tao_analysis_prompt(company_info)
+            messages = self._build_messages('tao', company_info)
             
             # 调用API
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {
-                        "role": "user",
-                        "content": prompt
-                    }
-                ]
-            )
+            response = self._create_completion(messages)
             
             # 获取分析结果
             analysis_text = response.choices[0].message.content
             
-            try:
-                # 解析JSON结果
-                analysis_result = json.loads(analysis_text)
-                
-                # 保存到缓存
-                if stock_code:
-                    self.save_dao_cache(stock_code, analysis_result)
-                
-                return analysis_result
-            except json.JSONDecodeError as e:
-                print(f"道德经分析结果JSON解析失败: {str(e)}")
-                return {"error": "分析结果格式错误"}
+            # 解析、校验并保存到缓存
+            return self._finish_analysis('tao', stock_code, messages, analysis_text, company_info)
                 
         except Exception as e:
-            print(f"道德经分析失败: {str(e)}")
+            logger.warning("道德经分析失败: %s", e)
             return {"error": f"道德经分析失败: {str(e)}"}
     
     def _build_tao_analysis_prompt(self, company_info: dict):
@@ -502,6 +921,15 @@ class AIAnalysisService:
         return prompt 
 
     def analyze_by_masters(self, company_info: dict, value_analysis: dict, force_refresh: bool = False):
+        """基于各位价值投资大咖的理念分析公司，相同输入的并发请求共享一次模型调用"""
+        stock_code = company_info.get('basic_info', {}).get('code')
+        if not stock_code:
+            return self._analyze_by_masters(company_info, value_analysis, force_refresh)
+        return self._single_flight('masters', stock_code, (company_info, value_analysis),
+                                   lambda: self._analyze_by_masters(company_info, value_analysis, force_refresh),
+                                   force_refresh)
+
+    def _analyze_by_masters(self, company_info: dict, value_analysis: dict, force_refresh: bool = False):
         """
         基于各位价值投资大咖的理念分析公司
         :param company_info: 公司信息
@@ -514,52 +942,36 @@ class AIAnalysisService:
             
             # 如果不是强制刷新，尝试从缓存加载
             if not force_refresh and stock_code:
-                cached_result = self.load_daka_cache(stock_code)
+                cached_result = self.load_cache('masters', stock_code, company_info, value_analysis)
                 if cached_result:
-                    print(f"从缓存加载大咖分析结果: {stock_code}")
+                    logger.debug("从缓存加载大咖分析结果: %s", stock_code)
                     return cached_result
             
             # 打印输入数据用于调试
-            print(f"公司信息: {json.dumps(company_info, ensure_ascii=False, indent=2)}")
-            print(f"价值分析数据: {json.dumps(value_analysis, ensure_ascii=False, indent=2)}")
+            logger.debug("公司信息: %s", LazyJson(company_info))
+            logger.debug("价值分析数据: %s", LazyJson(value_analysis))
             
             # 构建提示词
-            prompt = self._build_masters_analysis_prompt(company_info, value_analysis)
+            messages = self._build_messages('masters', company_info, value_analysis)
             
             # 打印提示词用于调试
-            print(f"大咖分析提示词: {prompt}")
+            logger.debug("大咖分析提示词: %s", messages[0]['content'])
             
             # 调用API
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {
-                        "role": "user",
-                        "content": prompt
-                    }
-                ]
-            )
+            response = self._create_completion(messages)
             
             # 获取分析结果
             analysis_text = response.choices[0].message.content
-            print(f"AI原始返回结果: {analysis_text}")
+            logger.debug("AI原始返回结果: %s", analysis_text)
             
-            try:
-                # 解析JSON结果
-                analysis_result = json.loads(analysis_text)
-                print(f"解析后的JSON结果: {json.dumps(analysis_result, ensure_ascii=False, indent=2)}")
-                
-                # 保存到缓存
-                if stock_code:
-                    self.save_daka_cache(stock_code, analysis_result)
-                
-                return analysis_result
-            except json.JSONDecodeError as e:
-                print(f"大咖分析结果JSON解析失败: {str(e)}")
-                return {"error": "分析结果格式错误"}
+            # 解析、校验并保存到缓存
+            analysis_result = self._finish_analysis('masters', stock_code, messages, analysis_text,
+                                                    company_info, value_analysis)
+            logger.debug("解析后的JSON结果: %s", LazyJson(analysis_result))
+            return analysis_result
                 
         except Exception as e:
-            print(f"价值投资大咖分析失败: {str(e)}")
+            logger.warning("价值投资大咖分析失败: %s", e)
             return {"error": f"价值投资大咖分析失败: {str(e)}"}
     
     def _build_masters_analysis_prompt(self, company_info: dict, value_analysis: dict):
@@ -0,0 +1,237 @@
+import asyncio
+import time
+import uuid
+from collections import OrderedDict
+from app.config import Config
+from app.services.executor import run_blocking, TUSHARE, LLM, LOCAL
+from app.services.metrics import set_endpoint, reset_endpoint
+
+
+class AIJobQueue:
+    """
+    AI分析后台任务队列
+    提交后立即返回任务id，由固定数量的worker依次执行；同一模型同时进行的分析数受限，给页面上的实时分析留出AI线程池
+    任务调用AIAnalysisService对应的分析方法，结果写入原有的分析缓存，页面打开时直接命中
+    """
+
+    # 分析类型对应的AIAnalysisService方法
+    ANALYZERS = {
+        'value': 'analyze_value_investment',
+        'tao': 'analyze_tao_philosophy',
+        'masters': 'analyze_by_masters',
+    }
+    FINISHED = ('done', 'cached', 'failed')
+
+    def __init__(self, stock_service, ai_service):
+        self.stock_service = stock_service
+        self.ai_service = ai_service
+        self.jobs = OrderedDict()
+        # {批次id: {"job_ids": [...], "remaining": 未清理的任务数, "pruned": 已清理任务的状态计数, "failures": 已清理的失败任务}}
+        self.batches = {}
+        # {任务id: 所属批次id集合}，同一任务可能被多个批次共用
+        self._job_batches = {}
+        self._active = {}
+        self._queue = None
+        self._workers = []
+        self._model_limits = {}
+
+    async def start(self):
+        if self._workers:
+            return
+        self._queue = asyncio.Queue(maxsize=Config.AI_JOB_QUEUE_SIZE)
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(Config.AI_JOB_WORKERS)]
+
+    async def stop(self):
+        """停止worker，执行中和排队中的任务标记为失败"""
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self._queue = None
+        now = time.time()
+        for job in self.jobs.values():
+            if job["status"] not in self.FINISHED:
+                job["status"] = "failed"
+                job["error"] = "任务队列已停止，任务已取消"
+                job["finished_at"] = now
+        self._active.clear()
+
+    def _model_limit(self, model: str) -> asyncio.Semaphore:
+        semaphore = self._model_limits.get(model)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(Config.AI_JOB_MODEL_CONCURRENCY.get(model, Config.AI_JOB_DEFAULT_CONCURRENCY))
+            self._model_limits[model] = semaphore
+        return semaphore
+
+    def submit(self, kind: str, stock_code: str, force_refresh: bool = False, batch_id: str = None) -> dict:
+        """
+        提交分析任务，同一股票同类分析已在排队或执行时返回已有任务
+        :return: 任务信息，队列已满或参数错误时返回带error的dict
+        """
+        if kind not in self.ANALYZERS:
+            return {"error": f"不支持的分析类型: {kind}"}
+        if self._queue is None:
+            return {"error": "AI任务队列未启动"}
+
+        job_id = self._active.get((kind, stock_code))
+        if job_id is not None:
+            return self.jobs[job_id]
+
+        job = {
+            "id": uuid.uuid4().hex[:12],
+            "kind": kind,
+            "stock_code": stock_code,
+            "force_refresh": force_refresh,
+            "batch_id": batch_id,
+            "status": "queued",
+            "error": None,
+            "created_at": time.time(),
+            "started_at": None,
+            "finished_at": None
+        }
+        try:
+            self._queue.put_nowait(job["id"])
+        except asyncio.QueueFull:
+            return {"error": "AI任务队列已满，请稍后再试"}
+        self.jobs[job["id"]] = job
+        self._active[(kind, stock_code)] = job["id"]
+        self._prune()
+        return job
+
+    def submit_watchlist(self, kinds: list, force_refresh: bool = False) -> dict:
+        """为监控列表中的所有股票提交分析任务"""
+        batch_id = uuid.uuid4().hex[:12]
+        job_ids = []
+        rejected = 0
+        for stock_code in list(self.stock_service.watchlist_snapshot()):
+            for kind in kinds:
+                job = self.submit(kind, stock_code, force_refresh, batch_id)
+                if "id" not in job:
+                    rejected += 1
+                else:
+                    job_ids.append(job["id"])
+                    self._job_batches.setdefault(job["id"], set()).add(batch_id)
+        self.batches[batch_id] = {
+            "job_ids": job_ids,
+            "remaining": len(job_ids),
+            "pruned": dict.fromkeys(self.FINISHED, 0),
+            "failures": []
+        }
+        return {"batch_id": batch_id, "submitted": len(job_ids), "rejected": rejected}
+
+    def _prune(self):
+        """
+        只保留最近的已完成任务
+        清理的任务按状态计入所属批次，批次的任务全部清理后删除批次
+        """
+        finished = [job_id for job_id, job in self.jobs.items() if job["status"] in self.FINISHED]
+        for job_id in finished[:max(0, len(finished) - Config.AI_JOB_HISTORY)]:
+            job = self.jobs.pop(job_id)
+            for batch_id in self._job_batches.pop(job_id, ()):
+                batch = self.batches.get(batch_id)
+                if batch is None:
+                    continue
+                batch["remaining"] -= 1
+                if batch["remaining"] <= 0:
+                    del self.batches[batch_id]
+                    continue
+                batch["pruned"][job["status"]] += 1
+                if job["status"] == "failed":
+                    batch["failures"].append(self._failure(job))
+
+    def get_job(self, job_id: str):
+        return self.jobs.get(job_id)
+
+    def batch_status(self, batch_id: str):
+        """批量任务的进度"""
+        batch = self.batches.get(batch_id)
+        if batch is None:
+            return None
+        job_ids = batch["job_ids"]
+        counts = {"queued": 0, "running": 0, **batch["pruned"]}
+        failed = list(batch["failures"])
+        for job_id in job_ids:
+            job = self.jobs.get(job_id)
+            if job is None:
+                continue
+            counts[job["status"]] += 1
+            if job["status"] == "failed":
+                failed.append(self._failure(job))
+        finished = counts["done"] + counts["cached"] + counts["failed"]
+        return {
+            "batch_id": batch_id,
+            "total": len(job_ids),
+            "finished": finished,
+            "progress": round(finished / len(job_ids), 4) if job_ids else 1.0,
+            **counts,
+            "failures": failed
+        }
+
+    @staticmethod
+    def _failure(job: dict) -> dict:
+        return {"stock_code": job["stock_code"], "kind": job["kind"], "error": job["error"]}
+
+    def status(self) -> dict:
+        """队列整体情况"""
+        counts = {"queued": 0, "running": 0, "done": 0, "cached": 0, "failed": 0}
+        for job in self.jobs.values():
+            counts[job["status"]] += 1
+        return {
+            "workers": len(self._workers),
+            "queue_depth": self._queue.qsize() if self._queue else 0,
+            **counts
+        }
+
+    async def load_inputs(self, kind: str, stock_code: str, force_refresh: bool = False):
+        """获取分析所需的输入数据，返回参数列表，失败时返回带error的dict"""
+        if kind == 'value':
+            analysis_data = await run_blocking(TUSHARE, self.stock_service.get_value_analysis_data, stock_code, force_refresh)
+            return analysis_data if "error" in analysis_data else [analysis_data]
+        company_info = await run_blocking(TUSHARE, self.stock_service.get_company_detail, stock_code, force_refresh)
+        if "error" in company_info or kind == 'tao':
+            return company_info if "error" in company_info else [company_info]
+        value_analysis = await run_blocking(TUSHARE, self.stock_service.get_value_analysis_data, stock_code, force_refresh)
+        return value_analysis if "error" in value_analysis else [company_info, value_analysis]
+
+    async def _worker(self):
+        while True:
+            job_id = await self._queue.get()
+            job = self.jobs.get(job_id)
+            token = set_endpoint(f"ai_job:{job['kind']}" if job else "ai_job")
+            try:
+                if job is not None:
+                    await self._run(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                job["status"] = "failed"
+                job["error"] = str(e)
+            finally:
+                if job is not None:
+                    job["finished_at"] = time.time()
+                    self._active.pop((job["kind"], job["stock_code"]), None)
+                reset_endpoint(token)
+                self._queue.task_done()
+
+    async def _run(self, job: dict):
+        job["status"] = "running"
+        job["started_at"] = time.time()
+        inputs = await self.load_inputs(job["kind"], job["stock_code"], job["force_refresh"])
+        if isinstance(inputs, dict):
+            job["status"] = "failed"
+            job["error"] = inputs["error"]
+            return
+
+        if not job["force_refresh"] and await run_blocking(LOCAL, self.ai_service.load_cache, job["kind"], job["stock_code"], *inputs):
+            job["status"] = "cached"
+            return
+
+        analyze = getattr(self.ai_service, self.ANALYZERS[job["kind"]])
+        async with self._model_limit(self.ai_service.model):
+            result = await run_blocking(LLM, analyze, *inputs, job["force_refresh"])
+
+        if self.ai_service.is_failed(result):
+            job["status"] = "failed"
+            job["error"] = result.get("error", "AI返回的结果不是有效的JSON格式，仅保存了文本提取结果")
+        else:
+            job["status"] = "done"
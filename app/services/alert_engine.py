@@ -0,0 +1,204 @@
+import json
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import numpy as np
+import requests
+from app.config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class FileSink:
+    """把提醒逐行（JSON）追加到本地文件，供其他程序读取"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def send(self, events: list):
+        with self._lock, open(self.path, 'a', encoding='utf-8') as f:
+            for event in events:
+                f.write(json.dumps(event, ensure_ascii=False) + '\n')
+
+
+class WebhookSink:
+    """把提醒POST到webhook，在独立线程中发送，不阻塞行情刷新"""
+
+    def __init__(self, url: str, timeout: float = 10):
+        self.url = url
+        self.timeout = timeout
+        self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="alert-webhook")
+
+    def send(self, events: list):
+        self._pool.submit(self._post, events)
+
+    def _post(self, events: list):
+        try:
+            requests.post(self.url, json={"events": events}, timeout=self.timeout).raise_for_status()
+        except Exception as e:
+            logger.warning("发送市值提醒到webhook失败: %s", e)
+
+
+class AlertEngine:
+    """
+    目标市值提醒：每次行情刷新后，把监控列表中股票的总市值与目标市值区间比较，越出或回到区间时产生提醒
+    - 每只股票处于区间下方、区间内、区间上方三种状态之一，状态变化才产生提醒；
+      越界和回到区间都要超过边界ALERT_HYSTERESIS（比例），市值在边界附近波动时不会反复提醒
+    - 只计算市值或目标区间发生变化的股票，计算按数组整体进行
+    - 提醒追加到持久日志（ALERT_LOG_FILE），并交给各个sink（本地文件、webhook）
+    - 各股票的状态保存在缓存库中，重启后不会重复提醒
+    """
+
+    BELOW, INSIDE, ABOVE = -1, 0, 1
+    # 状态变化对应的提醒类型
+    EVENT_TYPES = {BELOW: 'below_min', INSIDE: 'back_in_band', ABOVE: 'above_max'}
+    STATE_NAMESPACE = 'alert_state'
+
+    def __init__(self, cache_store, sinks: list = None, log_file: str = None):
+        self.cache_store = cache_store
+        self.sinks = list(sinks or [])
+        self.log_file = log_file or Config.ALERT_LOG_FILE
+        self._lock = threading.Lock()
+        # {股票代码: {"zone": 状态, "inputs": [市值, 下限, 上限]}}
+        self._state = {}
+        self._recent = deque(maxlen=Config.ALERT_RECENT_SIZE)
+        self._load_recent()
+
+    @classmethod
+    def from_config(cls, cache_store):
+        sinks = []
+        if Config.ALERT_FILE_SINK:
+            sinks.append(FileSink(Config.ALERT_FILE_SINK))
+        if Config.ALERT_WEBHOOK_URL:
+            sinks.append(WebhookSink(Config.ALERT_WEBHOOK_URL))
+        return cls(cache_store, sinks)
+
+    def _load_recent(self):
+        """启动时从持久日志读取最近的提醒"""
+        try:
+            with open(self.log_file, 'r', encoding='utf-8') as f:
+                for line in f:
+                    if line.strip():
+                        self._recent.append(json.loads(line))
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning("读取市值提醒日志失败: %s", e)
+
+    def _load_state(self, stock_codes: list):
+        """首次遇到的股票从缓存库读取上次的状态"""
+        missing = [stock_code for stock_code in stock_codes if stock_code not in self._state]
+        if not missing:
+            return
+        for stock_code, entry in self.cache_store.get_many(self.STATE_NAMESPACE, missing).items():
+            self._state[stock_code] = entry['data']
+
+    @staticmethod
+    def _band(targets: dict):
+        band = (targets or {}).get("target_market_value") or {}
+        return band.get("min"), band.get("max")
+
+    def evaluate(self, results: dict, watchlist: dict) -> list:
+        """
+        用最新行情评估提醒，返回新产生的提醒
+        :param results: get_stock_info_many的返回值
+        :param watchlist: 股票代码 -> 目标市值设置
+        """
+        with self._lock:
+            candidates = {}
+            for stock_code, data in results.items():
+                if not data or "error" in data or stock_code not in watchlist:
+                    continue
+                market_value = data["stock_info"].get("market_value")
+                low, high = self._band(watchlist[stock_code])
+                if market_value is None or (low is None and high is None):
+                    continue
+                candidates[stock_code] = (data["stock_info"].get("name", ""), float(market_value), low, high)
+            self._load_state(list(candidates))
+
+            # 只重新计算市值或区间变化的股票
+            changed = [
+                stock_code for stock_code, (_, market_value, low, high) in candidates.items()
+                if self._state.get(stock_code, {}).get("inputs") != [market_value, low, high]
+            ]
+            if not changed:
+                return []
+
+            values = np.array([candidates[code][1] for code in changed], dtype='f8')
+            lows = np.array([np.nan if candidates[code][2] is None else candidates[code][2] for code in changed], dtype='f8')
+            highs = np.array([np.nan if candidates[code][3] is None else candidates[code][3] for code in changed], dtype='f8')
+            zones = np.array([self._state.get(code, {}).get("zone", self.INSIDE) for code in changed], dtype='i1')
+            new_zones = self.next_zones(values, lows, highs, zones, Config.ALERT_HYSTERESIS)
+
+            now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            events, updates = [], {}
+            for i, stock_code in enumerate(changed):
+                name, market_value, low, high = candidates[stock_code]
+                zone = int(new_zones[i])
+                if zone != zones[i]:
+                    events.append({
+                        "time": now,
+                        "code": stock_code,
+                        "name": name,
+                        "type": self.EVENT_TYPES[zone],
+                        "market_value": market_value,
+                        "min": low,
+                        "max": high
+                    })
+                state = {"zone": zone, "inputs": [market_value, low, high]}
+                self._state[stock_code] = state
+                updates[stock_code] = state
+            self.cache_store.put_many(self.STATE_NAMESPACE, updates, now)
+
+            if events:
+                self._record(events)
+        return events
+
+    @classmethod
+    def next_zones(cls, values: np.ndarray, lows: np.ndarray, highs: np.ndarray, zones: np.ndarray,
+                   hysteresis: float) -> np.ndarray:
+        """
+        按当前状态和滞回比例计算新状态（整列计算，未设置的边界为NaN，比较结果为False）
+        进入区间上方要高于上限×(1+h)，从上方回到区间要低于上限×(1-h)；下限方向对称
+        """
+        up = 1 + hysteresis
+        down = 1 - hysteresis
+        above = np.where(zones == cls.ABOVE, values >= highs * down, values > highs * up)
+        below = np.where(zones == cls.BELOW, values <= lows * up, values < lows * down)
+        return np.select([above, below], [cls.ABOVE, cls.BELOW], default=cls.INSIDE).astype('i1')
+
+    def _record(self, events: list):
+        """写入持久日志，交给各个sink"""
+        try:
+            with open(self.log_file, 'a', encoding='utf-8') as f:
+                for event in events:
+                    f.write(json.dumps(event, ensure_ascii=False) + '\n')
+        except Exception as e:
+            logger.warning("写入市值提醒日志失败: %s", e)
+        self._recent.extend(events)
+        for event in events:
+            logger.info("市值提醒 %s %s: %s 市值%s亿", event["code"], event["name"], event["type"], event["market_value"])
+        for sink in self.sinks:
+            try:
+                sink.send(events)
+            except Exception as e:
+                logger.warning("市值提醒发送失败（%s）: %s", type(sink).__name__, e)
+
+    def forget(self, stock_code: str):
+        """股票移出监控列表后清除状态，重新加入时重新判断"""
+        with self._lock:
+            self._state.pop(stock_code, None)
+            self.cache_store.delete(self.STATE_NAMESPACE, stock_code)
+
+    def recent(self, limit: int = 100) -> list:
+        """最近的提醒，新的在前"""
+        return list(self._recent)[::-1][:limit]
+
+    def zones(self) -> dict:
+        """各股票当前所处的状态"""
+        names = {self.BELOW: 'below', self.INSIDE: 'inside', self.ABOVE: 'above'}
+        with self._lock:
+            return {stock_code: names[state["zone"]] for stock_code, state in self._state.items()}
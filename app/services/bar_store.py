@@ -0,0 +1,203 @@
+import json
+import logging
+import os
+import threading
+from datetime import datetime, timedelta
+import numpy as np
+import pandas as pd
+from app import pro
+from app.config import Config
+from app.services.metrics import track_cache
+from app.services.trading_session import TradingSession
+
+logger = logging.getLogger(__name__)
+
+
+class BarStore:
+    """
+    本地日线库：每个代码一个定长二进制记录文件（按日期升序），读取时用np.memmap映射，按日期二分查找任意区间
+    - 首次出现的代码回填BAR_BACKFILL_DAYS天的历史（一次按代码的区间查询）
+    - 之后每个新交易日只追加一次：股票用按trade_date的一次daily批量查询覆盖库中所有股票；
+      index_daily必须指定代码，指数按代码从上次的最后日期增量拉取
+    - 缺的交易日过多时（如长时间未同步），改为按代码区间补齐
+    """
+
+    DTYPE = np.dtype([
+        ('date', '<i4'), ('open', '<f8'), ('high', '<f8'), ('low', '<f8'),
+        ('close', '<f8'), ('pct_chg', '<f8'), ('vol', '<f8'), ('amount', '<f8')
+    ])
+    FIELDS = 'ts_code,trade_date,open,high,low,close,pct_chg,vol,amount'
+    # 数据类型对应的tushare接口
+    APIS = {'stock': 'daily', 'index': 'index_daily'}
+
+    def __init__(self, directory: str = None, session: TradingSession = None):
+        self.directory = directory or Config.BAR_STORE_DIR
+        self.session = session or TradingSession()
+        self._lock = threading.Lock()
+        self._meta_path = os.path.join(self.directory, 'meta.json')
+        for kind in self.APIS:
+            os.makedirs(os.path.join(self.directory, kind), exist_ok=True)
+        self._meta = self._load_meta()
+
+    def _load_meta(self) -> dict:
+        try:
+            with open(self._meta_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            logger.warning("读取日线库状态失败: %s", e)
+            return {}
+
+    def _save_meta(self):
+        tmp_path = f"{self._meta_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._meta, f)
+        os.replace(tmp_path, self._meta_path)
+
+    def _path(self, kind: str, ts_code: str) -> str:
+        return os.path.join(self.directory, kind, f"{ts_code}.bin")
+
+    def codes(self, kind: str) -> list:
+        """库中已有的代码"""
+        return [name[:-len('.bin')] for name in os.listdir(os.path.join(self.directory, kind)) if name.endswith('.bin')]
+
+    def read(self, kind: str, ts_code: str) -> np.ndarray:
+        """映射整个文件（只读），不存在时返回空数组；只映射完整的记录，追加中的半条记录不可见"""
+        path = self._path(kind, ts_code)
+        try:
+            count = os.path.getsize(path) // self.DTYPE.itemsize
+        except FileNotFoundError:
+            count = 0
+        if count == 0:
+            return np.empty(0, dtype=self.DTYPE)
+        return np.memmap(path, dtype=self.DTYPE, mode='r', shape=(count,))
+
+    def last_date(self, kind: str, ts_code: str):
+        """最后一条记录的日期（YYYYMMDD整数），没有数据时返回None"""
+        bars = self.read(kind, ts_code)
+        return int(bars['date'][-1]) if len(bars) else None
+
+    def window(self, kind: str, ts_code: str, start: str = None, end: str = None, limit: int = None) -> list:
+        """
+        读取[start, end]区间的日线（YYYYMMDD，均可省略），按日期升序
+        :param limit: 只返回区间内最近的limit条
+        """
+        with track_cache(f"bars:{kind}", 'window'):
+            bars = self.read(kind, ts_code)
+            dates = bars['date']
+            lo = np.searchsorted(dates, int(start), 'left') if start else 0
+            hi = np.searchsorted(dates, int(end), 'right') if end else len(bars)
+            if limit:
+                lo = max(lo, hi - limit)
+            selected = np.array(bars[lo:hi])
+        return [
+            {"date": str(row[0]), **{name: float(row[i]) for i, name in enumerate(self.DTYPE.names) if i}}
+            for row in selected.tolist()
+        ]
+
+    def _to_records(self, df: pd.DataFrame) -> np.ndarray:
+        """tushare返回的日线转换为按日期升序、日期不重复的记录数组"""
+        if df is None or df.empty:
+            return np.empty(0, dtype=self.DTYPE)
+        df = df.drop_duplicates('trade_date').sort_values('trade_date')
+        records = np.empty(len(df), dtype=self.DTYPE)
+        records['date'] = df['trade_date'].astype(int).to_numpy()
+        for name in self.DTYPE.names[1:]:
+            records[name] = pd.to_numeric(df[name], errors='coerce').fillna(0).to_numpy(dtype='f8')
+        return records
+
+    def _append(self, kind: str, ts_code: str, records: np.ndarray) -> int:
+        """只追加比已有最后日期更新的记录，返回追加的条数"""
+        with self._lock:
+            last = self.last_date(kind, ts_code)
+            if last is not None:
+                records = records[records['date'] > last]
+            if len(records):
+                with track_cache(f"bars:{kind}", 'append'), open(self._path(kind, ts_code), 'ab') as f:
+                    f.write(records.tobytes())
+            return len(records)
+
+    def _fetch_range(self, kind: str, ts_code: str, start: str, end: str) -> np.ndarray:
+        df = getattr(pro, self.APIS[kind])(ts_code=ts_code, start_date=start, end_date=end, fields=self.FIELDS)
+        return self._to_records(df)
+
+    def backfill(self, kind: str, ts_code: str) -> int:
+        """库中没有的代码回填历史，返回写入的条数"""
+        if self.last_date(kind, ts_code) is not None:
+            return 0
+        end = self.session.last_settled_day()
+        start = end - timedelta(days=Config.BAR_BACKFILL_DAYS)
+        return self._append(kind, ts_code, self._fetch_range(kind, ts_code, start.strftime('%Y%m%d'), end.strftime('%Y%m%d')))
+
+    def ensure(self, kind: str, ts_code: str):
+        """按需准备单个代码：没有数据时回填，已有数据时补齐到最近一个已入库的交易日"""
+        last = self.last_date(kind, ts_code)
+        if last is None:
+            self.backfill(kind, ts_code)
+            return
+        through = self.session.last_settled_day()
+        if last < int(through.strftime('%Y%m%d')) and not self._synced(kind, through):
+            start = datetime.strptime(str(last), '%Y%m%d') + timedelta(days=1)
+            self._append(kind, ts_code, self._fetch_range(kind, ts_code, start.strftime('%Y%m%d'), through.strftime('%Y%m%d')))
+
+    def _synced(self, kind: str, through) -> bool:
+        synced = self._meta.get(kind)
+        return synced is not None and synced >= through.strftime('%Y%m%d')
+
+    def sync(self, kind: str, ts_codes: list = ()) -> dict:
+        """
+        回填ts_codes中的新代码，并把库中所有代码追加到最近一个已入库的交易日
+        :return: 回填的代码数、追加的记录数
+        """
+        backfilled = 0
+        for ts_code in ts_codes:
+            try:
+                if self.backfill(kind, ts_code):
+                    backfilled += 1
+            except Exception as e:
+                logger.warning("回填 %s 日线失败: %s", ts_code, e)
+
+        through = self.session.last_settled_day()
+        if self._synced(kind, through):
+            return {"backfilled": backfilled, "appended": 0}
+
+        codes = self.codes(kind)
+        lasts = {ts_code: self.last_date(kind, ts_code) for ts_code in codes}
+        lasts = {ts_code: last for ts_code, last in lasts.items() if last is not None}
+        if not lasts:
+            return {"backfilled": backfilled, "appended": 0}
+        synced = self._meta.get(kind) or str(min(lasts.values()))
+        days = self.session.trading_days_between(datetime.strptime(synced, '%Y%m%d').date(), through)
+
+        appended = 0
+        synced_through = through
+        if kind == 'stock' and days and len(days) <= Config.BAR_BULK_MAX_DAYS:
+            # 每个交易日一次批量查询，覆盖库中所有股票
+            for day in days:
+                df = pro.daily(trade_date=day.strftime('%Y%m%d'), fields=self.FIELDS)
+                if df.empty:
+                    if day == days[-1]:
+                        # 最近一天的数据可能尚未发布，下次同步时重试
+                        synced_through = day - timedelta(days=1)
+                    continue
+                df = df[df['ts_code'].isin(lasts)]
+                for ts_code, rows in df.groupby('ts_code'):
+                    appended += self._append(kind, ts_code, self._to_records(rows))
+        else:
+            through_str = through.strftime('%Y%m%d')
+            for ts_code, last in lasts.items():
+                if last >= int(through_str):
+                    continue
+                start = datetime.strptime(str(last), '%Y%m%d') + timedelta(days=1)
+                try:
+                    appended += self._append(kind, ts_code, self._fetch_range(kind, ts_code, start.strftime('%Y%m%d'), through_str))
+                except Exception as e:
+                    logger.warning("补齐 %s 日线失败: %s", ts_code, e)
+                    synced_through = min(synced_through, start.date() - timedelta(days=1))
+
+        with self._lock:
+            self._meta[kind] = synced_through.strftime('%Y%m%d')
+            self._save_meta()
+        logger.info("%s日线同步到 %s，追加 %s 条", kind, self._meta[kind], appended)
+        return {"backfilled": backfilled, "appended": appended}
@@ -0,0 +1,158 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from app.services.metrics import track_cache
+
+
+class CacheStore:
+    """
+    基于SQLite（WAL模式）的键值缓存
+    按(namespace, key)逐条写入，每次写入是一个独立事务，读取时只加载需要的键
+    每条缓存可带过期时间expires_at（Unix时间戳），为空表示不过期
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS cache (
+                    namespace TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    data TEXT NOT NULL,
+                    timestamp TEXT NOT NULL,
+                    updated_at REAL NOT NULL,
+                    expires_at REAL,
+                    PRIMARY KEY (namespace, key)
+                )
+            """)
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            # 兼容没有expires_at列的旧库
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(cache)")]
+            if 'expires_at' not in columns:
+                conn.execute("ALTER TABLE cache ADD COLUMN expires_at REAL")
+
+    def _connect(self) -> sqlite3.Connection:
+        """每个线程使用独立的连接"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def is_fresh(entry, now: float = None) -> bool:
+        """缓存条目是否存在且未过期"""
+        if not entry:
+            return False
+        expires_at = entry.get('expires_at')
+        return expires_at is None or expires_at > (time.time() if now is None else now)
+
+    def get(self, namespace: str, key: str):
+        """读取单条缓存，返回{'data': ..., 'timestamp': ..., 'expires_at': ...}，不存在返回None"""
+        with track_cache(f"sqlite:{namespace}", 'get'):
+            row = self._connect().execute(
+                "SELECT data, timestamp, expires_at FROM cache WHERE namespace = ? AND key = ?",
+                (namespace, key)
+            ).fetchone()
+            if row is None:
+                return None
+            return {'data': json.loads(row[0]), 'timestamp': row[1], 'expires_at': row[2]}
+
+    def get_many(self, namespace: str, keys: list) -> dict:
+        """批量读取缓存，只返回存在的键"""
+        keys = list(keys)
+        result = {}
+        with track_cache(f"sqlite:{namespace}", 'get_many'):
+            # SQLite单条语句的参数个数有限，分批查询
+            for i in range(0, len(keys), 500):
+                chunk = keys[i:i + 500]
+                rows = self._connect().execute(
+                    f"SELECT key, data, timestamp, expires_at FROM cache WHERE namespace = ? AND key IN ({','.join('?' * len(chunk))})",
+                    (namespace, *chunk)
+                ).fetchall()
+                for key, data, timestamp, expires_at in rows:
+                    result[key] = {'data': json.loads(data), 'timestamp': timestamp, 'expires_at': expires_at}
+        return result
+
+    def put(self, namespace: str, key: str, data, timestamp: str, expires_at: float = None):
+        """写入或更新单条缓存"""
+        self.put_many(namespace, {key: data}, timestamp, expires_at)
+
+    def put_many(self, namespace: str, items: dict, timestamp: str, expires_at=None):
+        """
+        在一个事务中写入或更新多条缓存
+        :param expires_at: 过期时间戳，可以是统一的数值，也可以是{key: 过期时间戳}
+        """
+        now = time.time()
+        with track_cache(f"sqlite:{namespace}", 'put_many'):
+            rows = [
+                (namespace, key, json.dumps(data, ensure_ascii=False), timestamp, now,
+                 expires_at.get(key) if isinstance(expires_at, dict) else expires_at)
+                for key, data in items.items()
+            ]
+            with self._connect() as conn:
+                conn.executemany("""
+                    INSERT INTO cache (namespace, key, data, timestamp, updated_at, expires_at) VALUES (?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(namespace, key) DO UPDATE SET
+                        data = excluded.data, timestamp = excluded.timestamp,
+                        updated_at = excluded.updated_at, expires_at = excluded.expires_at
+                """, rows)
+
+    def delete(self, namespace: str, key: str):
+        """删除单条缓存"""
+        with track_cache(f"sqlite:{namespace}", 'delete'):
+            with self._connect() as conn:
+                conn.execute("DELETE FROM cache WHERE namespace = ? AND key = ?", (namespace, key))
+
+    def keys(self, namespace: str) -> list:
+        """列出命名空间下的所有键"""
+        with track_cache(f"sqlite:{namespace}", 'keys'):
+            rows = self._connect().execute("SELECT key FROM cache WHERE namespace = ?", (namespace,)).fetchall()
+        return [row[0] for row in rows]
+
+    def migrate_from_json(self, json_path: str, convert) -> int:
+        """
+        一次性把旧版的整文件JSON缓存（{key: {'data': ..., 'timestamp': ...}}）导入缓存库
+        导入和完成标记在同一个事务中写入，失败时下次启动重试；成功后重复调用不会再次导入
+        :param convert: 由旧文件内容生成(namespace, key, data, timestamp, expires_at)的函数
+        :return: 导入的条目数
+        """
+        marker = f"migrated:{os.path.abspath(json_path)}"
+        conn = self._connect()
+        if conn.execute("SELECT 1 FROM meta WHERE key = ?", (marker,)).fetchone():
+            return 0
+        rows = []
+        if os.path.exists(json_path):
+            with open(json_path, 'r', encoding='utf-8') as f:
+                legacy = json.load(f)
+            now = time.time()
+            rows = [
+                (namespace, key, json.dumps(data, ensure_ascii=False), timestamp, now, expires_at)
+                for namespace, key, data, timestamp, expires_at in convert(legacy)
+            ]
+        with conn:
+            # 已存在的新数据优先，不被旧文件覆盖
+            count = conn.executemany("""
+                INSERT OR IGNORE INTO cache (namespace, key, data, timestamp, updated_at, expires_at) VALUES (?, ?, ?, ?, ?, ?)
+            """, rows).rowcount if rows else 0
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (marker, str(time.time())))
+        return count
+
+    def drop_namespace_once(self, namespace: str) -> int:
+        """
+        一次性删除整个命名空间（用于废弃的缓存格式），完成后在meta表中记录，重复调用不会再次删除
+        :return: 删除的条目数
+        """
+        marker = f"dropped:{namespace}"
+        conn = self._connect()
+        if conn.execute("SELECT 1 FROM meta WHERE key = ?", (marker,)).fetchone():
+            return 0
+        with conn:
+            count = conn.execute("DELETE FROM cache WHERE namespace = ?", (namespace,)).rowcount
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (marker, str(time.time())))
+        return count
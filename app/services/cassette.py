@@ -0,0 +1,95 @@
+import gzip
+import hashlib
+import json
+import logging
+import os
+import pickle
+import threading
+import time
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+try:
+    import pyarrow  # noqa: F401 feather格式需要pyarrow
+    HAS_PYARROW = True
+except ImportError:
+    HAS_PYARROW = False
+
+
+class CassetteMiss(LookupError):
+    """回放模式下没有录制过的请求"""
+
+
+class Cassette:
+    """
+    tushare DataApi的录制/回放包装，放在TushareClient之下：TushareClient(Cassette(ts.pro_api(), mode, directory))
+    - record：正常调用上游，每个(接口, 参数)的返回DataFrame写入本地文件
+    - replay：只读本地文件，不访问网络；没有录制过的请求抛出CassetteMiss
+    - auto：有录制的直接返回，没有的调用上游并录制（开发时避免重启后重复下载）
+    每个请求一个文件：{directory}/{接口名}/{参数哈希}.feather，没有pyarrow时为.pkl.gz；
+    index.jsonl记录每个文件对应的参数，方便查找某次请求的数据
+    参数按原样匹配，含当天日期的请求（如按日期区间取行情）只能在录制当天回放
+    """
+
+    MODES = ('record', 'replay', 'auto')
+
+    def __init__(self, api, mode: str, directory: str):
+        if mode not in self.MODES:
+            raise ValueError(f"不支持的录制模式: {mode}")
+        self._api = api
+        self.mode = mode
+        self.directory = directory
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    @property
+    def rate_limited(self) -> bool:
+        """回放不访问上游，TushareClient不需要对其限流"""
+        return self.mode != 'replay'
+
+    @staticmethod
+    def request_params(api_name: str, fields: str, kwargs: dict) -> dict:
+        return {"api_name": api_name, "fields": fields, "params": {key: str(value) for key, value in sorted(kwargs.items())}}
+
+    def _base_path(self, params: dict) -> str:
+        digest = hashlib.sha1(json.dumps(params, ensure_ascii=False, sort_keys=True).encode('utf-8')).hexdigest()[:20]
+        return os.path.join(self.directory, params["api_name"], digest)
+
+    def query(self, api_name: str, fields: str = '', **kwargs):
+        params = self.request_params(api_name, fields, kwargs)
+        base_path = self._base_path(params)
+        if self.mode != 'record':
+            df = self._load(base_path)
+            if df is not None:
+                return df
+            if self.mode == 'replay':
+                raise CassetteMiss(f"没有录制的tushare请求: {api_name} {params['params']}")
+        df = self._api.query(api_name, fields=fields, **kwargs)
+        self._save(base_path, params, df)
+        return df
+
+    def _load(self, base_path: str):
+        if HAS_PYARROW and os.path.exists(f"{base_path}.feather"):
+            return pd.read_feather(f"{base_path}.feather")
+        if os.path.exists(f"{base_path}.pkl.gz"):
+            with gzip.open(f"{base_path}.pkl.gz", 'rb') as f:
+                return pickle.load(f)
+        return None
+
+    def _save(self, base_path: str, params: dict, df: pd.DataFrame):
+        try:
+            os.makedirs(os.path.dirname(base_path), exist_ok=True)
+            path = f"{base_path}.feather" if HAS_PYARROW else f"{base_path}.pkl.gz"
+            tmp_path = f"{path}.tmp"
+            if HAS_PYARROW:
+                df.reset_index(drop=True).to_feather(tmp_path)
+            else:
+                with gzip.open(tmp_path, 'wb', compresslevel=6) as f:
+                    pickle.dump(df, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+            with self._lock, open(os.path.join(self.directory, 'index.jsonl'), 'a', encoding='utf-8') as f:
+                f.write(json.dumps({**params, "file": os.path.relpath(path, self.directory),
+                                    "rows": len(df), "recorded_at": time.time()}, ensure_ascii=False) + '\n')
+        except Exception as e:
+            logger.warning("录制tushare返回数据失败: %s", e)
@@ -0,0 +1,76 @@
+import asyncio
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from app.config import Config
+
+# 上游服务名称，每个上游使用独立的线程池，互不抢占
+TUSHARE = 'tushare'
+LLM = 'llm'
+# 本地磁盘读写（缓存文件、SQLite等），不与上游调用共用线程池
+LOCAL = 'local'
+
+_executors = {}
+_lock = threading.Lock()
+
+
+def get_executor(upstream: str) -> ThreadPoolExecutor:
+    """获取指定上游的线程池，首次使用时按配置的大小创建"""
+    with _lock:
+        executor = _executors.get(upstream)
+        if executor is None:
+            max_workers = Config.EXECUTOR_MAX_WORKERS.get(upstream, Config.EXECUTOR_DEFAULT_MAX_WORKERS)
+            executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"{upstream}-worker")
+            _executors[upstream] = executor
+        return executor
+
+
+async def run_blocking(upstream: str, func, *args, **kwargs):
+    """
+    在上游对应的线程池中执行同步调用，避免阻塞事件循环
+    :param upstream: 上游名称（TUSHARE / LLM），本地磁盘读写为LOCAL
+    :param func: 同步函数
+    :return: 函数返回值
+    """
+    loop = asyncio.get_running_loop()
+    # 在线程中沿用当前上下文（请求的接口标签等），run_in_executor默认不会复制contextvars
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(get_executor(upstream), partial(context.run, func, *args, **kwargs))
+
+
+async def iterate_blocking(upstream: str, func, *args, **kwargs):
+    """
+    在上游对应的线程池中迭代同步生成器，逐项异步产出
+    调用方中途停止读取时生成器仍会在线程中执行完毕（例如流式AI分析仍需写入缓存）
+    :param func: 返回同步生成器的函数
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    done = object()
+
+    def produce():
+        try:
+            for item in func(*args, **kwargs):
+                loop.call_soon_threadsafe(queue.put_nowait, (item, None))
+        except Exception as e:
+            loop.call_soon_threadsafe(queue.put_nowait, (done, e))
+        else:
+            loop.call_soon_threadsafe(queue.put_nowait, (done, None))
+
+    loop.run_in_executor(get_executor(upstream), contextvars.copy_context().run, produce)
+    while True:
+        item, error = await queue.get()
+        if item is done:
+            if error is not None:
+                raise error
+            return
+        yield item
+
+
+def shutdown_executors():
+    """关闭所有线程池（应用退出时调用）"""
+    with _lock:
+        for executor in _executors.values():
+            executor.shutdown(wait=False, cancel_futures=True)
+        _executors.clear()
@@ -0,0 +1,200 @@
+import logging
+import threading
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from app import pro
+from app.config import Config
+from app.services.trading_session import TradingSession
+
+logger = logging.getLogger(__name__)
+
+
+class FinaHistory:
+    """
+    每只股票最近FINA_HISTORY_PERIODS个报告期的财务指标，按列保存在缓存库中（{字段: [各期数值]}，按报告期升序）
+    - 首次用到时按代码一次区间查询拉取全部历史；ensure中缺历史的股票较多时改为按报告期整期拉取（fina_indicator_vip）
+    - 之后FinaStore拿到新报告期时直接追加，不再访问上游；中间缺期时才重新拉取一次
+    - 趋势指标在写入时整列计算一次，与历史一起保存，读取时不再计算
+    - 按股票加锁，访问上游时不阻塞其他股票
+    """
+
+    NAMESPACE = 'fina_history'
+    FIELDS = ('roe', 'roe_dt', 'grossprofit_margin', 'netprofit_margin', 'debt_to_assets', 'or_yoy', 'netprofit_yoy',
+              'eps', 'dt_eps', 'bps', 'ocfps', 'profit_dedt', 'total_revenue_ps')
+    QUERY_FIELDS = 'ts_code,ann_date,end_date,' + ','.join(FIELDS)
+    # 累计值字段（年初至报告期末），计算滚动四季度（TTM）合计
+    TTM_FIELDS = ('eps', 'dt_eps', 'ocfps', 'profit_dedt', 'total_revenue_ps')
+    # 计算复合增长率的年度字段
+    CAGR_FIELDS = ('eps', 'profit_dedt', 'total_revenue_ps', 'bps')
+
+    def __init__(self, cache_store, fina_store, session: TradingSession = None):
+        self.cache_store = cache_store
+        self.fina_store = fina_store
+        self.session = session or TradingSession()
+        self._lock = threading.Lock()
+        # {ts_code: 该股票的锁}，同一只股票的读改写互斥
+        self._code_locks = {}
+
+    def _code_lock(self, ts_code: str) -> threading.Lock:
+        with self._lock:
+            return self._code_locks.setdefault(ts_code, threading.Lock())
+
+    def stored(self, ts_code: str):
+        """已保存的历史（不访问上游），没有时返回None"""
+        entry = self.cache_store.get(self.NAMESPACE, ts_code)
+        return entry['data'] if entry else None
+
+    def get(self, ts_code: str, fetch: bool = True):
+        """
+        股票的财务历史和趋势指标
+        :param fetch: 本地没有历史时是否从上游拉取；为False时只用已保存的历史和FinaStore中的最新一期
+        :return: {"columns": {字段: [各期数值]}, "metrics": {...}}，取不到时返回None
+        """
+        with self._code_lock(ts_code):
+            history = self.stored(ts_code)
+            if history is None and not fetch:
+                return None
+            latest = self.fina_store.latest([ts_code]).get(ts_code)
+            if history is None:
+                return self._fill(ts_code)
+            periods = history["columns"]["end_date"]
+            if latest is None or latest["end_date"] <= periods[-1]:
+                return history
+            # 紧接着的下一期直接追加，中间缺期时重新拉取
+            if self.session.next_period_end(periods[-1]).strftime('%Y%m%d') == latest["end_date"]:
+                columns = {field: values + [latest.get(field)] for field, values in history["columns"].items()}
+                return self._save(ts_code, columns)
+            if not fetch:
+                return history
+            return self._fill(ts_code)
+
+    def ensure(self, ts_codes: list) -> int:
+        """
+        为尚无历史的股票拉取历史，已有的只追加新报告期，返回处理的股票数
+        缺历史的股票不少于FINA_BULK_MIN_CODES只时按报告期整期拉取（FINA_HISTORY_PERIODS+1次调用），
+        否则逐只区间查询（每只一次调用）；整期拉取失败或其中没有数据的股票逐只拉取
+        """
+        missing = [ts_code for ts_code in ts_codes if self.stored(ts_code) is None]
+        if len(missing) >= Config.FINA_BULK_MIN_CODES:
+            try:
+                filled = self._fill_many(missing)
+                logger.info("整期拉取财务历史，%s/%s 只股票有数据", len(filled), len(missing))
+            except Exception as e:
+                logger.warning("整期拉取财务历史失败，改为逐只拉取: %s", e)
+        count = 0
+        for ts_code in ts_codes:
+            try:
+                if self.get(ts_code) is not None:
+                    count += 1
+            except Exception as e:
+                logger.warning("更新 %s 财务历史失败: %s", ts_code, e)
+        return count
+
+    def _periods(self) -> list:
+        """拉取范围内的报告期（最近FINA_HISTORY_PERIODS+1个已结束的季度末），由旧到新"""
+        period = self.session.now().strftime('%Y%m%d')
+        periods = []
+        for _ in range(Config.FINA_HISTORY_PERIODS + 1):
+            period = self.session.previous_period_end(period).strftime('%Y%m%d')
+            periods.append(period)
+        return periods[::-1]
+
+    def _fill(self, ts_code: str):
+        """按代码一次区间查询拉取最近FINA_HISTORY_PERIODS期"""
+        df = pro.fina_indicator(ts_code=ts_code, start_date=self._periods()[0], fields=self.QUERY_FIELDS)
+        if df.empty:
+            logger.warning("无法获取 %s 的财务历史", ts_code)
+            return None
+        return self._save(ts_code, self._to_columns(df))
+
+    def _fill_many(self, ts_codes: list) -> dict:
+        """
+        按报告期整期拉取多只股票的历史，调用次数与股票数无关
+        :return: {ts_code: 历史}，没有数据或已由其他调用写入的股票不包含在内
+        """
+        frames = []
+        for period in self._periods():
+            df = pro.fina_indicator_vip(period=period, fields=self.QUERY_FIELDS)
+            frames.append(df[df['ts_code'].isin(ts_codes)])
+        result = {}
+        for ts_code, df in pd.concat(frames, ignore_index=True).groupby('ts_code'):
+            with self._code_lock(ts_code):
+                if self.stored(ts_code) is None:
+                    result[ts_code] = self._save(ts_code, self._to_columns(df))
+        return result
+
+    def _to_columns(self, df: pd.DataFrame) -> dict:
+        """一只股票的区间数据整理为按列的历史，同一报告期有更正公告时保留最新的一条"""
+        df = df.sort_values('ann_date').drop_duplicates('end_date', keep='last').sort_values('end_date')
+        df = df.tail(Config.FINA_HISTORY_PERIODS)
+        values = df.reindex(columns=list(self.FIELDS)).apply(pd.to_numeric, errors='coerce')
+        columns = {"end_date": df['end_date'].astype(str).tolist(), "ann_date": df['ann_date'].fillna('').astype(str).tolist()}
+        for field in self.FIELDS:
+            columns[field] = [None if np.isnan(value) else value for value in values[field].tolist()]
+        return columns
+
+    def _save(self, ts_code: str, columns: dict) -> dict:
+        columns = {field: values[-Config.FINA_HISTORY_PERIODS:] for field, values in columns.items()}
+        history = {"columns": columns, "metrics": self.compute_metrics(columns)}
+        self.cache_store.put(self.NAMESPACE, ts_code, history, datetime.now().strftime('%Y-%m-%d'))
+        return history
+
+    @classmethod
+    def compute_metrics(cls, columns: dict) -> dict:
+        """
+        由按列的历史整列计算趋势指标（比率为小数）
+        - 多年ROE均值/最小值、毛利率和净利率的均值与标准差（按年报）
+        - 每股收益、扣非净利润、每股营收、每股净资产的3年/5年复合增长率（首尾均为正时才计算）
+        - 累计值字段的TTM：本期累计 + 上年年报 - 上年同期累计（年报期即为本期累计）
+        """
+        end_dates = pd.Series(columns["end_date"])
+        frame = pd.DataFrame({field: np.array(columns[field], dtype='f8') for field in cls.FIELDS}, index=end_dates)
+        annual = frame[end_dates.str.endswith('1231').to_numpy()]
+
+        def window(field: str, years: int) -> np.ndarray:
+            return annual[field].to_numpy()[-years:]
+
+        def stat(func, values: np.ndarray, scale: float = 1):
+            values = values[~np.isnan(values)]
+            return round(float(func(values)) * scale, 4) if len(values) else None
+
+        metrics = {
+            "periods": len(frame),
+            "years": len(annual),
+            "latest_period": columns["end_date"][-1] if len(frame) else None,
+            "roe_avg_3y": stat(np.mean, window('roe', 3), 0.01),
+            "roe_avg_5y": stat(np.mean, window('roe', 5), 0.01),
+            "roe_min_5y": stat(np.min, window('roe', 5), 0.01),
+            "gross_margin_avg_5y": stat(np.mean, window('grossprofit_margin', 5), 0.01),
+            "gross_margin_std_5y": stat(np.std, window('grossprofit_margin', 5), 0.01),
+            "net_margin_avg_5y": stat(np.mean, window('netprofit_margin', 5), 0.01),
+            "net_margin_std_5y": stat(np.std, window('netprofit_margin', 5), 0.01),
+        }
+
+        # 复合增长率：所有字段整列计算
+        values = annual[list(cls.CAGR_FIELDS)].to_numpy()
+        for years in (3, 5):
+            if len(values) > years:
+                first, last = values[-years - 1], values[-1]
+                valid = (first > 0) & (last > 0)
+                cagr = np.full(len(cls.CAGR_FIELDS), np.nan)
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    np.power(last / first, 1 / years, out=cagr, where=valid)
+                cagr -= 1
+            else:
+                cagr = np.full(len(cls.CAGR_FIELDS), np.nan)
+            for field, value in zip(cls.CAGR_FIELDS, cagr):
+                metrics[f"{field}_cagr_{years}y"] = None if np.isnan(value) else round(float(value), 4)
+
+        # TTM：按报告期对齐上年年报和上年同期，整列计算后取最新一期
+        cumulative = frame[list(cls.TTM_FIELDS)]
+        previous_year = (end_dates.str[:4].astype(int) - 1).astype(str)
+        last_annual = cumulative.reindex((previous_year + '1231').to_numpy()).to_numpy()
+        same_period = cumulative.reindex((previous_year + end_dates.str[4:]).to_numpy()).to_numpy()
+        ttm = np.where(end_dates.str.endswith('1231').to_numpy()[:, None],
+                       cumulative.to_numpy(), cumulative.to_numpy() + last_annual - same_period)
+        latest_ttm = ttm[-1] if len(ttm) else np.full(len(cls.TTM_FIELDS), np.nan)
+        for field, value in zip(cls.TTM_FIELDS, latest_ttm):
+            metrics[f"{field}_ttm"] = None if np.isnan(value) else round(float(value), 4)
+        return metrics
@@ -0,0 +1,193 @@
+import logging
+import threading
+import time
+from datetime import datetime
+import pandas as pd
+from app import pro
+from app.config import Config
+from app.services.trading_session import TradingSession
+
+logger = logging.getLogger(__name__)
+
+
+class FinaStore:
+    """
+    财务指标按(股票, 报告期)保存在缓存库中，报告期内的数据不再变化，只在新的报告期披露后拉取
+    - 最新已披露的报告期：披露截止日已过的报告期视为所有股票都已披露；
+      披露窗口内的报告期按disclosure_date（整期分页查询，每天一次）的实际披露日判断
+    - disclosure_date不可用时按已保存数据的end_date推断，窗口内的新报告期每只股票每FINA_RECHECK_TTL复查一次
+    - 需要拉取的股票按报告期分组，较多时用fina_indicator_vip按period整期拉取，否则逐只按period拉取
+    - 锁只保护内存中的披露记录和索引的读改写，访问上游时不持有锁；相同参数的并发请求由TushareClient合并
+    """
+
+    NAMESPACE = 'fina_period'
+    # 每只股票已保存的最新报告期，以及最近一次尝试拉取的报告期和时间
+    INDEX_NAMESPACE = 'fina_index'
+    FIELDS = ('roe', 'roe_dt', 'roa', 'grossprofit_margin', 'netprofit_margin', 'netprofit_yoy',
+              'dt_netprofit_yoy', 'tr_yoy', 'or_yoy', 'op_income_yoy', 'assets_turn', 'inv_turn',
+              'ar_turn', 'ca_turn', 'current_ratio', 'quick_ratio', 'debt_to_assets', 'debt_to_eqt',
+              'ocf_to_or', 'ocf_to_opincome', 'ocf_yoy', 'eps', 'dt_eps', 'bps', 'ocfps', 'retainedps',
+              'cfps', 'ebit_ps', 'fcff_ps', 'fcfe_ps', 'profit_dedt', 'total_revenue_ps')
+    QUERY_FIELDS = 'ts_code,ann_date,end_date,' + ','.join(FIELDS)
+
+    def __init__(self, cache_store, session: TradingSession = None):
+        self.cache_store = cache_store
+        self.session = session or TradingSession()
+        self._lock = threading.Lock()
+        # {报告期: (查询日期, 已披露的ts_code集合或None)}
+        self._disclosed = {}
+
+    @staticmethod
+    def _key(ts_code: str, period: str) -> str:
+        return f"{ts_code}:{period}"
+
+    def _disclosed_codes(self, period: str, day):
+        """报告期内已实际披露的股票，每个报告期每天查询一次，接口不可用时返回None"""
+        with self._lock:
+            cached = self._disclosed.get(period)
+        if cached is not None and cached[0] == day:
+            return cached[1]
+        codes = None
+        try:
+            df = self._fetch_disclosures(period)
+            actual = df['actual_date'].fillna('').astype(str)
+            codes = set(df.loc[(actual != '') & (actual <= day.strftime('%Y%m%d')), 'ts_code'])
+        except Exception as e:
+            logger.warning("获取 %s 披露日期失败，按已有数据推断报告期: %s", period, e)
+        with self._lock:
+            self._disclosed[period] = (day, codes)
+        return codes
+
+    @staticmethod
+    def _fetch_disclosures(period: str) -> pd.DataFrame:
+        """整期的披露日期：单次返回有行数上限，按offset分页直到返回不足一页"""
+        page_size = Config.FINA_DISCLOSURE_PAGE_SIZE
+        frames = []
+        offset = 0
+        while True:
+            df = pro.disclosure_date(end_date=period, fields='ts_code,end_date,actual_date', limit=page_size, offset=offset)
+            frames.append(df)
+            if len(df) < page_size:
+                break
+            offset += page_size
+        return pd.concat(frames, ignore_index=True)
+
+    def published_periods(self, ts_codes: list) -> dict:
+        """
+        每只股票最新已披露的报告期
+        :return: {ts_code: 报告期}，披露窗口内的报告期无法通过disclosure_date确定时为None
+        """
+        day = self.session.now().date()
+        disclosing, settled = self.session.disclosure_periods(day)
+        result = dict.fromkeys(ts_codes, settled)
+        # 由旧到新，较新的报告期覆盖较旧的
+        for period in reversed(disclosing):
+            codes = self._disclosed_codes(period, day)
+            for ts_code in ts_codes:
+                if codes is None:
+                    result[ts_code] = None
+                elif ts_code in codes:
+                    result[ts_code] = period
+        return result
+
+    def latest(self, ts_codes: list) -> dict:
+        """
+        每只股票最新一期的财务指标，只拉取本地还没有的报告期
+        :return: {ts_code: 指标（含end_date、ann_date）}，取不到的股票不包含在内
+        """
+        ts_codes = list(dict.fromkeys(ts_codes))
+        index = self._load_index(ts_codes)
+        wanted = self.published_periods(ts_codes)
+        now = time.time()
+
+        # 需要拉取的(股票, 报告期)，按报告期分组（None为无法确定，逐只取最近一期）；同一报告期在复查间隔内只尝试一次
+        due = {}
+        for ts_code, period in wanted.items():
+            entry = index.get(ts_code, {})
+            if period is not None and entry.get("period", '') >= period:
+                continue
+            if entry.get("checked_period") == (period or '') and now - entry.get("checked_at", 0) < Config.FINA_RECHECK_TTL:
+                continue
+            due.setdefault(period, []).append(ts_code)
+
+        for period, codes in due.items():
+            rows = self._fetch_period(period, codes) if period else {}
+            # 无法确定报告期、或该期没有数据且本地也没有任何一期（如新上市）的股票，取最近一期
+            for ts_code in codes:
+                if ts_code not in rows and (period is None or not index.get(ts_code, {}).get("period")):
+                    row = self._fetch_last(ts_code)
+                    if row is not None:
+                        rows[ts_code] = row
+            self._store(rows)
+            index.update(self._update_index(codes, period or '', now, rows))
+
+        keys = {self._key(ts_code, entry["period"]): ts_code for ts_code, entry in index.items() if entry.get("period")}
+        stored = self.cache_store.get_many(self.NAMESPACE, list(keys))
+        return {keys[key]: entry['data'] for key, entry in stored.items()}
+
+    def _load_index(self, ts_codes: list) -> dict:
+        return {ts_code: entry['data'] for ts_code, entry in self.cache_store.get_many(self.INDEX_NAMESPACE, ts_codes).items()}
+
+    def _update_index(self, ts_codes: list, checked_period: str, checked_at: float, rows: dict) -> dict:
+        """
+        记录拉取结果：在锁内重新读取索引再合并，拉取期间其他调用写入的较新报告期不会被覆盖
+        :return: 更新后的{ts_code: 索引项}
+        """
+        with self._lock:
+            index = self._load_index(ts_codes)
+            for ts_code in ts_codes:
+                entry = dict(index.get(ts_code, {}), checked_period=checked_period, checked_at=checked_at)
+                if ts_code in rows and rows[ts_code]["end_date"] > entry.get("period", ''):
+                    entry["period"] = rows[ts_code]["end_date"]
+                index[ts_code] = entry
+            self.cache_store.put_many(self.INDEX_NAMESPACE, index, datetime.now().strftime('%Y-%m-%d'))
+        return index
+
+    def get(self, ts_code: str):
+        """单只股票最新一期的财务指标，取不到时返回None"""
+        return self.latest([ts_code]).get(ts_code)
+
+    def _fetch_period(self, period: str, ts_codes: list) -> dict:
+        """拉取一个报告期的数据：股票较多时整期拉取，否则逐只按period拉取"""
+        if len(ts_codes) >= Config.FINA_BULK_MIN_CODES:
+            try:
+                df = pro.fina_indicator_vip(period=period, fields=self.QUERY_FIELDS)
+                rows = self._to_rows(df[df['ts_code'].isin(ts_codes)])
+                logger.info("整期拉取 %s 财务指标，%s/%s 只股票有数据", period, len(rows), len(ts_codes))
+                return rows
+            except Exception as e:
+                logger.warning("整期拉取 %s 财务指标失败，改为逐只拉取: %s", period, e)
+        frames = []
+        for ts_code in ts_codes:
+            try:
+                df = pro.fina_indicator(ts_code=ts_code, period=period, fields=self.QUERY_FIELDS)
+                if not df.empty:
+                    frames.append(df)
+            except Exception as e:
+                logger.warning("获取 %s %s 财务指标失败: %s", ts_code, period, e)
+        return self._to_rows(pd.concat(frames, ignore_index=True)) if frames else {}
+
+    def _fetch_last(self, ts_code: str):
+        try:
+            rows = self._to_rows(pro.fina_indicator(ts_code=ts_code, fields=self.QUERY_FIELDS, limit=1))
+            return rows.get(ts_code)
+        except Exception as e:
+            logger.warning("获取 %s 最新财务指标失败: %s", ts_code, e)
+            return None
+
+    def _to_rows(self, df: pd.DataFrame) -> dict:
+        """整理为{ts_code: 指标}，同一报告期有更正公告时保留最新的一条；缺失值为None"""
+        if df is None or df.empty:
+            return {}
+        df = df.sort_values('ann_date').drop_duplicates(['ts_code', 'end_date'], keep='last')
+        df = df.sort_values('end_date').drop_duplicates('ts_code', keep='last')
+        values = df.reindex(columns=list(self.FIELDS)).apply(pd.to_numeric, errors='coerce')
+        values = values.astype(object).where(values.notna(), None)
+        values['ann_date'] = df['ann_date'].fillna('').astype(str)
+        values['end_date'] = df['end_date'].astype(str)
+        return dict(zip(df['ts_code'], values.to_dict('records')))
+
+    def _store(self, rows: dict):
+        if rows:
+            self.cache_store.put_many(self.NAMESPACE, {self._key(ts_code, row["end_date"]): row for ts_code, row in rows.items()},
+                                      datetime.now().strftime('%Y-%m-%d'))
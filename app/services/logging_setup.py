@@ -0,0 +1,84 @@
+import atexit
+import copy
+import datetime
+import json
+import logging
+import numbers
+import queue
+import sys
+from logging.handlers import QueueHandler, QueueListener
+from app.config import Config
+
+_listener = None
+
+
+class _DeferredQueueHandler(QueueHandler):
+    """
+    QueueHandler.prepare会在调用线程中拼接消息并格式化，这里只复制记录、固定参数，
+    消息拼接、异常堆栈和格式化都由后台线程完成
+    """
+
+    # 入队后不会再变化的参数原样保留
+    IMMUTABLE_ARGS = (str, bytes, numbers.Number, type(None), BaseException, datetime.date, datetime.time)
+    # 可变容器（含LazyJson中的数据）深拷贝一份，调用方之后的修改不影响日志内容，序列化仍在后台线程
+    CONTAINER_ARGS = (dict, list, set, tuple)
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        if isinstance(record.args, dict):
+            record.args = {key: self._freeze(value) for key, value in record.args.items()}
+        elif record.args:
+            record.args = tuple(self._freeze(arg) for arg in record.args)
+        return record
+
+    def _freeze(self, arg):
+        if isinstance(arg, self.IMMUTABLE_ARGS):
+            return arg
+        try:
+            if isinstance(arg, LazyJson):
+                return LazyJson(copy.deepcopy(arg.value))
+            if isinstance(arg, self.CONTAINER_ARGS):
+                return copy.deepcopy(arg)
+        except Exception:
+            pass
+        # 其他对象无法安全复制，在调用线程中转为字符串
+        return str(arg)
+
+
+def setup_logging():
+    """
+    app下各模块的logger统一经队列输出：记录日志只是把记录放入内存队列，
+    消息拼接、格式化和写终端由后台线程完成（见_DeferredQueueHandler），不阻塞请求处理
+    """
+    global _listener
+    if _listener is not None:
+        return
+    log_queue = queue.SimpleQueue()
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(logging.Formatter(Config.LOG_FORMAT))
+    _listener = QueueListener(log_queue, handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+
+    logger = logging.getLogger('app')
+    logger.setLevel(Config.LOG_LEVEL)
+    logger.addHandler(_DeferredQueueHandler(log_queue))
+    logger.propagate = False
+
+
+def stop_logging():
+    """停止后台线程，队列中剩余的日志写完后返回"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+class LazyJson:
+    """日志参数：只有在日志真正输出时才序列化为缩进的JSON"""
+
+    def __init__(self, value):
+        self.value = value
+
+    def __str__(self):
+        return json.dumps(self.value, ensure_ascii=False, indent=2, default=str)
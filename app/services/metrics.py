@@ -0,0 +1,175 @@
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from starlette.routing import Match
+
+# 当前请求的接口（路由模板，如/api/stock_info/{stock_code}），后台任务为scheduler:任务名等
+_endpoint = contextvars.ContextVar('metrics_endpoint', default='background')
+
+# 延迟直方图的分桶（秒），覆盖缓存读写到AI调用的范围
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + '}'
+
+
+class Counter:
+    """按标签累加的计数器"""
+
+    type_name = 'counter'
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(str(labels.get(label, '')) for label in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for key, value in sorted(values.items()):
+            yield self.name, dict(zip(self.labelnames, key)), value
+
+
+class Histogram:
+    """按标签统计的延迟直方图，输出累计分桶、总和与次数"""
+
+    type_name = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple, buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels.get(label, '')) for label in self.labelnames)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+                self._values[key] = entry
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry["buckets"][i] += 1
+            entry["sum"] += value
+            entry["count"] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        with self._lock:
+            values = {key: {**entry, "buckets": list(entry["buckets"])} for key, entry in self._values.items()}
+        for key, entry in sorted(values.items()):
+            labels = dict(zip(self.labelnames, key))
+            for bound, count in zip(self.buckets, entry["buckets"]):
+                yield f"{self.name}_bucket", {**labels, "le": repr(float(bound))}, count
+            yield f"{self.name}_bucket", {**labels, "le": "+Inf"}, entry["count"]
+            yield f"{self.name}_sum", labels, entry["sum"]
+            yield f"{self.name}_count", labels, entry["count"]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        """Prometheus文本格式"""
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type_name}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{_format_labels(labels)} {value}")
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+HTTP_LATENCY = REGISTRY.register(Histogram(
+    'http_request_duration_seconds', 'HTTP请求耗时（到响应开始返回为止）', ('endpoint', 'method', 'status')))
+UPSTREAM_LATENCY = REGISTRY.register(Histogram(
+    'upstream_request_duration_seconds', '上游调用耗时（tushare各接口、AI模型）', ('upstream', 'api', 'endpoint')))
+UPSTREAM_ERRORS = REGISTRY.register(Counter(
+    'upstream_errors_total', '上游调用失败次数', ('upstream', 'api', 'endpoint')))
+RATE_LIMIT_WAIT = REGISTRY.register(Histogram(
+    'tushare_rate_limit_wait_seconds', 'tushare限流排队等待时间', ('api', 'endpoint')))
+CACHE_LATENCY = REGISTRY.register(Histogram(
+    'cache_operation_duration_seconds', '缓存读写耗时', ('cache', 'operation', 'endpoint')))
+CACHE_REQUESTS = REGISTRY.register(Counter(
+    'cache_requests_total', '缓存命中/未命中次数', ('cache', 'result', 'endpoint')))
+
+
+def current_endpoint() -> str:
+    return _endpoint.get()
+
+
+def set_endpoint(endpoint: str):
+    """设置当前上下文的接口标签，返回用于恢复的token"""
+    return _endpoint.set(endpoint)
+
+
+def reset_endpoint(token):
+    _endpoint.reset(token)
+
+
+def resolve_endpoint(app, scope) -> str:
+    """按路由模板确定接口标签，避免股票代码等路径参数造成标签过多"""
+    for route in app.router.routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return getattr(route, 'path', scope['path'])
+    return 'unmatched'
+
+
+@contextmanager
+def track_upstream(upstream: str, api: str):
+    """记录一次上游调用的耗时，失败时累加错误次数"""
+    labels = {"upstream": upstream, "api": api, "endpoint": current_endpoint()}
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        UPSTREAM_ERRORS.inc(**labels)
+        raise
+    finally:
+        UPSTREAM_LATENCY.observe(time.perf_counter() - start, **labels)
+
+
+def track_cache(cache: str, operation: str):
+    """记录一次缓存读写的耗时"""
+    return CACHE_LATENCY.time(cache=cache, operation=operation, endpoint=current_endpoint())
+
+
+def record_cache(cache: str, hits: int = 0, misses: int = 0):
+    endpoint = current_endpoint()
+    if hits:
+        CACHE_REQUESTS.inc(hits, cache=cache, result='hit', endpoint=endpoint)
+    if misses:
+        CACHE_REQUESTS.inc(misses, cache=cache, result='miss', endpoint=endpoint)
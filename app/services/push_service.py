@@ -0,0 +1,88 @@
+import asyncio
+import json
+
+
+class PushHub:
+    """
+    服务端推送（SSE）
+    后台刷新任务把最新数据交给PushHub，PushHub与上一次推送的内容比较，只向所有连接的客户端广播发生变化的部分
+    """
+
+    # 单个客户端积压的消息上限，超过后丢弃最旧的消息
+    QUEUE_SIZE = 100
+
+    def __init__(self):
+        self._clients = set()
+        self._quotes = {}
+        self._indices = {}
+
+    @property
+    def client_count(self) -> int:
+        return len(self._clients)
+
+    def subscribe(self) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=self.QUEUE_SIZE)
+        self._clients.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self._clients.discard(queue)
+
+    def snapshot(self) -> list:
+        """新连接的客户端先收到一份完整数据"""
+        events = []
+        if self._indices:
+            events.append(("indices", list(self._indices.values())))
+        if self._quotes:
+            events.append(("quotes", self._quotes))
+        return events
+
+    def _broadcast(self, event: str, payload):
+        for queue in list(self._clients):
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait((event, payload))
+
+    def publish_quotes(self, results: dict):
+        """
+        推送股票数据的变化
+        :param results: get_stock_info_many的返回值
+        """
+        changed = {}
+        for stock_code, data in results.items():
+            if not data or "error" in data:
+                continue
+            current = {key: value for key, value in data["stock_info"].items() if key != "from_cache"}
+            previous = self._quotes.get(stock_code)
+            if previous is None or previous["stock_info"] != current or previous["targets"] != data["targets"]:
+                entry = {"stock_info": current, "targets": data["targets"]}
+                self._quotes[stock_code] = entry
+                changed[stock_code] = entry
+        if changed:
+            self._broadcast("quotes", changed)
+        return changed
+
+    def publish_indices(self, indices: list):
+        """推送发生变化的指数"""
+        changed = []
+        for index in indices:
+            if self._indices.get(index["code"]) != index:
+                self._indices[index["code"]] = index
+                changed.append(index)
+        if changed:
+            self._broadcast("indices", changed)
+        return changed
+
+    def publish_alerts(self, events: list):
+        """推送目标市值提醒"""
+        if events:
+            self._broadcast("alerts", events)
+
+    def remove_quote(self, stock_code: str):
+        """股票移出监控列表后不再推送"""
+        if self._quotes.pop(stock_code, None) is not None:
+            self._broadcast("removed", [stock_code])
+
+    @staticmethod
+    def format_event(event: str, payload) -> str:
+        return f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
@@ -0,0 +1,145 @@
+import asyncio
+import logging
+import time
+from datetime import datetime
+from app.config import Config
+from app.services.executor import run_blocking, LOCAL, TUSHARE
+from app.services.metrics import set_endpoint
+
+logger = logging.getLogger(__name__)
+
+
+class RefreshScheduler:
+    """
+    后台定时刷新任务，随FastAPI应用启动和退出
+    每个任务按各自的间隔循环执行，同一任务不会重叠；对tushare的批量刷新分批进行，批次之间暂停，避免触发频率限制
+    刷新结果交给push_hub，由其向已连接的页面推送变化
+    """
+
+    def __init__(self, stock_service, push_hub=None, screener=None, alerts=None):
+        self.stock_service = stock_service
+        self.push_hub = push_hub
+        self.screener = screener
+        self.alerts = alerts
+        self.jobs = {}
+        self._tasks = []
+        self.add_job('watchlist_quotes', self.refresh_watchlist_quotes, Config.SCHEDULER_QUOTE_INTERVAL)
+        self.add_job('index_snapshot', self.refresh_index_snapshot, Config.SCHEDULER_INDEX_INTERVAL)
+        self.add_job('fundamentals', self.refresh_fundamentals, Config.SCHEDULER_FUNDAMENTALS_INTERVAL)
+        self.add_job('symbol_table', self.refresh_symbol_table, Config.SCHEDULER_SYMBOL_TABLE_INTERVAL)
+        self.add_job('daily_bars', self.refresh_daily_bars, Config.SCHEDULER_BARS_INTERVAL)
+        if screener is not None:
+            self.add_job('screener', self.refresh_screener, Config.SCHEDULER_SCREENER_INTERVAL)
+
+    def add_job(self, name: str, func, interval: float):
+        """注册任务，func为无参数的协程函数"""
+        self.jobs[name] = {
+            "func": func,
+            "interval": interval,
+            "running": False,
+            "runs": 0,
+            "failures": 0,
+            "last_started_at": None,
+            "last_finished_at": None,
+            "last_duration_ms": None,
+            "last_success_at": None,
+            "last_error": None,
+            "next_run_at": None
+        }
+
+    async def start(self):
+        if not Config.SCHEDULER_ENABLED or self._tasks:
+            return
+        for delay, name in enumerate(self.jobs):
+            # 错开各任务的首次执行，避免启动时集中请求上游
+            self._tasks.append(asyncio.create_task(self._run_job(name, delay)))
+        logger.info("后台刷新任务已启动: %s", ', '.join(self.jobs))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _run_job(self, name: str, initial_delay: float):
+        job = self.jobs[name]
+        # 每个任务运行在独立的Task上下文中，指标按任务名归类
+        set_endpoint(f"scheduler:{name}")
+        await asyncio.sleep(initial_delay)
+        while True:
+            job["running"] = True
+            job["last_started_at"] = self._format_time(time.time())
+            start = time.perf_counter()
+            try:
+                await job["func"]()
+                job["last_success_at"] = self._format_time(time.time())
+                job["last_error"] = None
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                job["failures"] += 1
+                job["last_error"] = str(e)
+                logger.warning("后台任务 %s 执行失败: %s", name, e)
+            finally:
+                job["running"] = False
+                job["runs"] += 1
+                job["last_duration_ms"] = round((time.perf_counter() - start) * 1000, 1)
+                job["last_finished_at"] = self._format_time(time.time())
+            job["next_run_at"] = self._format_time(time.time() + job["interval"])
+            await asyncio.sleep(job["interval"])
+
+    @staticmethod
+    def _format_time(timestamp: float) -> str:
+        return datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S')
+
+    def status(self) -> dict:
+        """各任务最近一次的执行情况"""
+        return {
+            "enabled": Config.SCHEDULER_ENABLED,
+            "jobs": {
+                name: {key: value for key, value in job.items() if key != "func"}
+                for name, job in self.jobs.items()
+            }
+        }
+
+    async def _paced(self, func, stock_codes: list) -> list:
+        """分批在tushare线程池中执行，批次之间暂停，返回每批的结果"""
+        batch_size = Config.SCHEDULER_BATCH_SIZE
+        results = []
+        for i in range(0, len(stock_codes), batch_size):
+            if i:
+                await asyncio.sleep(Config.SCHEDULER_PACING_SECONDS)
+            results.append(await run_blocking(TUSHARE, func, stock_codes[i:i + batch_size]))
+        return results
+
+    async def refresh_watchlist_quotes(self):
+        """刷新监控列表的行情，未过期的部分直接跳过"""
+        batches = await self._paced(self.stock_service.get_stock_info_many, list(self.stock_service.watchlist_snapshot()))
+        for results in batches:
+            if self.push_hub is not None:
+                self.push_hub.publish_quotes(results)
+            if self.alerts is not None:
+                # 判断状态要读写缓存库和提醒日志，在线程池中执行，不阻塞事件循环
+                events = await run_blocking(LOCAL, self.alerts.evaluate, results, self.stock_service.watchlist_snapshot())
+                if events and self.push_hub is not None:
+                    self.push_hub.publish_alerts(events)
+
+    async def refresh_index_snapshot(self):
+        indices = await run_blocking(TUSHARE, self.stock_service.get_index_info)
+        if self.push_hub is not None:
+            self.push_hub.publish_indices(indices)
+
+    async def refresh_fundamentals(self):
+        """刷新监控列表中已过期的财务指标"""
+        await self._paced(self.stock_service.refresh_fundamentals, list(self.stock_service.watchlist_snapshot()))
+
+    async def refresh_symbol_table(self):
+        await run_blocking(TUSHARE, self.stock_service.symbols.refresh_if_stale)
+
+    async def refresh_daily_bars(self):
+        """日线库追加新交易日的数据，已是最新时不访问上游"""
+        await run_blocking(TUSHARE, self.stock_service.sync_bars)
+
+    async def refresh_screener(self):
+        """选股数据按交易日增量更新，当天已更新时不访问上游"""
+        await run_blocking(TUSHARE, self.screener.refresh)
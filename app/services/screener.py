@@ -0,0 +1,252 @@
+import logging
+import os
+import threading
+import time
+from datetime import timedelta
+import numpy as np
+import pandas as pd
+from app import pro
+from app.config import Config
+from app.services.trading_session import TradingSession
+
+logger = logging.getLogger(__name__)
+
+
+class Screener:
+    """
+    全市场选股：一次daily_basic（按trade_date）的估值快照加上各股票最新一期的财务指标，
+    整理为按列存储的NumPy数组，筛选和排序对全部A股整列计算，不访问上游
+    - 估值快照每个交易日拉取一次
+    - 财务指标按报告期批量拉取（fina_indicator_vip），披露截止日已过的报告期不再变化，只拉取一次并保存到本地；
+      仍在披露期内的报告期每个交易日复查一次
+    - 拉取失败或意外没有数据时保留已有数据，当天不算已检查，间隔Config.SCREENER_RETRY_INTERVAL后重试
+    """
+
+    # 筛选字段：名称 -> (来源列, 换算系数)，换算后的单位与get_stock_info一致（比率为小数，市值为亿元）
+    FIELDS = {
+        'price': ('close', 1),
+        'pe': ('pe', 1),
+        'pe_ttm': ('pe_ttm', 1),
+        'pb': ('pb', 1),
+        'ps': ('ps', 1),
+        'dv': ('dv_ratio', 0.01),
+        'mv': ('total_mv', 0.0001),
+        'turnover': ('turnover_rate', 0.01),
+        'roe': ('roe', 0.01),
+        'gross_margin': ('grossprofit_margin', 0.01),
+        'net_margin': ('netprofit_margin', 0.01),
+        'debt_to_assets': ('debt_to_assets', 0.01),
+        'revenue_yoy': ('or_yoy', 0.01),
+        'profit_yoy': ('netprofit_yoy', 0.01),
+    }
+    OPERATORS = {'lt': np.less, 'le': np.less_equal, 'gt': np.greater, 'ge': np.greater_equal}
+    DAILY_FIELDS = 'ts_code,trade_date,close,pe,pe_ttm,pb,ps,dv_ratio,total_mv,turnover_rate'
+    FINA_FIELDS = 'ts_code,ann_date,end_date,roe,grossprofit_margin,netprofit_margin,debt_to_assets,or_yoy,netprofit_yoy'
+
+    def __init__(self, symbols, session: TradingSession = None, directory: str = None):
+        self.symbols = symbols
+        self.session = session or TradingSession()
+        self.directory = directory or Config.SCREENER_DIR
+        os.makedirs(self.directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._daily = None
+        self._finas = {}
+        self._fina_checked = {}
+        self._checked_day = None
+        self._retry_at = 0
+        # 按列存储的全市场数据：{字段: ndarray}，以及代码、名称、行业、报告期
+        self._columns = None
+        self.trade_date = None
+        self.updated_at = None
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, f"{name}.pkl")
+
+    def _load_frame(self, name: str):
+        try:
+            return pd.read_pickle(self._path(name))
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning("读取选股数据 %s 失败: %s", name, e)
+            return None
+
+    def _save_frame(self, name: str, df: pd.DataFrame):
+        tmp_path = f"{self._path(name)}.tmp"
+        df.to_pickle(tmp_path)
+        os.replace(tmp_path, self._path(name))
+
+    def recent_periods(self, day) -> list:
+        """day之前结束的最近Config.SCREENER_FINA_PERIODS个报告期（YYYYMMDD），由新到旧"""
+        period = day.strftime('%Y%m%d')
+        periods = []
+        while len(periods) < Config.SCREENER_FINA_PERIODS:
+            period = self.session.previous_period_end(period).strftime('%Y%m%d')
+            periods.append(period)
+        return periods
+
+    def refresh(self, force: bool = False) -> bool:
+        """按交易日增量更新：当天已检查过、或上次更新不完整且未到重试时间时直接返回False"""
+        day = self.session.last_settled_day()
+        with self._lock:
+            if not force and self._columns is not None and (self._checked_day == day or time.time() < self._retry_at):
+                return False
+            complete = self._refresh_daily(day)
+            complete = self._refresh_finas(day) and complete
+            self._build()
+            if complete:
+                self._checked_day = day
+            else:
+                self._retry_at = time.time() + Config.SCREENER_RETRY_INTERVAL
+            return True
+
+    def _refresh_daily(self, day) -> bool:
+        """更新估值快照，返回是否已是day的数据"""
+        if self._daily is None:
+            self._daily = self._load_frame('daily_basic')
+        trade_date = day.strftime('%Y%m%d')
+        if self._daily is not None and str(self._daily['trade_date'].iloc[0]) >= trade_date:
+            return True
+        # 当天数据尚未发布（或遇到节假日）时往前找，已有快照时保留旧快照
+        complete = True
+        for _ in range(10):
+            df = pro.daily_basic(trade_date=trade_date, fields=self.DAILY_FIELDS)
+            if not df.empty:
+                self._daily = df
+                self._save_frame('daily_basic', df)
+                return complete
+            complete = False
+            if self._daily is not None:
+                return False
+            day -= timedelta(days=1)
+            while not self.session.is_trading_day(day):
+                day -= timedelta(days=1)
+            trade_date = day.strftime('%Y%m%d')
+        return False
+
+    def _refresh_finas(self, day) -> bool:
+        """更新各报告期的财务指标，返回是否所有需要复查的报告期都拉取成功"""
+        complete = True
+        periods = self.recent_periods(day)
+        for period in periods:
+            if period not in self._finas:
+                cached = self._load_frame(f"fina_{period}")
+                if cached is not None:
+                    self._finas[period] = cached
+            final = day > self.session.disclosure_deadline(period)
+            if period in self._finas and (final or self._fina_checked.get(period) == day):
+                continue
+            try:
+                df = pro.fina_indicator_vip(period=period, fields=self.FINA_FIELDS)
+            except Exception as e:
+                logger.warning("获取 %s 财务指标失败: %s", period, e)
+                complete = False
+                continue
+            if df.empty:
+                # 披露期刚开始时还没有公司披露，属于正常情况；截止日已过或之前有数据时视为上游异常
+                if final or period in self._finas:
+                    logger.warning("%s 财务指标没有数据，稍后重试", period)
+                    complete = False
+                else:
+                    self._fina_checked[period] = day
+                continue
+            # 同一报告期有更正公告时保留最新的一条
+            df = df.sort_values('ann_date').drop_duplicates('ts_code', keep='last')
+            self._finas[period] = df
+            self._fina_checked[period] = day
+            self._save_frame(f"fina_{period}", df)
+        for period in list(self._finas):
+            if period not in periods:
+                del self._finas[period]
+        return complete
+
+    def _build(self):
+        """合并估值快照和每只股票最新一期财务指标，转换为按列的数组"""
+        if self._daily is None:
+            raise ValueError("没有可用的估值快照")
+        frame = self._daily.drop_duplicates('ts_code').set_index('ts_code')
+        finas = [df for _, df in sorted(self._finas.items(), reverse=True)]
+        if finas:
+            fina = pd.concat(finas, ignore_index=True).drop_duplicates('ts_code', keep='first').set_index('ts_code')
+            frame = frame.join(fina.drop(columns=['ann_date']), how='left')
+        symbols = self.symbols.frame()
+        names = symbols.reset_index().set_index('ts_code')
+        frame = frame.join(names[['symbol', 'name', 'industry']], how='left')
+
+        columns = {
+            field: pd.to_numeric(frame[source], errors='coerce').to_numpy(dtype='f8') * scale
+            if source in frame else np.full(len(frame), np.nan)
+            for field, (source, scale) in self.FIELDS.items()
+        }
+        columns['ts_code'] = frame.index.to_numpy(dtype=object)
+        columns['code'] = frame['symbol'].fillna('').to_numpy(dtype=object)
+        columns['name'] = frame['name'].fillna('').to_numpy(dtype=object)
+        columns['industry'] = frame['industry'].astype(object).fillna('').to_numpy(dtype=object)
+        columns['end_date'] = frame['end_date'].fillna('').astype(str).to_numpy(dtype=object) if 'end_date' in frame else np.full(len(frame), '', dtype=object)
+        self._columns = columns
+        self.trade_date = str(self._daily['trade_date'].iloc[0])
+        self.updated_at = time.time()
+
+    def parse_filters(self, params: dict) -> list:
+        """把pe_lt=15这样的参数解析为[(字段, 运算, 数值)]，无法识别时抛出ValueError"""
+        filters = []
+        for key, value in params.items():
+            field, _, op = key.rpartition('_')
+            if field not in self.FIELDS or op not in self.OPERATORS:
+                raise ValueError(f"不支持的筛选条件: {key}")
+            try:
+                filters.append((field, op, float(value)))
+            except ValueError:
+                raise ValueError(f"筛选条件 {key} 的值不是数字: {value}")
+        return filters
+
+    def screen(self, params: dict, sort: str = None, order: str = 'desc', limit: int = 50, industry: str = None) -> dict:
+        """
+        按条件筛选全市场股票
+        :param params: {字段_运算: 数值}，运算为lt、le、gt、ge，如{'pe_lt': 15, 'roe_gt': 0.15}
+        :param sort: 排序字段，缺失值总是排在最后
+        """
+        try:
+            filters = self.parse_filters(params)
+        except ValueError as e:
+            return {"error": str(e)}
+        if sort is not None and sort not in self.FIELDS:
+            return {"error": f"不支持的排序字段: {sort}"}
+        try:
+            self.refresh()
+        except Exception as e:
+            logger.warning("更新选股数据失败: %s", e)
+            if self._columns is None:
+                return {"error": f"获取选股数据失败: {str(e)}"}
+
+        columns = self._columns
+        start = time.perf_counter()
+        mask = np.ones(len(columns['ts_code']), dtype=bool)
+        for field, op, value in filters:
+            mask &= self.OPERATORS[op](columns[field], value)
+        if industry:
+            mask &= columns['industry'] == industry
+        index = np.flatnonzero(mask)
+        if sort:
+            values = columns[sort][index]
+            index = index[np.argsort(values if order == 'asc' else -values, kind='stable')]
+        selected = index[:max(0, limit)]
+
+        results = [
+            {
+                "code": columns['code'][i],
+                "ts_code": columns['ts_code'][i],
+                "name": columns['name'][i],
+                "industry": columns['industry'][i],
+                "end_date": columns['end_date'][i],
+                **{field: None if np.isnan(columns[field][i]) else round(float(columns[field][i]), 4) for field in self.FIELDS}
+            }
+            for i in selected
+        ]
+        return {
+            "trade_date": self.trade_date,
+            "universe": len(mask),
+            "matched": len(index),
+            "elapsed_ms": round((time.perf_counter() - start) * 1000, 2),
+            "results": results
+        }
@@ -1,15 +1,68 @@
 import json
+import logging
 import os
-from datetime import datetime
+import threading
+import time
+from datetime import datetime, timedelta
 import pandas as pd
 from app import pro
 from app.config import Config
+from app.services.cache_store import CacheStore
+from app.services.trading_session import TradingSession
+from app.services.trading_calendar import TradingCalendar
+from app.services.symbol_table import SymbolTable
+from app.services.bar_store import BarStore
+from app.services.fina_store import FinaStore
+from app.services.fina_history import FinaHistory
+from app.services.metrics import record_cache
 import numpy as np
 
+logger = logging.getLogger(__name__)
+
+
 class StockService:
+    # 批量接口每次拼接的股票数量，以及最近交易日没有数据时回看的自然日天数（覆盖短期停牌）
+    BATCH_CHUNK_SIZE = 100
+    BATCH_LOOKBACK_DAYS = 15
+    # get_stock_info使用的财务指标字段
+    FINA_FIELDS = 'roe,grossprofit_margin,netprofit_margin,debt_to_assets,op_income_yoy,netprofit_yoy,bps,ocfps'
+    # 股票数据按行情、财务指标分开缓存，各自有不同的有效期（名称来自代码表）
+    CACHE_PARTS = ('quote', 'fina')
+    # 首页展示的主要指数
+    INDEX_CODES = {
+        '000001.SH': '上证指数',
+        '399001.SZ': '深证成指',
+        '399006.SZ': '创业板指',
+        '000016.SH': '上证50',
+        '000300.SH': '沪深300',
+        '000905.SH': '中证500',
+        '000852.SH': '中证1000',
+        '899050.BJ': '北证50',
+    }
+    # 指数K线天数
+    INDEX_KLINE_DAYS = 20
+    # 详情页和AI分析共用的数据，按股票代码缓存到缓存库
+    MEMO_NAMESPACES = ('company_detail', 'value_analysis', 'top_holders')
+
     def __init__(self):
         self.watchlist = {}
         self.cache_file = os.path.join(Config.BASE_DIR, "stock_cache.json")
+        # 监控列表在多个线程池中读写，修改、遍历和保存都持有此锁
+        self._watchlist_lock = threading.Lock()
+        self.cache_store = CacheStore(Config.CACHE_DB_FILE)
+        self.calendar = TradingCalendar()
+        self.session = TradingSession(self.calendar)
+        # 按(股票, 报告期)保存的财务指标，新的报告期披露后才拉取
+        self.fina_store = FinaStore(self.cache_store, self.session)
+        # 多期财务历史和趋势指标，新报告期从fina_store追加
+        self.fina_history = FinaHistory(self.cache_store, self.fina_store, self.session)
+        self.symbols = SymbolTable()
+        # 指数数据快照，所有请求共享
+        self._index_snapshot = None
+        self._index_expires_at = 0
+        self._index_lock = threading.Lock()
+        # 本地日线库，指数K线和历史行情从这里读取
+        self.bars = BarStore(session=self.session)
         self.load_watchlist()
         self.load_cache()
 
@@ -18,178 +71,312 @@ class StockService:
             if os.path.exists(Config.CONFIG_FILE):
                 with open(Config.CONFIG_FILE, 'r', encoding='utf-8') as f:
                     data = json.load(f)
-                    self.watchlist = data.get('watchlist', {})
+                    with self._watchlist_lock:
+                        self.watchlist = data.get('watchlist', {})
         except Exception as e:
-            print(f"Error loading watchlist: {str(e)}")
-            self.watchlist = {}
+            logger.warning("Error loading watchlist: %s", e)
+            with self._watchlist_lock:
+                self.watchlist = {}
+
+    def watchlist_snapshot(self) -> dict:
+        """监控列表的副本，供其他线程遍历"""
+        with self._watchlist_lock:
+            return dict(self.watchlist)
 
     def _save_watchlist(self):
+        """保存监控列表（调用方需持有_watchlist_lock）：先写临时文件再替换，避免写到一半的文件"""
         try:
-            with open(Config.CONFIG_FILE, 'w', encoding='utf-8') as f:
-                json.dump({'watchlist': self.watchlist}, f, ensure_ascii=False, indent=4)
+            tmp_path = f"{Config.CONFIG_FILE}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'watchlist': dict(self.watchlist)}, f, ensure_ascii=False, indent=4)
+            os.replace(tmp_path, Config.CONFIG_FILE)
         except Exception as e:
-            print(f"Error saving watchlist: {str(e)}")
+            logger.warning("Error saving watchlist: %s", e)
 
     def load_cache(self):
+        """
+        首次启动时把旧版stock_cache.json一次性迁移到缓存库的行情、财务指标两部分，之后按需逐条读取
+        过渡版本写入缓存库的整条stock_info（及名称）没有有效期信息，一次性清理
+        """
         try:
-            if os.path.exists(self.cache_file):
-                with open(self.cache_file, 'r', encoding='utf-8') as f:
-                    self.cache_data = json.load(f)
-            else:
-                self.cache_data = {}
+            count = self.cache_store.migrate_from_json(self.cache_file, self._convert_legacy_cache)
+            if count:
+                logger.info("已从 %s 迁移 %s 条股票缓存", self.cache_file, count)
         except Exception as e:
-            print(f"Error loading cache: {str(e)}")
-            self.cache_data = {}
-
-    def save_cache(self, stock_code, data):
+            logger.warning("Error migrating cache: %s", e)
         try:
-            self.cache_data[stock_code] = {
-                'data': data,
-                'timestamp': datetime.now().strftime('%Y-%m-%d')
-            }
-            with open(self.cache_file, 'w', encoding='utf-8') as f:
-                json.dump(self.cache_data, f, ensure_ascii=False, indent=4)
+            for namespace in ('stock_info', 'name'):
+                count = self.cache_store.drop_namespace_once(namespace)
+                if count:
+                    logger.info("已清理 %s 条旧版 %s 缓存", count, namespace)
         except Exception as e:
-            print(f"Error saving cache: {str(e)}")
+            logger.warning("Error cleaning legacy cache: %s", e)
+
+    def _convert_legacy_cache(self, legacy: dict):
+        """
+        旧版整条stock_info拆分为行情和财务指标，产出(namespace, 股票代码, 数据, 日期, 过期时间)
+        - 行情按已过期导入，首次读取时重新拉取
+        - 旧数据没有报告期，按缓存日期时截止日已过的最近报告期记录end_date，过期时间按缓存日期计算
+        """
+        quote_fields = ('market_value', 'pe_ratio', 'pb_ratio', 'ps_ratio', 'dividend_yield', 'price', 'change_percent')
+        fina_fields = ('roe', 'gross_profit_margin', 'net_profit_margin', 'debt_to_assets', 'revenue_yoy',
+                       'net_profit_yoy', 'bps', 'ocfps')
+        for stock_code, entry in legacy.items():
+            try:
+                stock_info = entry['data']['stock_info']
+                timestamp = entry.get('timestamp', '')
+                cached_at = datetime.strptime(timestamp, '%Y-%m-%d')
+            except (KeyError, TypeError, ValueError):
+                continue
+            if 'error' in stock_info:
+                continue
+            yield 'quote', stock_code, {field: stock_info.get(field, 0) for field in quote_fields}, timestamp, 0
+            end_date = self.session.disclosure_periods(cached_at.date())[1]
+            fina = dict({field: stock_info.get(field, 0) for field in fina_fields}, end_date=end_date)
+            yield 'fina', stock_code, fina, timestamp, self.session.fina_expires_at(end_date, cached_at)
 
-    def get_stock_info(self, stock_code: str, force_refresh: bool = False):
+    def _load_parts(self, stock_codes: list) -> dict:
+        """读取行情、财务指标两类缓存，返回{namespace: {股票代码: 缓存条目}}"""
         try:
-            # 检查缓存
-            today = datetime.now().strftime('%Y-%m-%d')
-            if not force_refresh and stock_code in self.cache_data and self.cache_data[stock_code]['timestamp'] == today:
-                print(f"从缓存获取股票 {stock_code} 的数据")
-                cached_data = self.cache_data[stock_code]['data']
-                cached_data['stock_info']['from_cache'] = True
-                return cached_data
+            return {namespace: self.cache_store.get_many(namespace, stock_codes) for namespace in self.CACHE_PARTS}
+        except Exception as e:
+            logger.warning("Error loading cache: %s", e)
+            return {namespace: {} for namespace in self.CACHE_PARTS}
 
-            # 如果强制刷新或缓存不存在或已过期，从API获取数据
-            print(f"从API获取股票 {stock_code} 的数据...")
+    def _save_parts(self, namespace: str, items: dict, expires_at):
+        if not items:
+            return
+        try:
+            self.cache_store.put_many(namespace, items, datetime.now().strftime('%Y-%m-%d'), expires_at)
+        except Exception as e:
+            logger.warning("Error saving cache: %s", e)
 
-            # 处理股票代码格式
-            if len(stock_code) != 6:
-                return {"error": "股票代码格式错误"}
-                
-            # 确定交易所
-            if stock_code.startswith('6'):
-                ts_code = f"{stock_code}.SH"
-            elif stock_code.startswith(('0', '3')):
-                ts_code = f"{stock_code}.SZ"
+    def get_stock_info(self, stock_code: str, force_refresh: bool = False):
+        if len(stock_code) != 6:
+            return {"error": "股票代码格式错误"}
+        return self.get_stock_info_many([stock_code], force_refresh)[stock_code]
+
+    def _fetch_latest_by_code(self, api_name: str, ts_codes: list, fields: str):
+        """
+        批量拉取最近一个已入库交易日的数据（按交易日历确定日期，每批一次查询）
+        当天没有数据的股票（停牌等）再按回看区间补查，每只股票只保留最新一个交易日
+        """
+        trade_date = self.session.last_settled_day().strftime('%Y%m%d')
+        frames = []
+        for i in range(0, len(ts_codes), self.BATCH_CHUNK_SIZE):
+            chunk = ts_codes[i:i + self.BATCH_CHUNK_SIZE]
+            df = getattr(pro, api_name)(ts_code=','.join(chunk), trade_date=trade_date, fields=fields)
+            if not df.empty:
+                frames.append(df)
+        found = set().union(*(frame['ts_code'] for frame in frames))
+        missing = [ts_code for ts_code in ts_codes if ts_code not in found]
+        if missing:
+            frames.extend(self._fetch_lookback(api_name, missing, fields, trade_date))
+        if not frames:
+            return pd.DataFrame(columns=fields.split(',')).set_index('ts_code')
+        df = pd.concat(frames, ignore_index=True)
+        return df.sort_values('trade_date').drop_duplicates('ts_code', keep='last').set_index('ts_code')
+
+    def _fetch_lookback(self, api_name: str, ts_codes: list, fields: str, end_date: str) -> list:
+        """按回看区间批量拉取，用于最近交易日没有数据的股票"""
+        start_date = datetime.strptime(end_date, '%Y%m%d') - timedelta(days=self.BATCH_LOOKBACK_DAYS)
+        frames = []
+        for i in range(0, len(ts_codes), self.BATCH_CHUNK_SIZE):
+            chunk = ts_codes[i:i + self.BATCH_CHUNK_SIZE]
+            df = getattr(pro, api_name)(ts_code=','.join(chunk),
+                                        start_date=start_date.strftime('%Y%m%d'),
+                                        end_date=end_date,
+                                        fields=fields)
+            if not df.empty:
+                frames.append(df)
+        return frames
+
+    def _fetch_quotes(self, ts_codes: dict) -> dict:
+        """批量获取行情与估值数据，返回{股票代码: 行情字段}"""
+        ts_list = list(ts_codes)
+        daily = self._fetch_latest_by_code('daily', ts_list, 'ts_code,trade_date,close,pct_chg')
+        daily_basic = self._fetch_latest_by_code('daily_basic', ts_list, 'ts_code,trade_date,total_mv,pe,pb,ps,dv_ratio')
+
+        # 以ts_code为索引对齐，整列计算，缺失值统一按0处理
+        frame = pd.DataFrame(index=pd.Index(ts_list, name='ts_code'))
+        frame = frame.join(daily[['close', 'pct_chg']]).join(daily_basic[['total_mv', 'pe', 'pb', 'ps', 'dv_ratio']])
+        frame = frame[frame['close'].notna() & frame['total_mv'].notna()]
+        num = frame.apply(pd.to_numeric, errors='coerce').fillna(0)
+        quotes = pd.DataFrame({
+            "market_value": (num['total_mv'] / 10000).round(2),  # 总市值（亿元）
+            "pe_ratio": num['pe'].round(2),
+            "pb_ratio": num['pb'].round(2),
+            "ps_ratio": num['ps'].round(2),
+            "dividend_yield": (num['dv_ratio'] / 100).round(4),  # tushare返回百分比，转换为小数
+            "price": num['close'].round(2),
+            "change_percent": (num['pct_chg'] / 100).round(4)
+        }, index=frame.index)
+        return {ts_codes[ts_code]: quote for ts_code, quote in zip(quotes.index, quotes.to_dict('records'))}
+
+    def _fetch_finas(self, ts_codes: dict):
+        """获取最新一期财务指标（本地已有最新报告期的不访问上游），返回({股票代码: 指标}, {股票代码: 过期时间})"""
+        rows = self.fina_store.latest(list(ts_codes))
+        if not rows:
+            return {}, {}
+
+        frame = pd.DataFrame.from_dict(rows, orient='index')
+        num = frame[self.FINA_FIELDS.split(',')].apply(pd.to_numeric, errors='coerce').fillna(0)
+        finas = pd.DataFrame({
+            "roe": (num['roe'] / 100).round(4),
+            "gross_profit_margin": (num['grossprofit_margin'] / 100).round(4),
+            "net_profit_margin": (num['netprofit_margin'] / 100).round(4),
+            "debt_to_assets": (num['debt_to_assets'] / 100).round(4),
+            "revenue_yoy": (num['op_income_yoy'] / 100).round(4),
+            "net_profit_yoy": (num['netprofit_yoy'] / 100).round(4),
+            "bps": num['bps'].round(3),
+            "ocfps": num['ocfps'].round(3)
+        }, index=frame.index)
+        finas['end_date'] = frame['end_date'].astype(str)
+
+        result, expires_at = {}, {}
+        for ts_code, fina in zip(finas.index, finas.to_dict('records')):
+            stock_code = ts_codes[ts_code]
+            result[stock_code] = fina
+            expires_at[stock_code] = self.session.fina_expires_at(fina['end_date'])
+        return result, expires_at
+
+    def get_stock_info_many(self, stock_codes: list, force_refresh: bool = False):
+        """
+        批量获取多只股票的数据
+        行情、财务指标分别缓存，各自按交易时段和报告期判断是否过期，只刷新过期的部分；名称来自代码表
+        强制刷新只在行情仍可能变化时重新拉取行情，收盘后直接使用缓存
+        :return: {股票代码: get_stock_info同结构的结果或{"error": ...}}
+        """
+        results = {}
+        ts_codes = {}
+        for stock_code in dict.fromkeys(stock_codes):
+            ts_code = self.symbols.to_ts_code(stock_code)
+            if ts_code is None:
+                results[stock_code] = {"error": "不支持的股票代码"}
             else:
-                return {"error": "不支持的股票代码"}
-
-            # 获取基本信息和总市值
-            basic_info = pro.daily_basic(ts_code=ts_code, fields='ts_code,total_mv', limit=1)
-            if basic_info.empty:
-                return {"error": "股票代码不存在"}
-
-            # 获取股票名称
-            stock_name = pro.stock_basic(ts_code=ts_code, fields='name').iloc[0]['name']
-
-            # 获取最新财务指标
-            fina_indicator = pro.fina_indicator(ts_code=ts_code, period=datetime.now().strftime('%Y%m%d'), fields='roe,grossprofit_margin,netprofit_margin,debt_to_assets,op_income_yoy,netprofit_yoy,bps,ocfps')
-            if fina_indicator.empty:
-                fina_indicator = pro.fina_indicator(ts_code=ts_code, limit=1)
-                
-            # 获取实时行情
-            today = datetime.now().strftime('%Y%m%d')
-            daily_data = pro.daily(ts_code=basic_info['ts_code'].iloc[0], start_date=today, end_date=today)
-            if daily_data.empty:
-                daily_data = pro.daily(ts_code=basic_info['ts_code'].iloc[0], limit=1)
-                if daily_data.empty:
-                    return {"error": "无法获取股票行情数据"}
-
-            # 获取市值信息（用于其他指标）
-            daily_basic = pro.daily_basic(ts_code=basic_info['ts_code'].iloc[0], 
-                                        fields='ts_code,trade_date,pe,pb,ps,dv_ratio',
-                                        limit=1)
-            
-            if daily_basic.empty:
-                return {"error": "无法获取股票基础数据"}
-                
-            latest_basic = daily_basic.iloc[0]
-            latest_fina = fina_indicator.iloc[0] if not fina_indicator.empty else pd.Series()
-            
-            # 计算实时总市值（单位：亿元）
-            current_price = float(daily_data['close'].iloc[0])
-            market_value = float(basic_info['total_mv'].iloc[0]) / 10000  # 转换为亿元
-            print(f"市值计算: 当前价格={current_price}, 总市值={market_value}亿元")
-            
-            # 处理股息率：tushare返回的是百分比值，需要转换为小数
-            dv_ratio = float(latest_basic['dv_ratio']) if pd.notna(latest_basic['dv_ratio']) else 0
-            dividend_yield = round(dv_ratio / 100, 4)  # 转换为小数
-            
-            # 处理财务指标，确保所有值都有默认值0，转换为小数
-            roe = round(float(latest_fina['roe']) / 100, 4) if pd.notna(latest_fina.get('roe')) else 0
-            gross_profit_margin = round(float(latest_fina['grossprofit_margin']) / 100, 4) if pd.notna(latest_fina.get('grossprofit_margin')) else 0
-            net_profit_margin = round(float(latest_fina['netprofit_margin']) / 100, 4) if pd.notna(latest_fina.get('netprofit_margin')) else 0
-            debt_to_assets = round(float(latest_fina['debt_to_assets']) / 100, 4) if pd.notna(latest_fina.get('debt_to_assets')) else 0
-            revenue_yoy = round(float(latest_fina['op_income_yoy']) / 100, 4) if pd.notna(latest_fina.get('op_income_yoy')) else 0
-            net_profit_yoy = round(float(latest_fina['netprofit_yoy']) / 100, 4) if pd.notna(latest_fina.get('netprofit_yoy')) else 0
-            bps = round(float(latest_fina['bps']), 3) if pd.notna(latest_fina.get('bps')) else 0  # 保留3位小数
-            ocfps = round(float(latest_fina['ocfps']), 3) if pd.notna(latest_fina.get('ocfps')) else 0  # 保留3位小数
-            
-            stock_info = {
-                "code": stock_code,
-                "name": stock_name,
-                "market_value": round(market_value, 2),  # 总市值（亿元）
-                "pe_ratio": round(float(latest_basic['pe']), 2) if pd.notna(latest_basic['pe']) else 0,  # 市盈率
-                "pb_ratio": round(float(latest_basic['pb']), 2) if pd.notna(latest_basic['pb']) else 0,  # 市净率
-                "ps_ratio": round(float(latest_basic['ps']), 2) if pd.notna(latest_basic['ps']) else 0,  # 市销率
-                "dividend_yield": dividend_yield,  # 股息率（小数）
-                "price": round(current_price, 2),  # 股价保留2位小数
-                "change_percent": round(float(daily_data['pct_chg'].iloc[0]) / 100, 4),  # 涨跌幅转换为小数
-                # 财务指标（全部转换为小数）
-                "roe": roe,  # ROE（小数）
-                "gross_profit_margin": gross_profit_margin,  # 毛利率（小数）
-                "net_profit_margin": net_profit_margin,  # 净利率（小数）
-                "debt_to_assets": debt_to_assets,  # 资产负债率（小数）
-                "revenue_yoy": revenue_yoy,  # 营收增长率（小数）
-                "net_profit_yoy": net_profit_yoy,  # 净利润增长率（小数）
-                "bps": bps,  # 每股净资产
-                "ocfps": ocfps,  # 每股经营现金流
-                "from_cache": False
-            }
-
-            # 获取目标值
-            targets = self.watchlist.get(stock_code, {})
-
-            result = {
-                "stock_info": stock_info,
-                "targets": targets
-            }
-
-            # 保存到缓存
-            self.save_cache(stock_code, result)
+                ts_codes[ts_code] = stock_code
+        if not ts_codes:
+            return results
+
+        codes = list(ts_codes.values())
+        cached = self._load_parts(codes)
+        now = datetime.now().timestamp()
+        refresh_quotes = force_refresh and self.session.quote_may_change()
+        parts = {namespace: {} for namespace in self.CACHE_PARTS}
+        stale = {namespace: {} for namespace in self.CACHE_PARTS}
+        for ts_code, stock_code in ts_codes.items():
+            for namespace in self.CACHE_PARTS:
+                entry = cached[namespace].get(stock_code)
+                if self.cache_store.is_fresh(entry, now) and not (namespace == 'quote' and refresh_quotes):
+                    parts[namespace][stock_code] = entry['data']
+                else:
+                    stale[namespace][ts_code] = stock_code
+        for namespace in self.CACHE_PARTS:
+            record_cache(namespace, hits=len(parts[namespace]), misses=len(stale[namespace]))
 
-            return result
+        fetched = set()
+        try:
+            if stale['quote']:
+                logger.debug("从API批量获取 %s 只股票的行情数据...", len(stale['quote']))
+                quotes = self._fetch_quotes(stale['quote'])
+                self._save_parts('quote', quotes, self.session.quote_expires_at())
+                parts['quote'].update(quotes)
+                fetched.update(quotes)
+            if stale['fina']:
+                finas, expires_at = self._fetch_finas(stale['fina'])
+                self._save_parts('fina', finas, expires_at)
+                parts['fina'].update(finas)
+                fetched.update(finas)
         except Exception as e:
-            print(f"Error fetching stock info: {str(e)}")
-            import traceback
-            print(f"详细错误: {traceback.format_exc()}")
-            return {"error": f"获取股票数据失败: {str(e)}"}
+            logger.exception("批量获取股票数据失败: %s", e)
+            for stock_code in codes:
+                if stock_code not in parts['quote']:
+                    results[stock_code] = {"error": f"获取股票数据失败: {str(e)}"}
+
+        names = self.symbols.lookup_many(codes)['name']
+        watchlist = self.watchlist_snapshot()
+        for stock_code in codes:
+            if stock_code in results:
+                continue
+            quote = parts['quote'].get(stock_code)
+            if quote is None:
+                results[stock_code] = {"error": "无法获取股票行情数据"}
+                continue
+            results[stock_code] = {
+                "stock_info": self._compose_stock_info(stock_code, names.get(stock_code, ''), quote,
+                                                       parts['fina'].get(stock_code), stock_code not in fetched),
+                "targets": watchlist.get(stock_code, {})
+            }
+        return results
+
+    def refresh_fundamentals(self, stock_codes: list):
+        """只刷新已过期的财务指标缓存并更新财务历史，返回刷新的股票数"""
+        cached = self._load_parts(stock_codes)['fina']
+        now = datetime.now().timestamp()
+        stale = {}
+        for stock_code in stock_codes:
+            ts_code = self.symbols.to_ts_code(stock_code)
+            if ts_code and not self.cache_store.is_fresh(cached.get(stock_code), now):
+                stale[ts_code] = stock_code
+        finas = {}
+        if stale:
+            finas, expires_at = self._fetch_finas(stale)
+            self._save_parts('fina', finas, expires_at)
+        # 监控列表的财务历史：首次拉取，之后只追加新报告期（最新一期已由上面批量取得），价值分析直接使用
+        self.fina_history.ensure([ts_code for ts_code in map(self.symbols.to_ts_code, stock_codes) if ts_code])
+        return len(finas)
+
+    def _compose_stock_info(self, stock_code: str, name: str, quote: dict, fina: dict, from_cache: bool):
+        """由代码表中的名称、行情、财务指标组装stock_info，缺失的财务指标按0处理"""
+        fina = fina or {}
+        return {
+            "code": stock_code,
+            "name": name,
+            "market_value": quote['market_value'],  # 总市值（亿元）
+            "pe_ratio": quote['pe_ratio'],  # 市盈率
+            "pb_ratio": quote['pb_ratio'],  # 市净率
+            "ps_ratio": quote['ps_ratio'],  # 市销率
+            "dividend_yield": quote['dividend_yield'],  # 股息率（小数）
+            "price": quote['price'],  # 股价保留2位小数
+            "change_percent": quote['change_percent'],  # 涨跌幅（小数）
+            # 财务指标（全部转换为小数）
+            "roe": fina.get('roe', 0),  # ROE（小数）
+            "gross_profit_margin": fina.get('gross_profit_margin', 0),  # 毛利率（小数）
+            "net_profit_margin": fina.get('net_profit_margin', 0),  # 净利率（小数）
+            "debt_to_assets": fina.get('debt_to_assets', 0),  # 资产负债率（小数）
+            "revenue_yoy": fina.get('revenue_yoy', 0),  # 营收增长率（小数）
+            "net_profit_yoy": fina.get('net_profit_yoy', 0),  # 净利润增长率（小数）
+            "bps": fina.get('bps', 0),  # 每股净资产
+            "ocfps": fina.get('ocfps', 0),  # 每股经营现金流
+            "from_cache": from_cache
+        }
 
     def get_watchlist(self):
         result = []
-        for stock_code, targets in self.watchlist.items():
+        watchlist = self.watchlist_snapshot()
+        codes = list(watchlist)
+        cached = self._load_parts(codes)
+        names = self.symbols.lookup_many(codes)['name']
+        now = datetime.now().timestamp()
+        for stock_code, targets in watchlist.items():
             try:
-                # 从缓存获取数据
-                today = datetime.now().strftime('%Y-%m-%d')
-                if stock_code in self.cache_data and self.cache_data[stock_code]['timestamp'] == today:
-                    result.append(self.cache_data[stock_code]['data'])
+                if self.symbols.to_ts_code(stock_code) is None:
+                    logger.warning("不支持的股票代码: %s", stock_code)
                     continue
-
-                # 如果没有缓存，只获取基本信息
-                if stock_code.startswith('6'):
-                    ts_code = f"{stock_code}.SH"
-                elif stock_code.startswith(('0', '3')):
-                    ts_code = f"{stock_code}.SZ"
-                else:
-                    print(f"不支持的股票代码: {stock_code}")
+                stock_name = names.get(stock_code, '')
+
+                # 行情未过期时直接返回完整数据
+                quote = cached['quote'].get(stock_code)
+                if self.cache_store.is_fresh(quote, now):
+                    fina = cached['fina'].get(stock_code)
+                    result.append({
+                        "stock_info": self._compose_stock_info(stock_code, stock_name, quote['data'],
+                                                               fina and fina['data'], True),
+                        "targets": targets
+                    })
                     continue
-                    
-                # 获取股票名称
-                stock_name = pro.stock_basic(ts_code=ts_code, fields='name').iloc[0]['name']
-                
+
+                # 否则只返回名称，行情由前端批量刷新
                 result.append({
                     "stock_info": {
                         "code": stock_code,
@@ -198,123 +385,190 @@ class StockService:
                     "targets": targets
                 })
             except Exception as e:
-                print(f"Error getting watchlist info for {stock_code}: {str(e)}")
+                logger.warning("Error getting watchlist info for %s: %s", stock_code, e)
                 continue
         return result
 
     def add_watch(self, stock_code: str, target_market_value_min: float = None, target_market_value_max: float = None):
-        self.watchlist[stock_code] = {
-            "target_market_value": {
-                "min": target_market_value_min,
-                "max": target_market_value_max
+        with self._watchlist_lock:
+            self.watchlist[stock_code] = {
+                "target_market_value": {
+                    "min": target_market_value_min,
+                    "max": target_market_value_max
+                }
             }
-        }
-        self._save_watchlist()
+            self._save_watchlist()
         return {"status": "success"}
 
     def remove_watch(self, stock_code: str):
-        if stock_code in self.watchlist:
-            del self.watchlist[stock_code]
+        with self._watchlist_lock:
+            removed = self.watchlist.pop(stock_code, None) is not None
+            self._save_watchlist()
+        if removed:
             # 同时删除缓存
-            if stock_code in self.cache_data:
-                del self.cache_data[stock_code]
-                try:
-                    with open(self.cache_file, 'w', encoding='utf-8') as f:
-                        json.dump(self.cache_data, f, ensure_ascii=False, indent=4)
-                except Exception as e:
-                    print(f"Error saving cache after removal: {str(e)}")
-        self._save_watchlist()
+            try:
+                for namespace in self.CACHE_PARTS:
+                    self.cache_store.delete(namespace, stock_code)
+            except Exception as e:
+                logger.warning("Error removing cache: %s", e)
         return {"status": "success"}
 
     def update_target(self, stock_code: str, target_market_value_min: float = None, target_market_value_max: float = None):
         """更新股票的目标市值"""
-        if stock_code not in self.watchlist:
-            return {"error": "股票不在监控列表中"}
-            
-        self.watchlist[stock_code] = {
-            "target_market_value": {
-                "min": target_market_value_min,
-                "max": target_market_value_max
+        with self._watchlist_lock:
+            if stock_code not in self.watchlist:
+                return {"error": "股票不在监控列表中"}
+
+            self.watchlist[stock_code] = {
+                "target_market_value": {
+                    "min": target_market_value_min,
+                    "max": target_market_value_max
+                }
             }
-        }
-        self._save_watchlist()
+            self._save_watchlist()
         return {"status": "success"}
 
     def get_index_info(self):
-        """获取主要指数数据"""
+        """获取主要指数数据，所有请求共享服务端快照，过期后才重新拉取"""
+        if self._index_snapshot is not None and time.time() < self._index_expires_at:
+            record_cache('index_snapshot', hits=1)
+            return self._index_snapshot
+        record_cache('index_snapshot', misses=1)
+        with self._index_lock:
+            # 等锁期间可能已被其他请求刷新
+            if self._index_snapshot is not None and time.time() < self._index_expires_at:
+                return self._index_snapshot
+            try:
+                return self.refresh_index_snapshot()
+            except Exception as e:
+                logger.warning("获取指数数据失败: %s", e)
+                return self._index_snapshot or []
+
+    def _index_from_bars(self, ts_code: str, name: str):
+        """从日线库读取指数最近的日线，最新一行即当前行情；K线按日期倒序"""
+        kline = self.bars.window('index', ts_code, limit=self.INDEX_KLINE_DAYS)[::-1]
+        if not kline:
+            return None
+        return {
+            'code': ts_code,
+            'name': name,
+            'price': kline[0]['close'],
+            'change': kline[0]['pct_chg'],
+            'kline_data': [{key: bar[key] for key in ('date', 'open', 'close', 'high', 'low', 'vol')} for bar in kline]
+        }
+
+    def refresh_index_snapshot(self):
+        """把指数日线同步到日线库（已是最新时不访问上游）后重建快照，有效期按交易时段计算"""
+        self.bars.sync('index', list(self.INDEX_CODES))
+        result = []
+        for ts_code, name in self.INDEX_CODES.items():
+            try:
+                data = self._index_from_bars(ts_code, name)
+                if data is not None:
+                    result.append(data)
+            except Exception as e:
+                logger.warning("获取指数 %s 数据失败: %s", ts_code, e)
+        if not result:
+            raise ValueError("所有指数数据获取失败")
+
+        self._index_snapshot = result
+        # 部分指数失败时尽快重试，其余情况按交易时段决定有效期
+        if len(result) < len(self.INDEX_CODES):
+            self._index_expires_at = time.time() + Config.QUOTE_TTL_OPEN
+        else:
+            self._index_expires_at = self.session.quote_expires_at()
+        return result
+
+    def sync_bars(self):
+        """回填监控列表中新增的股票，并把日线库追加到最近一个已入库的交易日"""
+        ts_codes = [ts_code for ts_code in map(self.symbols.to_ts_code, self.watchlist_snapshot()) if ts_code]
+        return {
+            "stock": self.bars.sync('stock', ts_codes),
+            "index": self.bars.sync('index', list(self.INDEX_CODES))
+        }
+
+    def get_history(self, stock_code: str, start: str = None, end: str = None, limit: int = None):
+        """从日线库读取股票的历史日线，库中没有时先回填"""
+        ts_code = self.symbols.to_ts_code(stock_code)
+        if ts_code is None:
+            return {"error": "不支持的股票代码"}
+        return self._bar_history('stock', ts_code, start, end, limit)
+
+    def get_index_history(self, ts_code: str, start: str = None, end: str = None, limit: int = None):
+        """从日线库读取指数的历史日线，库中没有时先回填"""
+        return self._bar_history('index', ts_code, start, end, limit)
+
+    def _bar_history(self, kind: str, ts_code: str, start: str, end: str, limit: int):
         try:
-            # 主要指数代码列表
-            index_codes = {
-                '000001.SH': '上证指数',
-                '399001.SZ': '深证成指',
-                '399006.SZ': '创业板指',
-                '000016.SH': '上证50',
-                '000300.SH': '沪深300',
-                '000905.SH': '中证500',
-                '000852.SH': '中证1000',
-                '899050.BJ': '北证50',
-            }
-            
-            result = []
-            for ts_code, name in index_codes.items():
-                try:
-                    # 获取指数基本信息
-                    df = pro.index_daily(ts_code=ts_code, limit=1)
-                    if not df.empty:
-                        data = df.iloc[0]
-                        # 获取K线数据(最近20天)
-                        kline_df = pro.index_daily(ts_code=ts_code, limit=20)
-                        kline_data = []
-                        if not kline_df.empty:
-                            for _, row in kline_df.iterrows():
-                                kline_data.append({
-                                    'date': row['trade_date'],
-                                    'open': float(row['open']),
-                                    'close': float(row['close']),
-                                    'high': float(row['high']),
-                                    'low': float(row['low']),
-                                    'vol': float(row['vol'])
-                                })
-                        
-                        result.append({
-                            'code': ts_code,
-                            'name': name,
-                            'price': float(data['close']),
-                            'change': float(data['pct_chg']),
-                            'kline_data': kline_data
-                        })
-                except Exception as e:
-                    print(f"获取指数 {ts_code} 数据失败: {str(e)}")
-                    continue
-            
-            return result
+            self.bars.ensure(kind, ts_code)
+        except Exception as e:
+            # 上游失败时返回库中已有的数据
+            logger.warning("更新 %s 日线失败: %s", ts_code, e)
+        bars = self.bars.window(kind, ts_code, start, end, limit)
+        if not bars:
+            return {"error": "暂无日线数据"}
+        return {"ts_code": ts_code, "bars": bars}
+
+    def get_fina_history(self, stock_code: str):
+        """最近多个报告期的财务指标（按列，报告期升序）和趋势指标"""
+        ts_code = self.symbols.to_ts_code(stock_code)
+        if ts_code is None:
+            return {"error": "不支持的股票代码"}
+        try:
+            history = self.fina_history.get(ts_code)
         except Exception as e:
-            print(f"获取指数数据失败: {str(e)}")
-            return [] 
+            logger.warning("获取 %s 财务历史失败: %s", stock_code, e)
+            return {"error": f"获取财务历史失败: {str(e)}"}
+        if history is None:
+            return {"error": "无法获取财务历史"}
+        return {"code": stock_code, "name": self.symbols.get_name(stock_code), **history}
+
+    def _memoized(self, namespace: str, stock_code: str, fetch, force_refresh: bool = False, valid=None):
+        """
+        有效期内直接返回缓存结果，否则调用fetch获取并缓存；返回error的结果不缓存
+        :param namespace: MEMO_NAMESPACES之一
+        :param fetch: 无参数的获取函数
+        :param valid: 可选，由缓存结果判断其依赖的本地数据是否未变，返回False时即使未过期也重新获取
+        """
+        if not force_refresh:
+            try:
+                entry = self.cache_store.get(namespace, stock_code)
+                if entry and self.cache_store.is_fresh(entry) and (valid is None or valid(entry['data'])):
+                    record_cache(namespace, hits=1)
+                    return entry['data']
+            except Exception as e:
+                logger.warning("Error loading cache: %s", e)
 
-    def get_company_detail(self, stock_code: str):
+        record_cache(namespace, misses=1)
+        result = fetch()
+        if "error" not in result:
+            self._save_parts(namespace, {stock_code: result}, time.time() + Config.DETAIL_CACHE_TTL)
+        return result
+
+    def get_company_detail(self, stock_code: str, force_refresh: bool = False):
+        """获取公司详情（基本信息、公司资料、最新财务指标和估值）"""
+        return self._memoized('company_detail', stock_code,
+                              lambda: self._fetch_company_detail(stock_code), force_refresh)
+
+    def _fetch_company_detail(self, stock_code: str):
         try:
-            print(f"开始获取公司详情: {stock_code}")
+            logger.debug("开始获取公司详情: %s", stock_code)
             
             # 处理股票代码格式
-            if stock_code.startswith('6'):
-                ts_code = f"{stock_code}.SH"
-            elif stock_code.startswith(('0', '3')):
-                ts_code = f"{stock_code}.SZ"
-            else:
-                print(f"不支持的股票代码格式: {stock_code}")
+            ts_code = self.symbols.to_ts_code(stock_code)
+            if ts_code is None:
+                logger.warning("不支持的股票代码格式: %s", stock_code)
                 return {"error": "不支持的股票代码"}
 
-            print(f"转换后的ts_code: {ts_code}")
+            logger.debug("转换后的ts_code: %s", ts_code)
 
-            # 获取公司基本信息
-            basic = pro.stock_basic(ts_code=ts_code, fields='name,industry,area,list_date')
-            if basic.empty:
-                print(f"无法获取公司基本信息: {ts_code}")
+            # 从代码表获取公司基本信息
+            company_info = self.symbols.lookup(stock_code)
+            if company_info is None:
+                logger.warning("无法获取公司基本信息: %s", ts_code)
                 return {"error": "无法获取公司信息"}
             
-            company_info = basic.iloc[0]
-            print(f"获取到的公司基本信息: {company_info.to_dict()}")
+            logger.debug("获取到的公司基本信息: %s", company_info)
             
             # 获取公司详细信息
             try:
@@ -346,7 +600,7 @@ class StockService:
                         "employees": 0, "main_business": "", "business_scope": ""
                     }
             except Exception as e:
-                print(f"获取公司详细信息失败: {str(e)}")
+                logger.warning("获取公司详细信息失败: %s", e)
                 company_detail_dict = {
                     "com_name": "", "chairman": "", "manager": "", "secretary": "",
                     "reg_capital": 0, "setup_date": "", "province": "", "city": "",
@@ -356,19 +610,15 @@ class StockService:
             
             # 获取最新财务指标
             try:
-                fina = pro.fina_indicator(ts_code=ts_code, period=datetime.now().strftime('%Y%m%d'))
-                if fina.empty:
-                    print("当前期间无财务数据，尝试获取最新一期数据")
-                    fina = pro.fina_indicator(ts_code=ts_code, limit=1)
+                fina_info = self.fina_store.get(ts_code)
                 
-                if fina.empty:
-                    print(f"无法获取财务指标数据: {ts_code}")
+                if fina_info is None:
+                    logger.warning("无法获取财务指标数据: %s", ts_code)
                     return {"error": "无法获取财务数据"}
                     
-                fina_info = fina.iloc[0]
-                print(f"获取到的财务指标: {fina_info.to_dict()}")
+                logger.debug("获取到的财务指标: %s", fina_info)
             except Exception as e:
-                print(f"获取财务指标失败: {str(e)}")
+                logger.warning("获取财务指标失败: %s", e)
                 return {"error": "获取财务指标失败"}
             
             # 获取市值信息（用于PE、PB等指标）
@@ -377,14 +627,15 @@ class StockService:
                 if not daily_basic.empty:
                     latest_basic = daily_basic.iloc[0]
                 else:
-                    print("无法获取PE/PB数据")
+                    logger.warning("无法获取PE/PB数据")
                     latest_basic = pd.Series({'pe': 0, 'pb': 0, 'ps': 0, 'dv_ratio': 0})
             except Exception as e:
-                print(f"获取PE/PB失败: {str(e)}")
+                logger.warning("获取PE/PB失败: %s", e)
                 latest_basic = pd.Series({'pe': 0, 'pb': 0, 'ps': 0, 'dv_ratio': 0})
             
             result = {
                 "basic_info": {
+                    "code": stock_code,
                     "name": str(company_info['name']),
                     "industry": str(company_info['industry']),
                     "list_date": str(company_info['list_date']),
@@ -441,24 +692,23 @@ class StockService:
                 }
             }
             
-            print(f"返回结果: {result}")
+            logger.debug("返回结果: %s", result)
             return result
             
         except Exception as e:
-            print(f"Error getting company detail: {str(e)}")
-            import traceback
-            print(f"详细错误: {traceback.format_exc()}")
+            logger.exception("Error getting company detail: %s", e)
             return {"error": f"获取公司详情失败: {str(e)}"} 
 
-    def get_top_holders(self, stock_code: str):
+    def get_top_holders(self, stock_code: str, force_refresh: bool = False):
         """获取前十大股东数据"""
+        return self._memoized('top_holders', stock_code,
+                              lambda: self._fetch_top_holders(stock_code), force_refresh)
+
+    def _fetch_top_holders(self, stock_code: str):
         try:
             # 处理股票代码格式
-            if stock_code.startswith('6'):
-                ts_code = f"{stock_code}.SH"
-            elif stock_code.startswith(('0', '3')):
-                ts_code = f"{stock_code}.SZ"
-            else:
+            ts_code = self.symbols.to_ts_code(stock_code)
+            if ts_code is None:
                 return {"error": "不支持的股票代码"}
 
             # 获取最新一期的股东数据
@@ -493,20 +743,27 @@ class StockService:
             return result
             
         except Exception as e:
-            print(f"获取股东数据失败: {str(e)}")
-            import traceback
-            print(f"详细错误: {traceback.format_exc()}")
+            logger.exception("获取股东数据失败: %s", e)
             return {"error": f"获取股东数据失败: {str(e)}"} 
 
-    def get_value_analysis_data(self, stock_code: str):
+    def get_value_analysis_data(self, stock_code: str, force_refresh: bool = False):
         """获取价值投资分析所需的关键财务指标"""
+        return self._memoized('value_analysis', stock_code,
+                              lambda: self._fetch_value_analysis_data(stock_code), force_refresh,
+                              lambda data: self._trend_is_current(stock_code, data))
+
+    def _trend_is_current(self, stock_code: str, data: dict) -> bool:
+        """缓存结果中的趋势指标与已保存的财务历史是否同一报告期（历史在缓存之后才拉取或追加时为False）"""
+        ts_code = self.symbols.to_ts_code(stock_code)
+        history = self.fina_history.stored(ts_code) if ts_code else None
+        stored_period = history["metrics"]["latest_period"] if history else None
+        return (data.get("trend") or {}).get("latest_period") == stored_period
+
+    def _fetch_value_analysis_data(self, stock_code: str):
         try:
             # 处理股票代码格式
-            if stock_code.startswith('6'):
-                ts_code = f"{stock_code}.SH"
-            elif stock_code.startswith(('0', '3')):
-                ts_code = f"{stock_code}.SZ"
-            else:
+            ts_code = self.symbols.to_ts_code(stock_code)
+            if ts_code is None:
                 return {"error": "不支持的股票代码"}
 
             # 获取最新每日指标（估值数据）
@@ -515,19 +772,18 @@ class StockService:
                 return {"error": "无法获取股票估值数据"}
 
             # 获取最新财务指标
-            fina = pro.fina_indicator(ts_code=ts_code, fields='''roe,grossprofit_margin,netprofit_margin,
-                netprofit_yoy,dt_netprofit_yoy,tr_yoy,or_yoy,assets_turn,inv_turn,ar_turn,current_ratio,
-                quick_ratio,debt_to_assets,ocf_to_or,ocf_yoy,eps,bps,cfps,ocfps,retainedps''', limit=1)
-            if fina.empty:
+            latest_fina = self.fina_store.get(ts_code)
+            if latest_fina is None:
                 return {"error": "无法获取财务指标数据"}
 
             # 获取股票名称和当前价格
             basic_info = pro.daily(ts_code=ts_code, fields='close,trade_date', limit=1)
-            stock_name = pro.stock_basic(ts_code=ts_code, fields='name').iloc[0]['name']
+            stock_name = self.symbols.get_name(stock_code)
+            # 已保存的财务历史（不访问上游）
+            history = self.fina_history.get(ts_code, fetch=False)
 
             # 整合数据
             latest_daily = daily_basic.iloc[0]
-            latest_fina = fina.iloc[0]
             latest_price = basic_info.iloc[0]
 
             analysis_data = {
@@ -575,13 +831,12 @@ class StockService:
                     "cfps": float(latest_fina['cfps']) if pd.notna(latest_fina['cfps']) else None,
                     "ocfps": float(latest_fina['ocfps']) if pd.notna(latest_fina['ocfps']) else None,
                     "retained_eps": float(latest_fina['retainedps']) if pd.notna(latest_fina['retainedps']) else None
-                }
+                },
+                "trend": history["metrics"] if history else None
             }
 
             return analysis_data
 
         except Exception as e:
-            print(f"获取价值投资分析数据失败: {str(e)}")
-            import traceback
-            print(f"详细错误: {traceback.format_exc()}")
+            logger.exception("获取价值投资分析数据失败: %s", e)
             return {"error": f"获取价值投资分析数据失败: {str(e)}"} 
\ No newline at end of file
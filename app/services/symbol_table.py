@@ -0,0 +1,126 @@
+import logging
+import os
+import threading
+import time
+import pandas as pd
+from app import pro
+from app.config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class SymbolTable:
+    """
+    全市场股票代码表（stock_basic）
+    一次加载全部上市股票，按6位代码建立索引，持久化到本地CSV以便快速重启
+    名称、行业、地区、上市日期以及交易所后缀都从这里解析，不再逐只调用stock_basic
+    """
+
+    FIELDS = ['ts_code', 'symbol', 'name', 'area', 'industry', 'list_date']
+    # 代码表中查不到时按代码前缀推断交易所
+    EXCHANGE_PREFIXES = (('6', 'SH'), ('0', 'SZ'), ('3', 'SZ'), ('4', 'BJ'), ('8', 'BJ'), ('92', 'BJ'))
+
+    def __init__(self, file_path: str = None, max_age: int = None):
+        self.file_path = file_path or Config.SYMBOL_TABLE_FILE
+        self.max_age = max_age if max_age is not None else Config.SYMBOL_TABLE_MAX_AGE
+        self._lock = threading.Lock()
+        self._frame = self._empty_frame()
+        self._loaded_at = 0
+        self._last_attempt = 0
+        self.load()
+
+    def _empty_frame(self) -> pd.DataFrame:
+        return pd.DataFrame(columns=self.FIELDS).set_index('symbol')
+
+    def _index(self, df: pd.DataFrame) -> pd.DataFrame:
+        """整理为以6位代码为索引的紧凑表，行业、地区用分类类型存储"""
+        df = df[self.FIELDS].astype(str).drop_duplicates('symbol').set_index('symbol')
+        df['area'] = df['area'].astype('category')
+        df['industry'] = df['industry'].astype('category')
+        return df
+
+    def load(self):
+        """从本地文件加载代码表"""
+        try:
+            if os.path.exists(self.file_path):
+                df = pd.read_csv(self.file_path, dtype=str, keep_default_na=False)
+                self._frame = self._index(df)
+                self._loaded_at = os.path.getmtime(self.file_path)
+        except Exception as e:
+            logger.warning("加载股票代码表失败: %s", e)
+
+    def refresh(self):
+        """从tushare重新拉取全市场代码表并写入本地文件"""
+        self._last_attempt = time.time()
+        df = pro.stock_basic(list_status='L', fields=','.join(self.FIELDS))
+        if df.empty:
+            raise ValueError("stock_basic返回为空")
+        frame = self._index(df)
+        tmp_path = f"{self.file_path}.tmp"
+        frame.reset_index()[self.FIELDS].to_csv(tmp_path, index=False)
+        os.replace(tmp_path, self.file_path)
+        with self._lock:
+            self._frame = frame
+            self._loaded_at = time.time()
+        logger.info("股票代码表已更新，共 %s 只股票", len(frame))
+
+    def _can_retry(self) -> bool:
+        """距上次尝试刷新超过最小间隔，避免上游不可用时反复请求"""
+        return time.time() - self._last_attempt >= Config.SYMBOL_TABLE_RETRY_INTERVAL
+
+    def refresh_if_stale(self):
+        """代码表为空或超过有效期时刷新，失败时继续使用旧数据"""
+        if len(self._frame) and time.time() - self._loaded_at < self.max_age:
+            return
+        if not self._can_retry():
+            return
+        try:
+            self.refresh()
+        except Exception as e:
+            logger.warning("刷新股票代码表失败: %s", e)
+
+    def lookup(self, symbol: str):
+        """查询单只股票的代码表记录，返回dict，查不到返回None"""
+        self.refresh_if_stale()
+        frame = self._frame
+        if symbol not in frame.index:
+            # 新上市股票可能还不在代码表中，限制频率补刷一次
+            if not self._can_retry():
+                return None
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.warning("刷新股票代码表失败: %s", e)
+                return None
+            frame = self._frame
+            if symbol not in frame.index:
+                return None
+        row = frame.loc[symbol]
+        return {"symbol": symbol, **{field: str(row[field]) for field in frame.columns}}
+
+    def lookup_many(self, symbols: list) -> pd.DataFrame:
+        """批量查询，返回以6位代码为索引的DataFrame，查不到的代码不在结果中"""
+        self.refresh_if_stale()
+        frame = self._frame
+        return frame[frame.index.isin(symbols)]
+
+    def frame(self) -> pd.DataFrame:
+        """全市场代码表，以6位代码为索引"""
+        self.refresh_if_stale()
+        return self._frame
+
+    def get_name(self, symbol: str) -> str:
+        record = self.lookup(symbol)
+        return record['name'] if record else ''
+
+    def to_ts_code(self, symbol: str):
+        """6位代码转换为tushare的ts_code，无法识别返回None"""
+        if len(symbol) != 6 or not symbol.isdigit():
+            return None
+        frame = self._frame
+        if symbol in frame.index:
+            return frame.at[symbol, 'ts_code']
+        for prefix, exchange in self.EXCHANGE_PREFIXES:
+            if symbol.startswith(prefix):
+                return f"{symbol}.{exchange}"
+        return None
@@ -0,0 +1,90 @@
+import json
+import logging
+import os
+import threading
+import time
+from datetime import date, datetime
+from app import pro
+from app.config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class TradingCalendar:
+    """
+    交易日历（trade_cal）：每个自然年只拉取一次全年日历并保存到本地JSON，之后判断交易日只查内存中的集合
+    - 首次用到某一年时从本地文件或上游加载，节假日、调休都以交易所日历为准
+    - 上游不可用或尚未发布该年日历时按周一至周五判断，间隔Config.TRADING_CALENDAR_RETRY_INTERVAL后重试
+    """
+
+    def __init__(self, file_path: str = None, exchange: str = None):
+        self.file_path = file_path or Config.TRADING_CALENDAR_FILE
+        self.exchange = exchange or Config.TRADING_CALENDAR_EXCHANGE
+        self._lock = threading.Lock()
+        # {年份: 该年交易日集合}
+        self._years = {}
+        self._last_attempt = {}
+        self.load()
+
+    def load(self):
+        """从本地文件加载已保存的各年日历"""
+        try:
+            if os.path.exists(self.file_path):
+                with open(self.file_path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                if data.get("exchange") == self.exchange:
+                    self._years = {
+                        int(year): {datetime.strptime(day, '%Y%m%d').date() for day in days}
+                        for year, days in data.get("years", {}).items()
+                    }
+        except Exception as e:
+            logger.warning("加载交易日历失败: %s", e)
+
+    def _save(self):
+        data = {
+            "exchange": self.exchange,
+            "years": {str(year): sorted(day.strftime('%Y%m%d') for day in days) for year, days in self._years.items()}
+        }
+        tmp_path = f"{self.file_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.file_path)
+
+    def _fetch_year(self, year: int):
+        """拉取一整年的日历，返回交易日集合"""
+        df = pro.trade_cal(exchange=self.exchange, start_date=f"{year}0101", end_date=f"{year}1231",
+                           fields='cal_date,is_open')
+        if df.empty:
+            raise ValueError(f"trade_cal没有{year}年的数据")
+        opened = df[df['is_open'].astype(int) == 1]
+        return {datetime.strptime(str(day), '%Y%m%d').date() for day in opened['cal_date']}
+
+    def year(self, year: int):
+        """某一年的交易日集合，无法获取时返回None"""
+        days = self._years.get(year)
+        if days is not None:
+            return days
+        with self._lock:
+            if year in self._years:
+                return self._years[year]
+            if time.time() - self._last_attempt.get(year, 0) < Config.TRADING_CALENDAR_RETRY_INTERVAL:
+                return None
+            self._last_attempt[year] = time.time()
+            try:
+                days = self._fetch_year(year)
+            except Exception as e:
+                logger.warning("获取 %s 年交易日历失败，暂按工作日判断: %s", year, e)
+                return None
+            self._years[year] = days
+            try:
+                self._save()
+            except Exception as e:
+                logger.warning("保存交易日历失败: %s", e)
+            logger.info("%s 年交易日历已更新，共 %s 个交易日", year, len(days))
+            return days
+
+    def is_trading_day(self, day: date) -> bool:
+        days = self.year(day.year)
+        if days is None:
+            return day.weekday() < 5
+        return day in days
@@ -0,0 +1,155 @@
+from datetime import datetime, date, time, timedelta
+import pytz
+from app.config import Config
+
+
+class TradingSession:
+    """
+    A股交易时段与缓存有效期策略
+    时间统一按北京时间计算，返回的过期时间为Unix时间戳（秒）
+    """
+
+    TIMEZONE = pytz.timezone('Asia/Shanghai')
+    # 连续竞价时段：上午9:30-11:30，下午13:00-15:00
+    SESSIONS = [(time(9, 30), time(11, 30)), (time(13, 0), time(15, 0))]
+    # 收盘后日线数据的入库时间，此前行情仍可能变化
+    QUOTE_SETTLE_TIME = time(16, 30)
+
+    def __init__(self, calendar=None):
+        # 交易日历（TradingCalendar），不提供时按周一至周五判断交易日
+        self.calendar = calendar
+
+    def now(self) -> datetime:
+        return datetime.now(self.TIMEZONE)
+
+    def _localize(self, now: datetime = None) -> datetime:
+        if now is None:
+            return self.now()
+        if now.tzinfo is None:
+            return self.TIMEZONE.localize(now)
+        return now.astimezone(self.TIMEZONE)
+
+    def is_trading_day(self, day: date) -> bool:
+        """是否为交易日：有交易日历时以日历为准，否则按周一至周五判断"""
+        if self.calendar is not None:
+            return self.calendar.is_trading_day(day)
+        return day.weekday() < 5
+
+    def is_open(self, now: datetime = None) -> bool:
+        """当前是否处于连续竞价时段"""
+        now = self._localize(now)
+        if not self.is_trading_day(now.date()):
+            return False
+        return any(start <= now.time() < end for start, end in self.SESSIONS)
+
+    def is_settling(self, now: datetime = None) -> bool:
+        """是否处于收盘后、日线数据尚未入库的时段"""
+        now = self._localize(now)
+        if not self.is_trading_day(now.date()):
+            return False
+        return self.SESSIONS[-1][1] <= now.time() < self.QUOTE_SETTLE_TIME
+
+    def quote_may_change(self, now: datetime = None) -> bool:
+        """行情是否仍可能变化：交易时段内，或收盘后日线尚未入库"""
+        now = self._localize(now)
+        return self.is_open(now) or self.is_settling(now)
+
+    def last_settled_day(self, now: datetime = None) -> date:
+        """日线数据已入库的最近一个交易日：当天入库时间之后为当天，否则为上一个交易日"""
+        now = self._localize(now)
+        day = now.date()
+        if not (self.is_trading_day(day) and now.time() >= self.QUOTE_SETTLE_TIME):
+            day -= timedelta(days=1)
+            while not self.is_trading_day(day):
+                day -= timedelta(days=1)
+        return day
+
+    def trading_days_between(self, start: date, end: date) -> list:
+        """start（不含）到end（含）之间的交易日"""
+        days = []
+        day = start + timedelta(days=1)
+        while day <= end:
+            if self.is_trading_day(day):
+                days.append(day)
+            day += timedelta(days=1)
+        return days
+
+    def next_open(self, now: datetime = None) -> datetime:
+        """下一个连续竞价时段的开始时间（当前处于交易时段内时返回下一段）"""
+        now = self._localize(now)
+        day = now.date()
+        while True:
+            if self.is_trading_day(day):
+                for start, _ in self.SESSIONS:
+                    candidate = self.TIMEZONE.localize(datetime.combine(day, start))
+                    if candidate > now:
+                        return candidate
+            day += timedelta(days=1)
+
+    def quote_expires_at(self, now: datetime = None) -> float:
+        """
+        行情数据的过期时间
+        交易时段内使用短TTL；收盘后到日线入库前使用结算TTL；午休、收盘后和非交易日有效至下一次开盘
+        """
+        now = self._localize(now)
+        if self.is_open(now):
+            return now.timestamp() + Config.QUOTE_TTL_OPEN
+        if self.is_settling(now):
+            return now.timestamp() + Config.QUOTE_TTL_SETTLE
+        return self.next_open(now).timestamp()
+
+    @staticmethod
+    def next_period_end(end_date: str) -> date:
+        """报告期（YYYYMMDD）的下一个季度末"""
+        following = datetime.strptime(end_date, '%Y%m%d').date() + timedelta(days=1)
+        quarter_end_month = (following.month - 1) // 3 * 3 + 3
+        if quarter_end_month == 12:
+            return date(following.year, 12, 31)
+        return date(following.year, quarter_end_month + 1, 1) - timedelta(days=1)
+
+    @staticmethod
+    def previous_period_end(end_date: str) -> date:
+        """报告期（YYYYMMDD）的上一个季度末"""
+        period = datetime.strptime(end_date, '%Y%m%d').date()
+        quarter_start_month = (period.month - 1) // 3 * 3 + 1
+        return date(period.year, quarter_start_month, 1) - timedelta(days=1)
+
+    def disclosure_periods(self, day: date) -> tuple:
+        """
+        day时的报告期状态：([披露窗口内的报告期（已结束、披露截止日未过），由新到旧], 截止日已过的最近报告期)
+        如4月中旬同时处于一季报和上一年年报的披露窗口
+        """
+        period = self.previous_period_end(day.strftime('%Y%m%d'))
+        disclosing = []
+        while self.disclosure_deadline(period.strftime('%Y%m%d')) >= day:
+            disclosing.append(period.strftime('%Y%m%d'))
+            period = self.previous_period_end(period.strftime('%Y%m%d'))
+        return disclosing, period.strftime('%Y%m%d')
+
+    @staticmethod
+    def disclosure_deadline(end_date: str) -> date:
+        """报告期的法定披露截止日：一季报4月30日、半年报8月31日、三季报10月31日、年报次年4月30日"""
+        period = datetime.strptime(end_date, '%Y%m%d').date()
+        if period.month == 3:
+            return date(period.year, 4, 30)
+        if period.month == 6:
+            return date(period.year, 8, 31)
+        if period.month == 9:
+            return date(period.year, 10, 31)
+        return date(period.year + 1, 4, 30)
+
+    def fina_expires_at(self, end_date: str = None, now: datetime = None) -> float:
+        """
+        财务指标的过期时间
+        下一个报告期结束前不可能披露新数据，有效至下一个季度末；进入披露窗口后每天复查一次
+        """
+        now = self._localize(now)
+        recheck = now.timestamp() + Config.FINA_RECHECK_TTL
+        if not end_date:
+            return recheck
+        try:
+            next_end = self.next_period_end(str(end_date))
+        except ValueError:
+            return recheck
+        boundary = self.TIMEZONE.localize(datetime.combine(next_end + timedelta(days=1), time(0, 0)))
+        return max(boundary.timestamp(), recheck)
@@ -0,0 +1,193 @@
+import logging
+import random
+import threading
+import time
+from concurrent.futures import Future
+from functools import partial
+from app.config import Config
+from app.services.metrics import track_upstream, RATE_LIMIT_WAIT, current_endpoint
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """令牌桶：按固定速率补充令牌，桶容量决定允许的突发请求数"""
+
+    def __init__(self, rate_per_minute: float, capacity: int):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def acquire(self) -> float:
+        """取一个令牌，没有令牌时阻塞等待，返回等待的秒数"""
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+    def drain(self):
+        """上游返回频率超限时清空令牌，后续请求重新按速率排队"""
+        with self._lock:
+            self._refill(time.monotonic())
+            self.tokens = min(self.tokens, 0.0)
+
+
+class TushareClient:
+    """
+    tushare pro接口的限流包装，用法与pro相同（pro.daily_basic(...)）
+    - 每个接口一个令牌桶，速率按接口配置，避免触发tushare的每分钟调用次数限制
+    - 参数完全相同的并发请求合并为一次调用，所有调用方共享结果
+    - 遇到频率超限错误时退避重试
+    - 记录各接口的排队数、等待时间、调用和重试次数
+    """
+
+    # tushare频率超限错误信息中的关键字；每天的次数用完时重试没有意义，不在此列
+    QUOTA_ERROR_KEYWORDS = ('每分钟最多访问', '每小时最多访问')
+
+    def __init__(self, api):
+        self._api = api
+        self._buckets = {}
+        self._in_flight = {}
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def __getattr__(self, api_name: str):
+        if api_name.startswith('_'):
+            raise AttributeError(api_name)
+        return partial(self.query, api_name)
+
+    def _bucket(self, api_name: str) -> TokenBucket:
+        with self._lock:
+            bucket = self._buckets.get(api_name)
+            if bucket is None:
+                rate = Config.TUSHARE_RATE_LIMITS.get(api_name, Config.TUSHARE_DEFAULT_RATE_LIMIT)
+                bucket = TokenBucket(rate, Config.TUSHARE_BURST)
+                self._buckets[api_name] = bucket
+            return bucket
+
+    def _metric(self, api_name: str) -> dict:
+        metric = self._metrics.get(api_name)
+        if metric is None:
+            metric = {
+                "calls": 0,
+                "coalesced": 0,
+                "retries": 0,
+                "quota_errors": 0,
+                "errors": 0,
+                "queue_depth": 0,
+                "max_queue_depth": 0,
+                "wait_total_ms": 0.0,
+                "wait_max_ms": 0.0,
+                "last_wait_ms": 0.0
+            }
+            self._metrics[api_name] = metric
+        return metric
+
+    @staticmethod
+    def _request_key(api_name: str, fields: str, kwargs: dict):
+        return api_name, fields, tuple(sorted((key, repr(value)) for key, value in kwargs.items()))
+
+    @classmethod
+    def is_quota_error(cls, error: Exception) -> bool:
+        message = str(error)
+        return any(keyword in message for keyword in cls.QUOTA_ERROR_KEYWORDS)
+
+    def query(self, api_name: str, fields: str = '', **kwargs):
+        """调用tushare接口，相同参数的进行中请求直接等待其结果"""
+        key = self._request_key(api_name, fields, kwargs)
+        with self._lock:
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._in_flight[key] = future
+            else:
+                self._metric(api_name)["coalesced"] += 1
+        if not leader:
+            # 合并的调用方拿到副本，避免修改共享的DataFrame
+            return future.result().copy()
+
+        try:
+            result = self._call(api_name, fields, kwargs)
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            # 发起调用的一方同样拿副本，原DataFrame只供合并的调用方复制，不会被原地修改
+            return result.copy()
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+
+    def _call(self, api_name: str, fields: str, kwargs: dict):
+        bucket = self._bucket(api_name)
+        attempt = 0
+        while True:
+            # 回放录制数据时不访问上游，无需排队
+            if getattr(self._api, 'rate_limited', True):
+                self._acquire(api_name, bucket)
+            try:
+                with track_upstream('tushare', api_name):
+                    result = self._api.query(api_name, fields=fields, **kwargs)
+                with self._lock:
+                    self._metric(api_name)["calls"] += 1
+                return result
+            except Exception as e:
+                quota_error = self.is_quota_error(e)
+                with self._lock:
+                    metric = self._metric(api_name)
+                    metric["calls"] += 1
+                    metric["quota_errors" if quota_error else "errors"] += 1
+                if not quota_error or attempt >= Config.TUSHARE_MAX_RETRIES:
+                    raise
+                bucket.drain()
+                delay = Config.TUSHARE_RETRY_BACKOFF * (2 ** attempt) * (1 + random.random())
+                attempt += 1
+                with self._lock:
+                    self._metric(api_name)["retries"] += 1
+                logger.warning("%s 触发频率限制，%.1f秒后第%s次重试", api_name, delay, attempt)
+                time.sleep(delay)
+
+    def _acquire(self, api_name: str, bucket: TokenBucket):
+        with self._lock:
+            metric = self._metric(api_name)
+            metric["queue_depth"] += 1
+            metric["max_queue_depth"] = max(metric["max_queue_depth"], metric["queue_depth"])
+        try:
+            waited_ms = bucket.acquire() * 1000
+        finally:
+            with self._lock:
+                metric["queue_depth"] -= 1
+        RATE_LIMIT_WAIT.observe(waited_ms / 1000, api=api_name, endpoint=current_endpoint())
+        with self._lock:
+            metric["wait_total_ms"] += waited_ms
+            metric["wait_max_ms"] = max(metric["wait_max_ms"], waited_ms)
+            metric["last_wait_ms"] = waited_ms
+
+    def metrics(self) -> dict:
+        """各接口的调用统计"""
+        with self._lock:
+            return {
+                api_name: {
+                    **metric,
+                    "wait_total_ms": round(metric["wait_total_ms"], 1),
+                    "wait_max_ms": round(metric["wait_max_ms"], 1),
+                    "last_wait_ms": round(metric["last_wait_ms"], 1),
+                    "tokens": round(self._buckets[api_name].tokens, 2) if api_name in self._buckets else None
+                }
+                for api_name, metric in self._metrics.items()
+            }
@@ -0,0 +1,320 @@
+"""
+本地的tushare和大模型替身，供离线压测使用
+
+FakeTushareApi实现tushare DataApi的query(api_name, fields, **kwargs)接口，返回按股票代码确定性生成的
+合成数据（列名与daily、daily_basic、fina_indicator、index_daily等接口一致）；
+FakeLLMClient实现openai客户端的chat.completions.create（含stream=True），返回符合各类分析格式的JSON。
+两者都可以配置延迟、错误率和每分钟调用次数上限，超限时抛出与真实上游相同措辞的错误。
+"""
+import hashlib
+import json
+import random
+import threading
+import time
+from collections import defaultdict, deque
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+import numpy as np
+import pandas as pd
+
+PROVINCES = ['北京', '上海', '广东', '浙江', '江苏', '四川', '湖北', '山东']
+INDUSTRIES = ['银行', '白酒', '半导体', '医药', '汽车', '电力', '软件服务', '化工', '家电', '食品']
+
+
+def make_symbols(count: int) -> list:
+    """生成count个6位股票代码，沪深北三个交易所交替分布"""
+    prefixes = ['600', '000', '300', '601', '002', '688', '830']
+    return [f"{prefixes[i % len(prefixes)]}{i // len(prefixes):03d}" for i in range(count)]
+
+
+def to_ts_code(symbol: str) -> str:
+    if symbol.startswith('6'):
+        return f"{symbol}.SH"
+    if symbol.startswith(('4', '8', '92')):
+        return f"{symbol}.BJ"
+    return f"{symbol}.SZ"
+
+
+def _seed(*parts) -> int:
+    return int(hashlib.md5('|'.join(map(str, parts)).encode()).hexdigest()[:8], 16)
+
+
+class RateLimiter:
+    """按接口统计最近60秒的调用次数，超过上限返回True"""
+
+    def __init__(self, per_minute: int):
+        self.per_minute = per_minute
+        self._calls = defaultdict(deque)
+        self._lock = threading.Lock()
+
+    def exceeded(self, name: str) -> bool:
+        if not self.per_minute:
+            return False
+        now = time.monotonic()
+        with self._lock:
+            calls = self._calls[name]
+            while calls and now - calls[0] >= 60:
+                calls.popleft()
+            if len(calls) >= self.per_minute:
+                return True
+            calls.append(now)
+            return False
+
+
+class FakeUpstream:
+    """延迟、错误率、限流和调用计数的公共部分"""
+
+    def __init__(self, latency: float = 0.02, jitter: float = 0.5, error_rate: float = 0.0,
+                 rate_limit: int = 0, seed: int = 0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.limiter = RateLimiter(rate_limit)
+        self.calls = defaultdict(int)
+        self.errors = defaultdict(int)
+        self.rate_limited = defaultdict(int)
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _enter(self, name: str, quota_message: str):
+        """模拟一次调用的排队和网络延迟，按配置抛出限流或随机错误"""
+        with self._lock:
+            self.calls[name] += 1
+            fail = self._random.random() < self.error_rate
+            delay = self.latency * (1 + self.jitter * (self._random.random() * 2 - 1))
+        if self.limiter.exceeded(name):
+            with self._lock:
+                self.rate_limited[name] += 1
+            raise Exception(quota_message)
+        time.sleep(max(0.0, delay))
+        if fail:
+            with self._lock:
+                self.errors[name] += 1
+            raise Exception(f"{name}: 模拟的上游错误")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                name: {"calls": self.calls[name], "errors": self.errors[name], "rate_limited": self.rate_limited[name]}
+                for name in sorted(self.calls)
+            }
+
+    def reset_stats(self):
+        with self._lock:
+            self.calls.clear()
+            self.errors.clear()
+            self.rate_limited.clear()
+
+
+class FakeTushareApi(FakeUpstream):
+    """tushare pro接口的替身：app.pro._api = FakeTushareApi(...)"""
+
+    def __init__(self, symbols: list, **kwargs):
+        super().__init__(**kwargs)
+        self.symbols = list(symbols)
+        self.today = datetime.now()
+
+    def query(self, api_name: str, fields: str = '', **kwargs):
+        self._enter(api_name, f"抱歉，您每分钟最多访问该接口{self.limiter.per_minute}次")
+        builder = getattr(self, f"_{api_name}", None)
+        df = builder(**kwargs) if builder else pd.DataFrame()
+        if fields:
+            columns = [field.strip() for field in fields.split(',') if field.strip()]
+            df = df.reindex(columns=columns)
+        offset = int(kwargs.get('offset') or 0)
+        limit = kwargs.get('limit')
+        df = df.iloc[offset:]
+        return df.head(int(limit)).reset_index(drop=True) if limit else df.reset_index(drop=True)
+
+    def _trade_dates(self, start_date: str = None, end_date: str = None, days: int = 20) -> list:
+        """工作日作为交易日，按日期倒序（与tushare一致）"""
+        end = datetime.strptime(end_date, '%Y%m%d') if end_date else self.today
+        start = datetime.strptime(start_date, '%Y%m%d') if start_date else end - timedelta(days=days * 2)
+        dates = pd.bdate_range(start, end)
+        return [date.strftime('%Y%m%d') for date in reversed(dates)][:None if start_date else days]
+
+    @staticmethod
+    def _codes(ts_code: str = None) -> list:
+        return [code for code in (ts_code or '').split(',') if code]
+
+    def _daily_rows(self, ts_codes: list, dates: list) -> pd.DataFrame:
+        """ts_code × trade_date的随机游走行情，同一代码同一日期每次生成的值相同"""
+        frames = []
+        for ts_code in ts_codes:
+            rng = np.random.default_rng(_seed('daily', ts_code))
+            base = rng.uniform(5, 200)
+            pct = rng.normal(0, 1.5, len(dates))
+            close = np.round(base * np.cumprod(1 + pct / 100), 2)
+            frames.append(pd.DataFrame({
+                'ts_code': ts_code,
+                'trade_date': dates,
+                'open': np.round(close * (1 - pct / 200), 2),
+                'high': np.round(close * 1.01, 2),
+                'low': np.round(close * 0.99, 2),
+                'close': close,
+                'pre_close': np.round(close / (1 + pct / 100), 2),
+                'change': np.round(close - close / (1 + pct / 100), 2),
+                'pct_chg': np.round(pct, 2),
+                'vol': np.round(rng.uniform(1e4, 1e6, len(dates)), 2),
+                'amount': np.round(rng.uniform(1e5, 1e7, len(dates)), 3),
+            }))
+        return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+    def _dates_for(self, trade_date=None, start_date=None, end_date=None, limit=None):
+        if trade_date:
+            return [trade_date]
+        return self._trade_dates(start_date, end_date, days=int(limit) if limit else 20)
+
+    def _daily(self, ts_code=None, trade_date=None, start_date=None, end_date=None, limit=None, **kwargs):
+        codes = self._codes(ts_code) or [to_ts_code(symbol) for symbol in self.symbols]
+        return self._daily_rows(codes, self._dates_for(trade_date, start_date, end_date, limit))
+
+    def _daily_basic(self, ts_code=None, trade_date=None, start_date=None, end_date=None, limit=None, **kwargs):
+        df = self._daily(ts_code, trade_date, start_date, end_date, limit)
+        if df.empty:
+            return df
+        rng = np.random.default_rng(_seed('daily_basic', ts_code, trade_date, start_date))
+        size = len(df)
+        return pd.DataFrame({
+            'ts_code': df['ts_code'],
+            'trade_date': df['trade_date'],
+            'close': df['close'],
+            'turnover_rate': np.round(rng.uniform(0.1, 10, size), 4),
+            'pe': np.round(rng.uniform(5, 80, size), 4),
+            'pe_ttm': np.round(rng.uniform(5, 80, size), 4),
+            'pb': np.round(rng.uniform(0.5, 12, size), 4),
+            'ps': np.round(rng.uniform(0.5, 20, size), 4),
+            'dv_ratio': np.round(rng.uniform(0, 6, size), 4),
+            'total_share': np.round(rng.uniform(1e4, 1e6, size), 4),
+            'total_mv': np.round(rng.uniform(5e5, 2e8, size), 4),
+            'circ_mv': np.round(rng.uniform(5e5, 2e8, size), 4),
+        })
+
+    FINA_COLUMNS = ('roe', 'roe_dt', 'roa', 'grossprofit_margin', 'netprofit_margin', 'netprofit_yoy',
+                    'dt_netprofit_yoy', 'tr_yoy', 'or_yoy', 'op_income_yoy', 'assets_turn', 'inv_turn',
+                    'ar_turn', 'ca_turn', 'current_ratio', 'quick_ratio', 'debt_to_assets', 'debt_to_eqt',
+                    'ocf_to_or', 'ocf_to_opincome', 'ocf_yoy', 'eps', 'dt_eps', 'bps', 'ocfps', 'retainedps',
+                    'cfps', 'ebit_ps', 'fcff_ps', 'fcfe_ps', 'profit_dedt', 'total_revenue_ps')
+
+    def _report_periods(self, count: int) -> list:
+        """最近的count个已披露报告期，倒序"""
+        periods = []
+        year = self.today.year
+        for quarter_end in ['1231', '0930', '0630', '0331'] * (count // 4 + 2):
+            period = f"{year}{quarter_end}"
+            if quarter_end == '0331':
+                year -= 1
+            # 报告期结束两个月后才有数据
+            if datetime.strptime(period, '%Y%m%d') + timedelta(days=60) <= self.today:
+                periods.append(period)
+        return periods[:count]
+
+    def _fina_indicator(self, ts_code=None, period=None, start_date=None, end_date=None, limit=None, **kwargs):
+        if period:
+            # 与_report_periods一致，尚未披露的报告期没有数据
+            periods = [period] if datetime.strptime(period, '%Y%m%d') + timedelta(days=60) <= self.today else []
+        elif start_date:
+            periods = [end for end in self._report_periods(100) if end >= start_date]
+        else:
+            periods = self._report_periods(int(limit) if limit else 12)
+        frames = []
+        for code in self._codes(ts_code) or [to_ts_code(symbol) for symbol in self.symbols]:
+            rng = np.random.default_rng(_seed('fina', code))
+            scale = rng.uniform(0.5, 3, len(self.FINA_COLUMNS))
+            for end_date_ in periods:
+                noise = np.random.default_rng(_seed('fina', code, end_date_)).normal(1, 0.1, len(self.FINA_COLUMNS))
+                values = np.round(scale * noise * 10, 4)
+                ann_date = (datetime.strptime(end_date_, '%Y%m%d') + timedelta(days=30)).strftime('%Y%m%d')
+                frames.append({'ts_code': code, 'ann_date': ann_date, 'end_date': end_date_,
+                               **dict(zip(self.FINA_COLUMNS, values))})
+        return pd.DataFrame(frames)
+
+    def _fina_indicator_vip(self, period=None, **kwargs):
+        return self._fina_indicator(period=period, **kwargs)
+
+    def _disclosure_date(self, end_date=None, **kwargs):
+        """报告期结束30天后披露（与_fina_indicator的ann_date一致），未到日期的actual_date为空"""
+        ann_date = datetime.strptime(end_date, '%Y%m%d') + timedelta(days=30)
+        return pd.DataFrame({
+            'ts_code': [to_ts_code(symbol) for symbol in self.symbols],
+            'ann_date': ann_date.strftime('%Y%m%d'),
+            'end_date': end_date,
+            'pre_date': ann_date.strftime('%Y%m%d'),
+            'actual_date': ann_date.strftime('%Y%m%d') if ann_date <= self.today else None,
+        })
+
+    def _index_daily(self, ts_code=None, trade_date=None, start_date=None, end_date=None, limit=None, **kwargs):
+        return self._daily(ts_code, trade_date, start_date, end_date, limit)
+
+    def _trade_cal(self, exchange=None, start_date=None, end_date=None, **kwargs):
+        """自然日日历，工作日为交易日（与_trade_dates一致）"""
+        days = pd.date_range(start_date, end_date)
+        return pd.DataFrame({
+            'exchange': exchange or 'SSE',
+            'cal_date': days.strftime('%Y%m%d'),
+            'is_open': (days.weekday < 5).astype(int)
+        })
+
+    def _stock_basic(self, **kwargs):
+        rows = []
+        for i, symbol in enumerate(self.symbols):
+            rows.append({
+                'ts_code': to_ts_code(symbol),
+                'symbol': symbol,
+                'name': f"测试股份{i:04d}",
+                'area': PROVINCES[i % len(PROVINCES)],
+                'industry': INDUSTRIES[i % len(INDUSTRIES)],
+                'list_date': f"{2000 + i % 20}0101",
+            })
+        return pd.DataFrame(rows)
+
+    def _stock_company(self, ts_code=None, **kwargs):
+        return pd.DataFrame([{
+            'ts_code': code, 'com_name': f"{code}测试股份有限公司", 'chairman': '张三', 'manager': '李四',
+            'secretary': '王五', 'reg_capital': 100000.0, 'setup_date': '19990101', 'province': '上海',
+            'city': '上海市', 'introduction': '公司主要从事测试业务。' * 20, 'website': 'www.example.com',
+            'email': 'ir@example.com', 'office': '上海市浦东新区', 'employees': 5000,
+            'main_business': '测试业务', 'business_scope': '测试、咨询。' * 10
+        } for code in self._codes(ts_code)])
+
+    def _top10_holders(self, ts_code=None, **kwargs):
+        period = self._report_periods(1)[0]
+        return pd.DataFrame([{
+            'ts_code': ts_code, 'ann_date': period, 'end_date': period, 'holder_name': f"股东{i + 1}",
+            'hold_amount': float(1e8 / (i + 1)), 'hold_ratio': round(30.0 / (i + 1), 2), 'hold_change': 0.0
+        } for i in range(10)])
+
+
+def _analysis_text(messages) -> str:
+    """返回同时满足三类分析格式的JSON文本"""
+    section = {"summary": "合成的分析结论", "details": "合成的分析内容。" * 20}
+    result = {
+        "investment_suggestion": {"summary": "持有", "reasons": ["估值合理"]},
+        "analysis": {"valuation_analysis": "估值合理", "financial_health": "稳健"},
+        "price_analysis": {"reasonable_price_range": {"min": 10.0, "max": 20.0},
+                           "target_market_value": {"min": 100.0, "max": 200.0}},
+        "tao_philosophy": section, "business_ethics": section, "investment_advice": section,
+        "buffett_analysis": section, "graham_analysis": section, "lin_yuan_analysis": section,
+        "li_daxiao_analysis": section, "duan_yongping_analysis": section,
+    }
+    return json.dumps(result, ensure_ascii=False)
+
+
+class FakeLLMClient(FakeUpstream):
+    """openai客户端的替身：ai_service.client = FakeLLMClient(...)，stream=True时分段返回"""
+
+    def __init__(self, chunk_size: int = 40, **kwargs):
+        super().__init__(**kwargs)
+        self.chunk_size = chunk_size
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, model: str, messages: list, stream: bool = False, **kwargs):
+        self._enter('chat.completions', "Error code: 429 - 请求过于频繁，请稍后再试")
+        text = _analysis_text(messages)
+        if not stream:
+            return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=text))])
+        return self._stream(text)
+
+    def _stream(self, text: str):
+        for i in range(0, len(text), self.chunk_size):
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=text[i:i + self.chunk_size]))])
@@ -0,0 +1,101 @@
+"""
+/api/index_info 并发延迟压测
+
+在若干个AI大咖分析请求（模拟30秒级的LLM调用）执行期间，持续并发请求/api/index_info，
+对比空闲时与AI分析进行中的延迟分布。阻塞调用都在线程池中执行时，两组延迟应基本持平。
+
+上游调用全部替换为本地的sleep，不需要tushare token和大模型API。
+用法（先安装压测依赖：pip install -r benchmarks/requirements.txt）：
+    python benchmarks/load_index_info.py --ai-requests 8 --ai-latency 5 --index-clients 20
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+from app import app
+from app.api import stock_routes
+
+
+def install_fake_upstreams(index_latency: float, ai_latency: float):
+    """把路由使用的服务方法替换为只sleep的同步实现，模拟阻塞的上游调用"""
+    def get_index_info():
+        time.sleep(index_latency)
+        return [{"code": "000001.SH", "name": "上证指数", "price": 3000.0, "change": 0.5, "kline_data": []}]
+
+    def get_company_detail(stock_code):
+        time.sleep(index_latency)
+        return {"basic_info": {"code": stock_code, "name": stock_code}, "financial_info": {}}
+
+    def get_value_analysis_data(stock_code):
+        time.sleep(index_latency)
+        return {"stock_info": {"code": stock_code}}
+
+    def analyze_by_masters(company_info, value_analysis, force_refresh=False):
+        time.sleep(ai_latency)
+        return {"buffett_analysis": "-"}
+
+    stock_routes.stock_service.get_index_info = get_index_info
+    stock_routes.stock_service.get_company_detail = get_company_detail
+    stock_routes.stock_service.get_value_analysis_data = get_value_analysis_data
+    stock_routes.ai_service.analyze_by_masters = analyze_by_masters
+
+
+async def measure_index_info(client, clients: int, rounds: int):
+    """clients个并发客户端各请求rounds次，返回每次请求的耗时（毫秒）"""
+    latencies = []
+
+    async def worker():
+        for _ in range(rounds):
+            start = time.perf_counter()
+            response = await client.get("/api/index_info")
+            response.raise_for_status()
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    await asyncio.gather(*(worker() for _ in range(clients)))
+    return latencies
+
+
+def summarize(label: str, latencies: list):
+    latencies = sorted(latencies)
+    p50 = statistics.median(latencies)
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    print(f"{label}: 请求数={len(latencies)} p50={p50:.1f}ms p99={p99:.1f}ms max={latencies[-1]:.1f}ms")
+    return p50, p99
+
+
+async def main(args):
+    install_fake_upstreams(args.index_latency, args.ai_latency)
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=None) as client:
+        idle = await measure_index_info(client, args.index_clients, args.rounds)
+        base_p50, base_p99 = summarize("空闲时 /api/index_info", idle)
+
+        ai_tasks = [asyncio.create_task(client.get(f"/api/master_analysis/{600000 + i}"))
+                    for i in range(args.ai_requests)]
+        await asyncio.sleep(0.1)  # 确保AI请求已进入线程池
+        busy = await measure_index_info(client, args.index_clients, args.rounds)
+        busy_p50, busy_p99 = summarize(f"{args.ai_requests}个AI分析进行中 /api/index_info", busy)
+        ai_running = sum(not task.done() for task in ai_tasks)
+        await asyncio.gather(*ai_tasks)
+
+    print(f"测量结束时仍在执行的AI分析: {ai_running}/{args.ai_requests}")
+    ok = busy_p99 < max(base_p99 * args.tolerance, base_p99 + 50)
+    print("结论: " + ("延迟保持平稳" if ok else "AI分析期间延迟明显上升"))
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="/api/index_info 并发延迟压测")
+    parser.add_argument("--ai-requests", type=int, default=8, help="并发的AI分析请求数")
+    parser.add_argument("--ai-latency", type=float, default=5.0, help="模拟的LLM调用耗时（秒）")
+    parser.add_argument("--index-latency", type=float, default=0.02, help="模拟的tushare调用耗时（秒）")
+    parser.add_argument("--index-clients", type=int, default=20, help="并发请求index_info的客户端数")
+    parser.add_argument("--rounds", type=int, default=10, help="每个客户端的请求次数")
+    parser.add_argument("--tolerance", type=float, default=2.0, help="允许的p99放大倍数")
+    sys.exit(asyncio.run(main(parser.parse_args())))
@@ -0,0 +1,253 @@
+"""
+离线压测：tushare和大模型替换为本地替身（benchmarks/fakes.py），不需要token和网络
+
+对每个监控列表规模（默认10、100、1000只）在独立的临时缓存目录中运行两轮：
+- cold：缓存为空，模拟首次打开首页、详情页和AI分析
+- warm：同样的请求再来一遍，应基本命中缓存
+每轮由若干并发客户端请求FastAPI应用，报告各接口的p50/p99延迟和错误数、上游调用次数和缓存写入量，
+可用--json保存结果，部署前与上一次的结果对比。
+
+用法（先安装压测依赖：pip install -r benchmarks/requirements.txt）：
+    python benchmarks/offline_suite.py --sizes 10,100,1000 --clients 20 --tushare-latency 0.02 --llm-latency 0.5
+    python benchmarks/offline_suite.py --sizes 100 --tushare-error-rate 0.02 --tushare-rate-limit 500
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+from app import app, pro
+from app.api import stock_routes
+from app.config import Config
+from app.services.cache_store import CacheStore
+from app.services.bar_store import BarStore
+from app.services.fina_history import FinaHistory
+from app.services.fina_store import FinaStore
+from app.services.symbol_table import SymbolTable
+from app.services.trading_calendar import TradingCalendar
+from benchmarks.fakes import FakeTushareApi, FakeLLMClient, make_symbols
+
+
+class WriteCounter:
+    """统计缓存库和AI分析缓存文件的写入条数和字节数"""
+
+    def __init__(self):
+        self.rows = defaultdict(int)
+        self.bytes = defaultdict(int)
+
+    def wrap_cache_store(self, store: CacheStore):
+        put_many = store.put_many
+
+        def counted_put_many(namespace, items, timestamp, expires_at=None):
+            put_many(namespace, items, timestamp, expires_at)
+            self.rows[f"sqlite:{namespace}"] += len(items)
+            self.bytes[f"sqlite:{namespace}"] += sum(len(json.dumps(data, ensure_ascii=False).encode('utf-8'))
+                                                     for data in items.values())
+        store.put_many = counted_put_many
+
+    def wrap_ai_cache(self, ai_service):
+        save_cache = ai_service.save_cache
+
+        def counted_save_cache(kind, stock_code, analysis_result, *payloads):
+            save_cache(kind, stock_code, analysis_result, *payloads)
+            path = ai_service.get_cache_path(kind, stock_code, ai_service.input_hash(kind, *payloads))
+            self.rows[f"ai:{kind}"] += 1
+            self.bytes[f"ai:{kind}"] += os.path.getsize(path) if os.path.exists(path) else 0
+        ai_service.save_cache = counted_save_cache
+
+    def snapshot(self) -> dict:
+        return {name: {"rows": self.rows[name], "bytes": self.bytes[name]} for name in sorted(self.rows)}
+
+    def reset(self):
+        self.rows.clear()
+        self.bytes.clear()
+
+
+def setup_environment(workdir: str, size: int, args, counter: WriteCounter):
+    """把服务的缓存指向临时目录，上游替换为替身，监控列表设为size只股票"""
+    symbols = make_symbols(size)
+    tushare = FakeTushareApi(symbols, latency=args.tushare_latency, error_rate=args.tushare_error_rate,
+                             rate_limit=args.tushare_rate_limit, seed=args.seed)
+    llm = FakeLLMClient(latency=args.llm_latency, error_rate=args.llm_error_rate,
+                        rate_limit=args.llm_rate_limit, seed=args.seed)
+
+    # 客户端限流按替身的上限配置，未配置时不限
+    Config.TUSHARE_DEFAULT_RATE_LIMIT = args.client_rate_limit
+    Config.TUSHARE_BURST = max(Config.TUSHARE_BURST, args.clients)
+    pro._api = tushare
+    pro._buckets.clear()
+    pro._metrics.clear()
+
+    stock_service = stock_routes.stock_service
+    stock_service.cache_store = CacheStore(os.path.join(workdir, "stock_cache.db"))
+    stock_service.symbols = SymbolTable(file_path=os.path.join(workdir, "stock_basic.csv"))
+    stock_service.symbols.refresh()
+    stock_service._index_snapshot = None
+    stock_service._index_expires_at = 0
+    stock_service._save_watchlist = lambda: None
+    stock_service.watchlist = {symbol: {"target_market_value": {"min": None, "max": None}} for symbol in symbols}
+    # 交易日历、日线库和财务数据也指向临时目录（财务数据与缓存库共用）
+    stock_service.calendar = TradingCalendar(file_path=os.path.join(workdir, "trade_cal.json"))
+    stock_service.session.calendar = stock_service.calendar
+    stock_service.bars = BarStore(os.path.join(workdir, "bars"), stock_service.session)
+    stock_service.fina_store = FinaStore(stock_service.cache_store, stock_service.session)
+    stock_service.fina_history = FinaHistory(stock_service.cache_store, stock_service.fina_store, stock_service.session)
+    counter.wrap_cache_store(stock_service.cache_store)
+
+    ai_service = stock_routes.ai_service
+    ai_service.client = llm
+    ai_service.cache_dirs = {kind: os.path.join(workdir, directory)
+                             for kind, (directory, _) in ai_service.CACHE_TYPES.items()}
+    for directory in ai_service.cache_dirs.values():
+        os.makedirs(directory, exist_ok=True)
+    ai_service.__dict__.pop('save_cache', None)
+    counter.wrap_ai_cache(ai_service)
+    return symbols, tushare, llm
+
+
+def build_requests(symbols: list, args) -> list:
+    """一轮的请求：首页（监控列表、批量行情、指数），部分股票的详情页和AI分析"""
+    rng = random.Random(args.seed)
+    requests = [("watchlist", "/api/watchlist"), ("stock_info_batch", "/api/stock_info/batch")]
+    requests += [("index_info", "/api/index_info")] * args.clients
+    for symbol in rng.sample(symbols, min(len(symbols), args.detail_sample)):
+        requests += [
+            ("stock_info", f"/api/stock_info/{symbol}"),
+            ("company_detail", f"/api/company_detail/{symbol}"),
+            ("value_analysis", f"/api/value_analysis/{symbol}"),
+            ("holders", f"/api/holders/{symbol}"),
+        ]
+    for symbol in rng.sample(symbols, min(len(symbols), args.ai_sample)):
+        requests += [
+            ("ai_analysis", f"/api/ai_analysis/{symbol}"),
+            ("tao_analysis", f"/api/tao_analysis/{symbol}"),
+            ("master_analysis", f"/api/master_analysis/{symbol}"),
+        ]
+    rng.shuffle(requests)
+    # 首页总是先于其他请求打开
+    requests.sort(key=lambda item: item[0] not in ("watchlist", "stock_info_batch"))
+    return requests
+
+
+async def run_round(client, requests: list, clients: int) -> dict:
+    """clients个并发客户端依次取请求执行，返回{接口: {"latencies": [...], "errors": n}}"""
+    queue = asyncio.Queue()
+    for item in requests:
+        queue.put_nowait(item)
+    results = defaultdict(lambda: {"latencies": [], "errors": 0})
+
+    async def worker():
+        while not queue.empty():
+            name, url = queue.get_nowait()
+            start = time.perf_counter()
+            try:
+                response = await client.get(url)
+                body = response.json()
+                failed = response.status_code != 200 or (isinstance(body, dict) and "error" in body)
+            except Exception:
+                failed = True
+            results[name]["latencies"].append((time.perf_counter() - start) * 1000)
+            results[name]["errors"] += failed
+
+    await asyncio.gather(*(worker() for _ in range(clients)))
+    return results
+
+
+def percentile(values: list, q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+def summarize(results: dict) -> dict:
+    return {
+        name: {
+            "count": len(entry["latencies"]),
+            "errors": entry["errors"],
+            "p50_ms": round(statistics.median(entry["latencies"]), 1),
+            "p99_ms": round(percentile(entry["latencies"], 0.99), 1),
+            "max_ms": round(max(entry["latencies"]), 1)
+        }
+        for name, entry in sorted(results.items())
+    }
+
+
+def print_report(size: int, phase: str, elapsed: float, latency: dict, upstream: dict, writes: dict):
+    print(f"\n=== 监控列表 {size} 只 / {phase}  用时 {elapsed:.2f}s")
+    print(f"{'接口':<18}{'请求数':>8}{'错误':>6}{'p50(ms)':>10}{'p99(ms)':>10}{'max(ms)':>10}")
+    for name, row in latency.items():
+        print(f"{name:<18}{row['count']:>8}{row['errors']:>6}{row['p50_ms']:>10}{row['p99_ms']:>10}{row['max_ms']:>10}")
+    calls = ", ".join(f"{name}={row['calls']}"
+                      + (f"(错误{row['errors']},限流{row['rate_limited']})" if row['errors'] or row['rate_limited'] else "")
+                      for name, row in upstream.items())
+    print(f"上游调用: {calls or '无'}")
+    total_rows = sum(row["rows"] for row in writes.values())
+    total_bytes = sum(row["bytes"] for row in writes.values())
+    print(f"缓存写入: {total_rows} 条 / {total_bytes / 1024:.1f} KB  "
+          + ", ".join(f"{name}={row['rows']}条/{row['bytes'] / 1024:.1f}KB" for name, row in writes.items()))
+
+
+async def run_size(size: int, args) -> dict:
+    workdir = tempfile.mkdtemp(prefix=f"bench_{size}_")
+    counter = WriteCounter()
+    try:
+        symbols, tushare, llm = setup_environment(workdir, size, args, counter)
+        requests = build_requests(symbols, args)
+        report = {}
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            for phase in ("cold", "warm"):
+                tushare.reset_stats()
+                llm.reset_stats()
+                counter.reset()
+                start = time.perf_counter()
+                results = await run_round(client, requests, args.clients)
+                elapsed = time.perf_counter() - start
+                upstream = {**{f"tushare.{name}": row for name, row in tushare.stats().items()},
+                            **{f"llm.{name}": row for name, row in llm.stats().items()}}
+                latency = summarize(results)
+                writes = counter.snapshot()
+                print_report(size, phase, elapsed, latency, upstream, writes)
+                report[phase] = {"elapsed_s": round(elapsed, 3), "latency": latency,
+                                 "upstream_calls": upstream, "cache_writes": writes}
+        return report
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+async def main(args):
+    report = {"args": vars(args), "sizes": {}}
+    for size in args.sizes:
+        report["sizes"][str(size)] = await run_size(size, args)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\n结果已保存到 {args.json}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="离线压测（本地tushare和大模型替身）")
+    parser.add_argument("--sizes", type=lambda value: [int(size) for size in value.split(',')], default=[10, 100, 1000],
+                        help="监控列表规模，逗号分隔")
+    parser.add_argument("--clients", type=int, default=20, help="并发客户端数")
+    parser.add_argument("--detail-sample", type=int, default=50, help="每轮打开详情页的股票数")
+    parser.add_argument("--ai-sample", type=int, default=5, help="每轮请求AI分析的股票数")
+    parser.add_argument("--tushare-latency", type=float, default=0.02, help="tushare替身的单次延迟（秒）")
+    parser.add_argument("--tushare-error-rate", type=float, default=0.0, help="tushare替身的随机错误率")
+    parser.add_argument("--tushare-rate-limit", type=int, default=0, help="tushare替身每个接口每分钟的调用上限，0为不限")
+    parser.add_argument("--client-rate-limit", type=int, default=100000, help="TushareClient的每分钟限流速率")
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="大模型替身的单次延迟（秒）")
+    parser.add_argument("--llm-error-rate", type=float, default=0.0, help="大模型替身的随机错误率")
+    parser.add_argument("--llm-rate-limit", type=int, default=0, help="大模型替身每分钟的调用上限，0为不限")
+    parser.add_argument("--seed", type=int, default=1, help="随机种子，相同参数的两次运行请求序列相同")
+    parser.add_argument("--json", help="把结果保存为JSON文件")
+    asyncio.run(main(parser.parse_args()))